@@ -1,5 +1,11 @@
 #!/usr/bin/env python3
-import json
+import os
+import sys
+import itertools
+
+# json_stream lives at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_stream import iter_items, write_items
 
 # Paths to your JSON files.
 json_file1 = 'JSONs/individual_assessment.json'
@@ -7,29 +13,24 @@ json_file2 = 'JSONs/pre-package.json'
 merged_output_file = 'JSONs/final.json'
 
 def load_json(file_path):
+    """Yields the objects in a JSON file one at a time."""
     try:
-        with open(file_path, 'r') as f:
-            return json.load(f)
+        yield from iter_items(file_path)
     except Exception as e:
         print(f"Error reading {file_path}: {e}")
-        return []
 
 def save_json(data, file_path):
     try:
-        with open(file_path, 'w') as f:
-            json.dump(data, f, indent=4)
-        print(f"Data successfully saved to {file_path}")
+        count = write_items(file_path, data)
+        print(f"Data successfully saved to {file_path} ({count} records)")
     except Exception as e:
         print(f"Error writing to {file_path}: {e}")
 
 def main():
-    # Load data from both JSON files.
-    data1 = load_json(json_file1)
-    data2 = load_json(json_file2)
-    
-    # Merge the lists. If both JSON files contain a list of objects.
-    merged_data = data1 + data2
-    
+    # Stream both JSON files (lists of objects) into the merged file one object at a
+    # time, so neither is ever held in memory whole.
+    merged_data = itertools.chain(load_json(json_file1), load_json(json_file2))
+
     # Write the merged data out to a new JSON file.
     save_json(merged_data, merged_output_file)
 
@@ -1,24 +1,30 @@
 #!/usr/bin/env python3
-import requests
-from bs4 import BeautifulSoup
 import csv
+from crawler import Crawler
+from extract import parse_html, PRODUCT_PAGE
 from tqdm import tqdm
 
 # === CONFIGURATION ===
 INPUT_FILE      = 'individual_assessment_Cat.txt'     # path to your input list of full URLs (one per line)
 OUTPUT_FILE     = 'Cat2.csv'   # path to the output CSV
 
-def scrape_product_page(page_url):
+def scrape_product_page(page_url, crawler=None):
     """
     Given a product page URL, returns a dict with
     Product, Description, Job Level, Language, Assessment Length.
     """
-    resp = requests.get(page_url)
-    resp.raise_for_status()
-    soup = BeautifulSoup(resp.text, 'html.parser')
+    return parse_product_page((crawler or Crawler()).fetch(page_url), page_url)
+
+def parse_product_page(html, page_url):
+    """
+    Extracts the fields returned by `scrape_product_page` from a fetched page.
+    """
+    # Only the title and the info rows are parsed (see extract.py).
+    soup = parse_html(html, PRODUCT_PAGE)
+    title = soup.find('h1')
 
     # 1) Product title
-    product = soup.find('h1').get_text(strip=True) if soup.find('h1') else ''
+    product = title.get_text(strip=True) if title else ''
 
     # 2) Initialize fields
     description = job_levels = languages = assessment_length = ''
@@ -56,14 +62,15 @@ def main():
         pages = [line.strip() for line in f if line.strip()]
 
     records = []
+    # Pages are fetched concurrently (see crawler.py); results arrive in page order.
     # Wrap the loop in tqdm for a progress bar
-    for page in tqdm(pages, desc="Scraping pages", unit="page"):
-        print(f"\n→ Scraping {page}")
-        try:
-            rec = scrape_product_page(page)
-            records.append(rec)
-        except Exception as e:
-            print(f"   ERROR on {page}: {e}")
+    results = Crawler().crawl(pages, parse_product_page)
+    for page, rec, error in tqdm(results, total=len(pages), desc="Scraping pages", unit="page"):
+        print(f"\n→ Scraped {page}")
+        if error:
+            print(f"   ERROR on {page}: {error}")
+            continue
+        records.append(rec)
 
     # 2) Write out CSV
     fieldnames = ['Product', 'Description', 'Job Level', 'Language', 'Assessment Length']
@@ -0,0 +1,416 @@
+"""
+Shared crawler engine for the scrapers.
+
+Every request goes through one requests.Session whose connection pool keeps a
+connection alive per worker, so pages on the same host reuse connections instead of
+paying a new TCP and TLS handshake each. Pages are fetched on a thread pool, and
+politeness is enforced per host rather than by sleeping between pages. Each host
+gets an adaptive throttle (HostThrottle) that raises its concurrency and request rate
+while responses are fast and healthy, and cuts them on 429/503, errors or rising
+latency, honouring Retry-After. CRAWL_PER_HOST (requests in flight) and
+CRAWL_MIN_INTERVAL (seconds between request starts) are the ceilings it never exceeds.
+Their defaults (2 in flight, 0.2 s) keep a host at the old scrapers' pace: they fetched
+one page at a time with a 0.2 s pause, so at most 5 request starts per second. Raise
+them only for a site known to allow more.
+While a crawl runs, the live request rate and error rate per host are printed every
+CRAWL_STATUS_SECONDS. Responses are kept in an on-disk cache and revalidated with
+conditional GETs on the next crawl (see http_cache.py).
+
+    crawler = Crawler()
+    for url, rows, error in crawler.crawl(urls, parse_table_data):
+        ...
+
+`crawl` fetches each URL, runs `parse(html, url)` in a pool of parser processes fed by
+a bounded queue, and yields (url, result, error) in input order (or as each page is
+ready, with ordered=False); `error` is the exception if the fetch or the parse failed.
+`fetch(url)` fetches a single page under the same limits.
+"""
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from collections import deque
+from urllib.parse import urlsplit
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from http_cache import HTTPCache
+
+USER_AGENT = "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; Trident/6.0)"
+HEADERS = {"User-Agent": USER_AGENT}
+
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "16"))   # worker threads in total
+CRAWL_PER_HOST = int(os.getenv("CRAWL_PER_HOST", "2"))          # most requests in flight per host
+CRAWL_MIN_INTERVAL = float(os.getenv("CRAWL_MIN_INTERVAL", "0.2"))  # shortest gap between request starts per host
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "30"))
+CRAWL_RETRIES = int(os.getenv("CRAWL_RETRIES", "3"))            # for connection errors and 429/5xx
+
+# Adaptive throttling (AIMD). A host starts at CRAWL_START_CONCURRENCY requests in flight
+# and CRAWL_START_RATE requests per second. Healthy responses add about one request in
+# flight per round of responses and CRAWL_RATE_STEP requests/s per second, up to the
+# limits above; a 429/503, an error or a latency above CRAWL_LATENCY_FACTOR x the
+# host's baseline multiplies both by CRAWL_BACKOFF, at most once per round trip.
+CRAWL_START_CONCURRENCY = int(os.getenv("CRAWL_START_CONCURRENCY", "1"))
+CRAWL_START_RATE = float(os.getenv("CRAWL_START_RATE", "2"))
+CRAWL_MIN_RATE = float(os.getenv("CRAWL_MIN_RATE", "0.2"))
+CRAWL_RATE_STEP = float(os.getenv("CRAWL_RATE_STEP", "2"))
+CRAWL_BACKOFF = float(os.getenv("CRAWL_BACKOFF", "0.5"))
+CRAWL_LATENCY_FACTOR = float(os.getenv("CRAWL_LATENCY_FACTOR", "2"))
+CRAWL_MAX_RETRY_AFTER = float(os.getenv("CRAWL_MAX_RETRY_AFTER", "300"))
+# Processes that parse fetched pages, one per core, and how many fetched pages may wait
+# for them. 0 parses on the fetching threads, the default on a single core, where a
+# separate process only adds overhead.
+CPU_COUNT = os.cpu_count() or 1
+CRAWL_PARSE_WORKERS = int(os.getenv("CRAWL_PARSE_WORKERS", str(CPU_COUNT if CPU_COUNT > 1 else 0)))
+CRAWL_PARSE_QUEUE = int(os.getenv("CRAWL_PARSE_QUEUE", "32"))
+# Seconds between live status lines during a crawl; 0 turns them off.
+CRAWL_STATUS_SECONDS = float(os.getenv("CRAWL_STATUS_SECONDS", "5"))
+
+THROTTLE_STATUSES = (429, 503)
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Smoothing of the latency average, and the window the live rates are measured over.
+LATENCY_SMOOTHING = 0.3
+STATS_WINDOW = 10.0
+_DONE = object()
+
+
+def retry_after_seconds(value):
+    """
+    Seconds to wait from a Retry-After header (delay-seconds or an HTTP date), or None.
+    """
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(CRAWL_MAX_RETRY_AFTER, max(0.0, seconds))
+
+
+class HostThrottle:
+    """
+    Adaptive per-host politeness: an AIMD controller over the number of requests in
+    flight and the request rate.
+
+    `acquire()` blocks until a request fits under both, `release(status, latency)`
+    reports how it went. Fast, successful responses raise the limits additively;
+    throttling (429/503), errors and latency well above the host's baseline cut them
+    multiplicatively, and a Retry-After pauses the host for as long as it asks. The
+    crawl settles just under whatever the site tolerates.
+    """
+
+    def __init__(self, max_concurrency=CRAWL_PER_HOST, min_interval=CRAWL_MIN_INTERVAL,
+                 start_concurrency=CRAWL_START_CONCURRENCY, start_rate=CRAWL_START_RATE):
+        self.max_concurrency = max_concurrency
+        self.max_rate = 1.0 / min_interval if min_interval > 0 else float("inf")
+        self.concurrency = float(max(1, min(start_concurrency, max_concurrency)))
+        self.rate = min(start_rate, self.max_rate)
+        self.in_flight = 0
+        self.latency = None
+        self.base_latency = None
+        self.decreases = 0
+        self._outcomes = deque()  # (finished at, succeeded) within STATS_WINDOW
+        self._next_start = 0.0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        with self._condition:
+            while self.in_flight >= int(self.concurrency):
+                self._condition.wait()
+            self.in_flight += 1
+            now = time.monotonic()
+            start = max(now, self._next_start, self._paused_until)
+            self._next_start = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def release(self, status, latency, retry_after=None):
+        """
+        Records a finished request: its HTTP status (None for a connection error or
+        timeout), its latency in seconds and any Retry-After.
+        """
+        now = time.monotonic()
+        with self._condition:
+            self.in_flight -= 1
+            failed = status is None or status in THROTTLE_STATUSES or status >= 500
+            self._outcomes.append((now, not failed))
+            while self._outcomes and now - self._outcomes[0][0] > STATS_WINDOW:
+                self._outcomes.popleft()
+
+            if failed:
+                if retry_after is not None:
+                    self._paused_until = max(self._paused_until, now + retry_after)
+                self._decrease(now)
+            else:
+                self.latency = latency if self.latency is None else (
+                    LATENCY_SMOOTHING * latency + (1 - LATENCY_SMOOTHING) * self.latency)
+                if self.base_latency is None or self.latency < self.base_latency:
+                    self.base_latency = self.latency
+                else:
+                    # Let the baseline follow a site that is lastingly slower.
+                    self.base_latency += (self.latency - self.base_latency) * 0.01
+                if self.latency > self.base_latency * CRAWL_LATENCY_FACTOR:
+                    self._decrease(now)
+                else:
+                    self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+                    self.rate = min(self.max_rate, self.rate + CRAWL_RATE_STEP / self.rate)
+            self._condition.notify_all()
+
+    def _decrease(self, now):
+        # Responses already in flight report the same overload; one cut per round trip.
+        if now - self._last_decrease < (self.latency or 1.0):
+            return
+        self._last_decrease = now
+        self.decreases += 1
+        self.concurrency = max(1.0, self.concurrency * CRAWL_BACKOFF)
+        self.rate = max(CRAWL_MIN_RATE, min(self.rate, self.max_rate) * CRAWL_BACKOFF)
+
+    def stats(self):
+        """
+        Current limits, plus the completed-request rate and error rate over the last
+        STATS_WINDOW seconds.
+        """
+        with self._condition:
+            now = time.monotonic()
+            outcomes = [ok for finished, ok in self._outcomes if now - finished <= STATS_WINDOW]
+            span = min(STATS_WINDOW, now - self._outcomes[0][0]) if self._outcomes else 0.0
+            return {
+                "rate": len(outcomes) / span if span > 0 else 0.0,
+                "error_rate": outcomes.count(False) / len(outcomes) if outcomes else 0.0,
+                "rate_limit": self.rate,
+                "concurrency": int(self.concurrency),
+                "in_flight": self.in_flight,
+                "paused": max(0.0, self._paused_until - now),
+            }
+
+
+def create_session(pool_size=CRAWL_CONCURRENCY):
+    """
+    A Session with a connection pool of `pool_size` per host. Retries are left to the
+    Crawler, so each attempt is seen by the host's throttle.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class Crawler:
+
+    def __init__(self, concurrency=CRAWL_CONCURRENCY, per_host=CRAWL_PER_HOST, min_interval=CRAWL_MIN_INTERVAL,
+                 timeout=CRAWL_TIMEOUT, retries=CRAWL_RETRIES, headers=HEADERS, session=None,
+                 status_seconds=CRAWL_STATUS_SECONDS, cache=None, parse_workers=CRAWL_PARSE_WORKERS,
+                 parse_queue=CRAWL_PARSE_QUEUE):
+        self.concurrency = concurrency
+        self.per_host = per_host
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.retries = retries
+        self.headers = headers
+        self.status_seconds = status_seconds
+        self.parse_workers = parse_workers
+        self.parse_queue = parse_queue
+        self.session = session or create_session(max(concurrency, per_host))
+        # None: as CRAWL_CACHE says (see http_cache.py); False: no cache.
+        self.cache = HTTPCache.from_env() if cache is None else cache or None
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def host_throttle(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            throttle = self._hosts.get(host)
+            if throttle is None:
+                throttle = self._hosts[host] = HostThrottle(self.per_host, self.min_interval)
+            return throttle
+
+    def fetch(self, url):
+        """
+        Returns the body of `url` as text, retrying connection errors and 429/5xx
+        responses. A cached page is revalidated with a conditional GET, or served
+        straight from the cache in offline mode. Raises requests.RequestException on
+        failure.
+        """
+        entry = self.cache.lookup(url) if self.cache else None
+        if self.cache and self.cache.offline:
+            return self.cache.cached(url, entry)
+        headers = dict(self.headers, **HTTPCache.conditional_headers(entry)) if entry else self.headers
+
+        throttle = self.host_throttle(url)
+        for attempt in range(self.retries + 1):
+            throttle.acquire()
+            started = time.monotonic()
+            status, retry_after = None, None
+            try:
+                response = self.session.get(url, headers=headers, timeout=self.timeout)
+                status = response.status_code
+                retry_after = retry_after_seconds(response.headers.get("Retry-After"))
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+                continue
+            finally:
+                throttle.release(status, time.monotonic() - started, retry_after)
+            if status in RETRY_STATUSES and attempt < self.retries:
+                continue
+            if status == 304 and entry:
+                return self.cache.revalidated(url, entry)
+            response.raise_for_status()
+            return self.cache.store(url, response) if self.cache else response.text
+
+    def status(self):
+        """
+        One line per host: live request rate, error rate and the throttle's limits.
+        """
+        with self._lock:
+            hosts = list(self._hosts.items())
+        lines = []
+        for host, throttle in hosts:
+            stats = throttle.stats()
+            line = (f"→ {host}: {stats['rate']:.1f} req/s, {stats['error_rate']:.0%} errors "
+                    f"(limit {stats['rate_limit']:.1f} req/s, {stats['in_flight']}/{stats['concurrency']} in flight)")
+            if stats["paused"]:
+                line += f", paused {stats['paused']:.0f}s for Retry-After"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def _report_status(self, stop):
+        while not stop.wait(self.status_seconds):
+            status = self.status()
+            if status:
+                print(status, flush=True)
+
+    def crawl(self, urls, parse, ordered=True):
+        """
+        Yields (url, parse(html, url), error) for each of `urls`; `error` is the
+        exception if the fetch or the parse failed.
+
+        Pages are fetched on the thread pool and handed through a bounded queue
+        (CRAWL_PARSE_QUEUE pages) to CRAWL_PARSE_WORKERS processes that parse them, so
+        parsing uses every core rather than competing with the fetches for the GIL, and
+        a slow parse stage holds fetching back instead of piling pages up in memory.
+        With no parse workers, pages are parsed on the fetching threads. Results come
+        in input order, or as soon as each is ready with ordered=False. `parse` must be
+        a module-level function so it can be sent to the parse processes.
+        """
+        fetch_pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        parse_pool = None
+        if self.parse_workers > 0:
+            parse_pool = ProcessPoolExecutor(self.parse_workers, mp_context=multiprocessing.get_context("spawn"))
+        parse_queue = queue.Queue(maxsize=self.parse_queue)
+        finished = queue.Queue()
+        stop = threading.Event()
+
+        def fetch_stage(index, url):
+            try:
+                html = self.fetch(url)
+                if parse_pool is None:
+                    finished.put((index, url, parse(html, url), None))
+                    return
+            except Exception as e:
+                finished.put((index, url, None, e))
+                return
+            # Blocks while the parse stage is behind.
+            parse_queue.put((index, url, html))
+
+        def parse_stage():
+            # Pages handed to the process pool at once; the rest wait in parse_queue.
+            slots = threading.BoundedSemaphore(2 * self.parse_workers)
+            while True:
+                item = parse_queue.get()
+                if item is _DONE:
+                    return
+                if stop.is_set():
+                    continue
+                index, url, html = item
+
+                def parsed(future, index=index, url=url):
+                    slots.release()
+                    if not future.cancelled():
+                        error = future.exception()
+                        finished.put((index, url, None if error else future.result(), error))
+
+                slots.acquire()
+                try:
+                    parse_pool.submit(parse, html, url).add_done_callback(parsed)
+                except Exception as e:
+                    slots.release()
+                    finished.put((index, url, None, e))
+
+        def close():
+            fetch_pool.shutdown(wait=True)
+            parse_queue.put(_DONE)
+            parse_pool.shutdown(wait=True, cancel_futures=True)
+
+        if parse_pool is not None:
+            threading.Thread(target=parse_stage, name="crawl-parse", daemon=True).start()
+        if self.status_seconds > 0:
+            threading.Thread(target=self._report_status, args=(stop,), daemon=True).start()
+        # Pages in the pipeline (fetching, queued, parsing or waiting to be yielded).
+        window = threading.Semaphore(2 * self.concurrency + self.parse_queue + 2 * self.parse_workers)
+
+        def feed():
+            # Reads `urls` on its own thread, so a lazily produced input (such as the
+            # output of another crawl) never holds back pages that are already done.
+            count, error = 0, None
+            try:
+                for url in urls:
+                    while not window.acquire(timeout=0.5):
+                        if stop.is_set():
+                            return
+                    if stop.is_set():
+                        return
+                    fetch_pool.submit(fetch_stage, count, url)
+                    count += 1
+            except Exception as e:
+                error = e
+            finally:
+                finished.put((_DONE, None, count, error))
+
+        threading.Thread(target=feed, name="crawl-feed", daemon=True).start()
+        completed = False
+        try:
+            total = None
+            yielded = 0
+            buffered = {}
+            while total is None or yielded < total:
+                index, url, result, error = finished.get()
+                if index is _DONE:
+                    if error is not None:
+                        raise error
+                    total = result
+                    continue
+                if not ordered:
+                    window.release()
+                    yielded += 1
+                    yield url, result, error
+                    continue
+                buffered[index] = (url, result, error)
+                while yielded in buffered:
+                    window.release()
+                    yield buffered.pop(yielded)
+                    yielded += 1
+            completed = True
+        finally:
+            stop.set()
+            if self.cache:
+                print(self.cache.summary())
+            # Reached early on a break or KeyboardInterrupt: drop what has not started,
+            # and let what is in flight wind down in the background.
+            fetch_pool.shutdown(wait=False, cancel_futures=True)
+            if parse_pool is not None:
+                if completed:
+                    close()
+                else:
+                    threading.Thread(target=close, daemon=True).start()
+
+    def close(self):
+        self.session.close()
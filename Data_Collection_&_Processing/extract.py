@@ -0,0 +1,91 @@
+"""
+Subtree-only HTML parsing for the scrapers.
+
+The scrapers need only small parts of each page. On listing pages that is the
+catalogue table; on product pages it is the training-calendar rows and the title
+(PRODUCT_PAGE keeps both from a single parse).
+`parse_html(html, only)` builds a BeautifulSoup tree of just the elements the
+strainer `only` matches, with their contents. It skips building the navigation,
+scripts and footer that make up most of a page. The scrapers' find/find_all code runs
+on that small tree unchanged.
+
+    soup = parse_html(html, CALENDAR_ROWS)
+    for row in soup.find_all(CALENDAR_ROWS):
+        ...
+
+HTML_PARSER picks the BeautifulSoup backend:
+- "html.parser" (the default) is the standard library's parser, which the scrapers
+  have always used
+- "lxml" is faster, but it recovers from malformed markup differently, so it is
+  opt-in. Check that `python -m benchmarks.parse --from-cache` reports the same output
+  for it before switching
+- "auto" uses lxml when it is installed, else html.parser
+HTML_SUBTREES=0 parses whole pages again. `python -m benchmarks.parse` compares the
+backends and both modes for time and identical output.
+"""
+import os
+import re
+import importlib.util
+from bs4 import BeautifulSoup, SoupStrainer
+
+HTML_PARSER = os.getenv("HTML_PARSER", "html.parser")
+HTML_SUBTREES = os.getenv("HTML_SUBTREES", "1") == "1"
+LXML_AVAILABLE = importlib.util.find_spec("lxml") is not None
+
+# What the scrapers look for. Class rules are regular expressions over the class
+# attribute, so they match the same tags whether BeautifulSoup hands the rule the
+# whole attribute or one class at a time.
+CATALOGUE_TABLE = SoupStrainer(
+    "div", class_=re.compile(r"custom__table-wrapper|(^|\s)custom__table-responsive(\s|$)"))
+TABLES = SoupStrainer("table")
+CALENDAR_ROWS = SoupStrainer("div", class_=re.compile(r"product-catalogue-training-calendar__row"))
+TITLE = SoupStrainer("h1")
+
+
+class AnyOf(SoupStrainer):
+    """
+    A strainer that keeps an element when any of `strainers` would, so one parse
+    can collect several kinds of subtree (SoupStrainer's own rules must all match).
+    """
+    def __init__(self, *strainers):
+        super().__init__()
+        self.strainers = strainers
+
+    def allow_tag_creation(self, nsprefix, name, attrs):
+        return any(strainer.allow_tag_creation(nsprefix, name, attrs) for strainer in self.strainers)
+
+    def allow_string_creation(self, string):
+        return any(strainer.allow_string_creation(string) for strainer in self.strainers)
+
+    def search_tag(self, markup_name=None, markup_attrs={}):
+        # BeautifulSoup before 4.13 asks search_tag instead of allow_tag_creation.
+        for strainer in self.strainers:
+            found = strainer.search_tag(markup_name, markup_attrs)
+            if found:
+                return found
+        return None
+
+
+# A product page's title and calendar rows, in one parse.
+PRODUCT_PAGE = AnyOf(TITLE, CALENDAR_ROWS)
+
+
+def parser_backend(name=None):
+    """
+    The BeautifulSoup parser to use for `name` (HTML_PARSER by default).
+    """
+    name = name or HTML_PARSER
+    if name == "auto":
+        return "lxml" if LXML_AVAILABLE else "html.parser"
+    if name == "lxml" and not LXML_AVAILABLE:
+        raise ValueError("HTML_PARSER=lxml, but lxml is not installed (pip install lxml).")
+    return name
+
+
+def parse_html(html, only=None, parser=None):
+    """
+    Parses `html`, keeping only the elements the SoupStrainer `only` matches (with
+    everything inside them). With no strainer, or HTML_SUBTREES=0, the whole page
+    is parsed.
+    """
+    return BeautifulSoup(html, parser_backend(parser), parse_only=only if HTML_SUBTREES else None)
@@ -1,23 +1,24 @@
 #!/usr/bin/env python3
-import requests
-from bs4 import BeautifulSoup
 import json
-import time
 import re
 import os
 import sys
 import uuid  # For generating unique IDs
 
+# json_stream lives at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_stream import write_items, append_items
+from crawler import Crawler
+from extract import parse_html, CALENDAR_ROWS
+
 # === CONFIGURATION ===
 INPUT_FILE = 'JSONs/final_copy.json'      # Input JSON file containing a list of courses.
 OUTPUT_FILE = 'JSONs/products.json'   # Output JSON file for successfully scraped courses.
 FAILED_FILE = 'JSONs/failed.json'     # Output JSON file for courses that fail processing.
 TIMEOUT = 5                          # Reduced timeout (in seconds) to avoid long waits.
-USER_AGENT = "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; Trident/6.0)"
-HEADERS = {"User-Agent": USER_AGENT}
 
 
-def scrape_course_page(url):
+def scrape_course_page(url, crawler=None):
     """
     Given a course URL, fetch the page (using a lower timeout to avoid long delays)
     and parse its details using BeautifulSoup. Returns a dict with:
@@ -26,19 +27,25 @@ def scrape_course_page(url):
       - duration: The first numeric value found in the text under the "Assessment Length" heading.
     """
     try:
-        response = requests.get(url, headers=HEADERS, timeout=TIMEOUT)
-        response.raise_for_status()
+        html = (crawler or Crawler(timeout=TIMEOUT)).fetch(url)
     except Exception as e:
         raise Exception(f"Request error: {e}")
+    return parse_course_page(html, url)
+
 
-    soup = BeautifulSoup(response.text, 'html.parser')
+def parse_course_page(html, url):
+    """
+    Extracts the fields returned by `scrape_course_page` from a fetched page.
+    """
+    # Only the detail rows are parsed (see extract.py).
+    soup = parse_html(html, CALENDAR_ROWS)
     # Initialize fields.
     description = ""
     language = ""
     duration = ""
 
     # Find all divs that contain course details.
-    rows = soup.find_all("div", class_=lambda c: c and "product-catalogue-training-calendar__row" in c)
+    rows = soup.find_all(CALENDAR_ROWS)
     for row in rows:
         h4 = row.find("h4")
         if not h4:
@@ -72,21 +79,10 @@ def load_json_file(filename):
 def append_to_json(filename, records):
     """
     Appends new records (list of dicts) to an existing JSON file.
-    If the file doesn't exist or is unreadable, it creates a new one.
+    If the file doesn't exist, it creates a new one. Only the new records are
+    written; the existing ones are neither read nor rewritten.
     """
-    if os.path.exists(filename):
-        try:
-            with open(filename, 'r', encoding='utf-8') as f:
-                existing = json.load(f)
-        except Exception as e:
-            print(f"Error loading {filename}: {e}")
-            existing = []
-    else:
-        existing = []
-
-    existing.extend(records)
-    with open(filename, 'w', encoding='utf-8') as f:
-        json.dump(existing, f, indent=4)
+    append_items(filename, records)
 
 
 def update_input_file(all_courses, successful_urls):
@@ -94,11 +90,10 @@ def update_input_file(all_courses, successful_urls):
     Updates the input JSON file (final.json) by removing successfully processed courses.
     Remaining courses include those that failed or were not attempted.
     """
-    remaining = [course for course in all_courses if course.get("url") not in successful_urls]
+    remaining = (course for course in all_courses if course.get("url") not in successful_urls)
     try:
-        with open(INPUT_FILE, 'w', encoding='utf-8') as f:
-            json.dump(remaining, f, indent=4)
-        print(f"Updated {INPUT_FILE}: {len(remaining)} courses remaining.")
+        count = write_items(INPUT_FILE, remaining)
+        print(f"Updated {INPUT_FILE}: {count} courses remaining.")
     except Exception as e:
         print(f"Error updating {INPUT_FILE}: {e}")
 
@@ -117,18 +112,20 @@ def main():
     total = len(courses)
     print(f"Total courses to process: {total}")
 
-    try:
-        for idx, course in enumerate(courses, start=1):
-            url = course.get("url")
-            if not url:
-                print("No URL found, skipping.")
-                continue
+    skipped = [course for course in courses if not course.get("url")]
+    if skipped:
+        print(f"No URL found for {len(skipped)} courses, skipping.")
+    courses_with_url = [course for course in courses if course.get("url")]
 
-            print(f"Processing {idx}/{total}: {url}")
-            try:
-                details = scrape_course_page(url)
-            except Exception as ex:
-                print(f"  ERROR on {url}: {ex}")
+    # Pages are fetched concurrently within the crawler's per-host limits (see
+    # crawler.py) and come back in input order.
+    crawler = Crawler(timeout=TIMEOUT)
+    results = crawler.crawl([course["url"] for course in courses_with_url], parse_course_page)
+    try:
+        for idx, (course, (url, details, error)) in enumerate(zip(courses_with_url, results), start=1):
+            print(f"Processed {idx}/{len(courses_with_url)}: {url}")
+            if error:
+                print(f"  ERROR on {url}: {error}")
                 failed_courses.append(course)
                 continue
 
@@ -146,10 +143,10 @@ def main():
             }
             success_records.append(new_entry)
             successful_urls.add(url)
-            # Short delay to lessen rapid-fire requests.
-            time.sleep(0.2)
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt detected! Saving current progress...")
+    finally:
+        results.close()
 
     # Append newly scraped courses to the output JSON.
     if success_records:
@@ -0,0 +1,151 @@
+"""
+On-disk HTTP response cache for the scrapers, with conditional revalidation.
+
+Bodies are stored content-addressed under bodies/<sha256 of the body>, so identical
+pages are kept once. A small JSON entry per URL under entries/<sha256 of the URL>.json
+records the body's hash, its encoding and the response's ETag / Last-Modified. A
+re-crawl sends those back as If-None-Match / If-Modified-Since, and an unchanged page
+costs a 304 with no body instead of a full download.
+
+    CRAWL_CACHE=on        # default: revalidate cached pages with conditional GETs
+    CRAWL_CACHE=offline   # serve only from the cache, never touch the network
+    CRAWL_CACHE=off       # no cache
+
+Offline mode re-runs the parsers against the saved HTML at disk speed; a page that
+was never cached raises CacheMiss. The cache lives in .cache/http at the repository
+root unless HTTP_CACHE_PATH says otherwise.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+from pathlib import Path
+import requests
+
+HTTP_CACHE_PATH = Path(os.getenv("HTTP_CACHE_PATH",
+                                 Path(__file__).resolve().parent.parent / ".cache" / "http"))
+CRAWL_CACHE = os.getenv("CRAWL_CACHE", "on")
+CACHE_MODES = ("on", "offline", "off")
+
+
+class CacheMiss(requests.RequestException):
+    """
+    Raised in offline mode for a URL that is not in the cache.
+    """
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.{os.getpid()}-{threading.get_ident()}.tmp")
+    tmp_path.write_bytes(data)
+    os.replace(tmp_path, path)
+
+
+class HTTPCache:
+
+    def __init__(self, root=HTTP_CACHE_PATH, offline=False):
+        self.root = Path(root)
+        self.offline = offline
+        self.not_modified = 0
+        self.downloaded = 0
+        self.offline_hits = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, mode=CRAWL_CACHE):
+        """
+        The cache for a CRAWL_CACHE mode, or None for "off".
+        """
+        if mode not in CACHE_MODES:
+            raise ValueError(f"CRAWL_CACHE must be one of {', '.join(CACHE_MODES)}, not {mode!r}.")
+        return None if mode == "off" else cls(offline=mode == "offline")
+
+    def _entry_path(self, url):
+        key = _digest(url.encode("utf-8"))
+        return self.root / "entries" / key[:2] / f"{key}.json"
+
+    def _body_path(self, body_hash):
+        return self.root / "bodies" / body_hash[:2] / body_hash
+
+    def lookup(self, url):
+        """
+        The cache entry for `url`, or None if it is not cached (or its body is gone).
+        """
+        try:
+            with self._entry_path(url).open("r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return entry if self._body_path(entry["body"]).exists() else None
+
+    @staticmethod
+    def conditional_headers(entry):
+        """
+        If-None-Match / If-Modified-Since headers that revalidate `entry`.
+        """
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def read(self, entry):
+        body = self._body_path(entry["body"]).read_bytes()
+        return body.decode(entry.get("encoding") or "utf-8", errors="replace")
+
+    def cached(self, url, entry=None):
+        """
+        The cached body of `url` for offline use. Raises CacheMiss if there is none.
+        """
+        entry = entry or self.lookup(url)
+        if entry is None:
+            raise CacheMiss(f"{url} is not in the HTTP cache ({self.root}).")
+        with self._lock:
+            self.offline_hits += 1
+        return self.read(entry)
+
+    def revalidated(self, url, entry):
+        """
+        Records a 304 for `url` and returns its cached body.
+        """
+        entry["checked"] = time.time()
+        _write_atomic(self._entry_path(url), json.dumps(entry).encode("utf-8"))
+        with self._lock:
+            self.not_modified += 1
+        return self.read(entry)
+
+    def store(self, url, response):
+        """
+        Saves a 200 response for `url` and returns its body as text.
+        """
+        body = response.content
+        body_hash = _digest(body)
+        body_path = self._body_path(body_hash)
+        if not body_path.exists():
+            _write_atomic(body_path, body)
+        now = time.time()
+        entry = {
+            "url": url,
+            "body": body_hash,
+            "encoding": response.encoding or response.apparent_encoding,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "fetched": now,
+            "checked": now,
+        }
+        _write_atomic(self._entry_path(url), json.dumps(entry).encode("utf-8"))
+        with self._lock:
+            self.downloaded += 1
+        return self.read(entry)
+
+    def summary(self):
+        if self.offline:
+            return f"→ HTTP cache (offline): {self.offline_hits} pages served from {self.root}"
+        return (f"→ HTTP cache: {self.not_modified} not modified (304), "
+                f"{self.downloaded} downloaded, in {self.root}")
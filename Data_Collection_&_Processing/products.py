@@ -1,66 +1,43 @@
 #!/usr/bin/env python3
 import os
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
 import json
-import time
 import re
-from bs4 import BeautifulSoup
 import sys
 
+# json_stream lives at the repository root.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from json_stream import write_items, append_items
+from crawler import Crawler
+from extract import parse_html, CALENDAR_ROWS
+
 # Configuration
 INPUT_FILE = 'JSONs/final_copy.json'         # JSON file with basic course info.
 OUTPUT_FILE = 'JSONs/products.json'      # Output JSON file with successfully detailed info.
 FAILED_FILE = 'JSONs/failed.json'         # Output JSON file for failed courses.
-USER_AGENT = "Mozilla/5.0 (compatible; MSIE 10.0; Windows NT 6.1; Trident/6.0)"
-HEADERS = {"User-Agent": USER_AGENT}
-
-def create_session():
-    """
-    Creates and returns a requests Session object with a retry strategy to overcome 
-    transient network issues and timeouts.
-    """
-    session = requests.Session()
-    retry_strategy = Retry(
-        total=5,  # Number of total retries (for network-level errors)
-        status_forcelist=[429, 500, 502, 503, 504],
-        allowed_methods=["HEAD", "GET", "OPTIONS"],
-        backoff_factor=1  # Wait 1, 2, 4... seconds between retries
-    )
-    adapter = HTTPAdapter(max_retries=retry_strategy)
-    session.mount("http://", adapter)
-    session.mount("https://", adapter)
-    return session
-
-def fetch_page(url, session):
-    """
-    Fetches the URL using the provided session and returns the page content.
-    Uses a 30-second timeout to allow slow servers extra time.
-    """
-    try:
-        response = session.get(url, headers=HEADERS, timeout=30)
-        response.raise_for_status()
-        return response.text
-    except requests.RequestException as e:
-        print(f"Error fetching {url}: {e}")
-        return None
 
-def extract_course_details(url, session):
+def extract_course_details(url, crawler):
     """
     Given a course URL, fetches the page and scrapes:
       - Description: from the <p> tag under the "Description" heading.
       - Language: from the <p> tag under the "Languages" heading.
       - Duration: numeric value from the <p> tag under the "Assessment length" heading.
-    Returns a dict with these values.
+    Returns a dict with these values, or None if the page could not be fetched.
     """
-    page_content = fetch_page(url, session)
-    if not page_content:
+    try:
+        page_content = crawler.fetch(url)
+    except Exception as e:
+        print(f"Error fetching {url}: {e}")
         return None
+    return parse_course_details(page_content, url)
 
-    soup = BeautifulSoup(page_content, 'html.parser')
+def parse_course_details(page_content, url):
+    """
+    Extracts the fields returned by `extract_course_details` from a fetched page.
+    """
+    # Only the detail rows are parsed (see extract.py).
+    soup = parse_html(page_content, CALENDAR_ROWS)
     # Look for all rows that contain course details.
-    detail_rows = soup.find_all("div", class_=lambda x: x and "product-catalogue-training-calendar__row" in x)
+    detail_rows = soup.find_all(CALENDAR_ROWS)
     description = ""
     language = ""
     duration = ""
@@ -93,30 +70,17 @@ def save_data(updated_courses, failed_courses):
     """
     Appends updated_courses to OUTPUT_FILE and writes failed_courses to FAILED_FILE.
     """
-    # Append new courses to products.json if it exists.
-    products_list = []
-    if os.path.exists(OUTPUT_FILE):
-        try:
-            with open(OUTPUT_FILE, 'r') as infile:
-                products_list = json.load(infile)
-            print(f"Loaded {len(products_list)} existing records from {OUTPUT_FILE}")
-        except Exception as e:
-            print(f"Error loading {OUTPUT_FILE}: {e}")
-            products_list = []
-
-    # Append new records.
-    products_list.extend(updated_courses)
+    # Append new courses to products.json in place (created if it does not exist);
+    # the existing records are not read or rewritten.
     try:
-        with open(OUTPUT_FILE, 'w') as outfile:
-            json.dump(products_list, outfile, indent=4)
+        append_items(OUTPUT_FILE, updated_courses)
         print(f"\nSuccessfully appended {len(updated_courses)} records to {OUTPUT_FILE}")
     except Exception as e:
         print(f"Error writing to {OUTPUT_FILE}: {e}")
 
     if failed_courses:
         try:
-            with open(FAILED_FILE, 'w') as failed_out:
-                json.dump(failed_courses, failed_out, indent=4)
+            write_items(FAILED_FILE, failed_courses)
             print(f"Saved {len(failed_courses)} failed records to {FAILED_FILE}")
         except Exception as e:
             print(f"Error writing to {FAILED_FILE}: {e}")
@@ -140,8 +104,7 @@ def update_input_file(all_courses, processed_idx, updated_courses):
     remaining_courses = attempted_unsuccessful + not_attempted
 
     try:
-        with open(INPUT_FILE, 'w') as infile:
-            json.dump(remaining_courses, infile, indent=4)
+        write_items(INPUT_FILE, remaining_courses)
         print(f"Updated {INPUT_FILE} with {len(remaining_courses)} remaining courses.")
     except Exception as e:
         print(f"Error writing to {INPUT_FILE}: {e}")
@@ -155,7 +118,10 @@ def main():
         print(f"Error reading {INPUT_FILE}: {e}")
         return
 
-    session = create_session()  # Create a session with retry logic.
+    # Pages are fetched concurrently, with retries and per-host limits, by the shared
+    # crawler (see crawler.py); results come back in input order.
+    crawler = Crawler()
+    results = crawler.crawl([course["url"] for course in courses if course.get("url")], parse_course_details)
     updated_courses = []  # Successfully scraped courses.
     failed_courses = []     # Courses that failed after retries.
     total = len(courses)
@@ -169,24 +135,10 @@ def main():
                 print("No URL found for element, skipping.")
                 continue
 
-            print(f"Processing ({idx}/{total}): {url}")
-            max_retries = 2
-            attempt = 0
-            details = None
-
-            # Attempt extraction with retries.
-            while attempt <= max_retries and details is None:
-                details = extract_course_details(url, session)
-                if details is None:
-                    if attempt < max_retries:
-                        attempt += 1
-                        print(f"  Retry {attempt}/{max_retries} for {url}")
-                        time.sleep(1)  # Pause before retrying.
-                    else:
-                        print(f"  Failed after {attempt + 1} attempts: {url}")
-                        break
-            
-            if details is None:
+            _, details, error = next(results)
+            print(f"Processed ({idx}/{total}): {url}")
+            if error:
+                print(f"  Failed: {url}: {error}")
                 failed_courses.append(course)
                 continue
             
@@ -201,8 +153,6 @@ def main():
                 "test_type": [course.get("test_type", "")]
             }
             updated_courses.append(new_entry)
-            # Pause briefly to reduce load on the server.
-            time.sleep(1)
     except KeyboardInterrupt:
         print("\nKeyboardInterrupt detected! Saving scraped data before exit...")
         # Save the new successful and failed courses.
@@ -210,6 +160,8 @@ def main():
         # Update the input file to remove successfully scraped courses.
         update_input_file(courses, processed_idx, updated_courses)
         sys.exit(0)
+    finally:
+        results.close()
 
     # After processing all courses, save data.
     save_data(updated_courses, failed_courses)
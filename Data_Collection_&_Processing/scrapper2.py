@@ -1,7 +1,7 @@
-import requests
-from bs4 import BeautifulSoup
 from urllib.parse import urljoin
 import json
+from crawler import Crawler
+from extract import parse_html, TABLES
 
 
 INPUT_FILE = 'individual_assessment.txt'
@@ -19,15 +19,17 @@ TEST_TYPE_MAPPING = {
     'S': "Stimulations"
 }
 
-def scrape_individual_table_data(page_url):
+def scrape_individual_table_data(page_url, crawler=None):
     try:
-        resp = requests.get(page_url)
-        resp.raise_for_status()
-    except requests.RequestException as e:
+        html = (crawler or Crawler()).fetch(page_url)
+    except Exception as e:
         print(f"Error fetching {page_url}: {e}")
         return []
-    
-    soup = BeautifulSoup(resp.text, 'html.parser')
+    return parse_individual_table_data(html, page_url)
+
+def parse_individual_table_data(html, page_url):
+    # Only the tables are parsed (see extract.py).
+    soup = parse_html(html, TABLES)
     
     selected_table = None
     for table in soup.find_all("table"):
@@ -100,16 +102,15 @@ def main():
         print(f"Error reading {INPUT_FILE}: {e}")
         return
 
-    for page in pages:
-        if page.startswith('/'):
-            page = urljoin(BASE_URL, page)
-        print(f"→ Scraping {page} for Individual Test Solutions ...")
-        try:
-            page_data = scrape_individual_table_data(page)
-            print(f"   Found {len(page_data)} rows")
-            all_data.extend(page_data)
-        except Exception as ex:
-            print(f"   ERROR on {page}: {ex}")
+    pages = [urljoin(BASE_URL, page) if page.startswith('/') else page for page in pages]
+    # Pages are fetched concurrently (see crawler.py); results arrive in page order.
+    for page, page_data, error in Crawler().crawl(pages, parse_individual_table_data):
+        print(f"→ Scraped {page} for Individual Test Solutions")
+        if error:
+            print(f"   ERROR on {page}: {error}")
+            continue
+        print(f"   Found {len(page_data)} rows")
+        all_data.extend(page_data)
     
     try:
         with open(OUTPUT_FILE, 'w') as outfile:
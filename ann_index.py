@@ -0,0 +1,276 @@
+"""
+Approximate nearest-neighbour search for the local backend: an inverted-file (IVF) index.
+
+Vectors are clustered around `nlist` centroids (spherical k-means) and stored grouped
+by cluster. A query scores the centroids, then only the vectors in the `nprobe`
+closest clusters, so the work per query is about nprobe / nlist of a full scan. Raise
+nprobe for recall, lower it for speed; `python ann_index.py recall` measures the
+trade-off against exact search.
+
+The index lives in JSONs/product_ann/ and supports incremental `add` / `remove`:
+ingest.py updates it instead of retraining. Every save is a new version of the
+directory, switched to in one step (see artifact.write_versioned). Retrain (`python ann_index.py
+build`) once the catalog has grown well beyond the size it was trained on, so the
+clusters stay balanced.
+
+    python ann_index.py build --nlist 0 --nprobe 8    # nlist 0 = 4 * sqrt(N)
+    python ann_index.py recall
+"""
+import json
+import time
+import argparse
+from pathlib import Path
+import numpy as np
+from artifact import version_path, write_versioned
+from local_index import LocalIndex, normalize_rows, top_rows, measure_recall, recall_queries, RECALL_K
+
+
+ANN_PATH = Path("JSONs/product_ann")
+
+NPROBE = 8
+KMEANS_ITERATIONS = 20
+# Vectors the centroids are trained on; the rest are only assigned.
+KMEANS_SAMPLE = 50000
+NPROBE_SWEEP = (1, 2, 4, 8, 16, 32, 64)
+
+
+def default_nlist(count):
+    return max(1, min(count, int(4 * np.sqrt(count))))
+
+
+def train_centroids(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """
+    Spherical k-means on (a sample of) the unit-norm `vectors`. Returns unit-norm centroids.
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > KMEANS_SAMPLE:
+        vectors = vectors[np.sort(rng.choice(len(vectors), size=KMEANS_SAMPLE, replace=False))]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), size=nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        empty = np.bincount(assignments, minlength=nlist) == 0
+        # Re-seed empty clusters with random vectors so every list gets used.
+        sums[empty] = vectors[rng.choice(len(vectors), size=int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    """
+    Same `query` / `query_many` / `ids` interface as LocalIndex. Each inverted list
+    holds the row positions (into `ids`) and unit-norm vectors of one cluster.
+    Removed products keep their position in `ids` but are no longer in any list.
+    """
+
+    def __init__(self, ids, centroids, list_rows, list_vectors, nprobe=NPROBE):
+        self.ids = list(ids)
+        self.centroids = centroids
+        self.list_rows = list_rows
+        self.list_vectors = list_vectors
+        self.nprobe = nprobe
+        self.recall = None
+        self._positions = {product_id: row for row, product_id in enumerate(self.ids)}
+        self._list_of = np.full(len(self.ids), -1, dtype=np.int64)
+        for number, rows in enumerate(list_rows):
+            self._list_of[rows] = number
+
+    def __len__(self):
+        return int(np.count_nonzero(self._list_of >= 0))
+
+    def __contains__(self, product_id):
+        row = self._positions.get(product_id)
+        return row is not None and self._list_of[row] >= 0
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    @property
+    def dimension(self):
+        return self.centroids.shape[1]
+
+    @classmethod
+    def build(cls, local_index, nlist=0, nprobe=NPROBE):
+        vectors = np.asarray(local_index.vectors, dtype=np.float32)
+        nlist = min(nlist or default_nlist(len(vectors)), len(vectors))
+        centroids = train_centroids(vectors, nlist)
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        list_rows = [np.flatnonzero(assignments == number) for number in range(nlist)]
+        list_vectors = [vectors[rows] for rows in list_rows]
+        return cls(local_index.ids, centroids, list_rows, list_vectors, nprobe)
+
+    def add(self, ids, vectors):
+        """
+        Inserts (or replaces) vectors without retraining: each goes to the list of its
+        closest centroid.
+        """
+        vectors = normalize_rows(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        self.remove(ids)
+        positions = []
+        for product_id in ids:
+            row = self._positions.get(product_id)
+            if row is None:
+                row = self._positions[product_id] = len(self.ids)
+                self.ids.append(product_id)
+            positions.append(row)
+        positions = np.array(positions, dtype=np.int64)
+        if len(self._list_of) < len(self.ids):
+            self._list_of = np.concatenate([self._list_of, np.full(len(self.ids) - len(self._list_of), -1)])
+
+        assignments = np.argmax(vectors @ self.centroids.T, axis=1)
+        for number in np.unique(assignments):
+            selected = assignments == number
+            self.list_rows[number] = np.concatenate([self.list_rows[number], positions[selected]])
+            self.list_vectors[number] = np.concatenate([self.list_vectors[number], vectors[selected]])
+        self._list_of[positions] = assignments
+
+    def remove(self, ids):
+        """
+        Drops `ids` from their lists. Unknown ids are ignored.
+        """
+        by_list = {}
+        for product_id in ids:
+            row = self._positions.get(product_id)
+            if row is not None and self._list_of[row] >= 0:
+                by_list.setdefault(int(self._list_of[row]), []).append(row)
+                self._list_of[row] = -1
+        for number, rows in by_list.items():
+            keep = ~np.isin(self.list_rows[number], rows)
+            self.list_rows[number] = self.list_rows[number][keep]
+            self.list_vectors[number] = self.list_vectors[number][keep]
+
+    def _search(self, query, centroid_scores, top_k, mask=None):
+        order = np.argsort(-centroid_scores)
+        nprobe = min(self.nprobe, self.nlist)
+        while True:
+            probed = order[:nprobe]
+            rows = np.concatenate([self.list_rows[number] for number in probed])
+            scores = np.concatenate([self.list_vectors[number] @ query for number in probed])
+            if mask is not None:
+                eligible = mask[rows]
+                rows, scores = rows[eligible], scores[eligible]
+            # A selective filter can leave too few candidates; widen the probe.
+            if len(rows) >= top_k or nprobe >= self.nlist:
+                break
+            nprobe = min(nprobe * 2, self.nlist)
+        top = top_rows(scores, top_k)
+        return [{"id": self.ids[rows[i]], "score": float(scores[i])} for i in top]
+
+    def query(self, vector, top_k=10, include_metadata=False, mask=None, **kwargs):
+        return self.query_many([vector], top_k, mask)[0]
+
+    def query_many(self, vectors, top_k=10, mask=None):
+        queries = normalize_rows(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        centroid_scores = queries @ self.centroids.T
+        return [{"matches": self._search(query, scores, top_k, mask)}
+                for query, scores in zip(queries, centroid_scores)]
+
+    def save(self, path: Path = ANN_PATH):
+        """
+        Writes the lists as one matrix ordered by list, plus offsets, so `load` can
+        memory-map it. The files are written together as a new version of the `path`
+        directory (see artifact.write_versioned): a process reloading meanwhile reads
+        either the old set or the new one, never offsets from one and rows from the other.
+        """
+        offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum([len(rows) for rows in self.list_rows], out=offsets[1:])
+
+        def write(directory):
+            np.save(directory / "centroids.npy", self.centroids)
+            np.save(directory / "offsets.npy", offsets)
+            np.save(directory / "rows.npy", np.concatenate(self.list_rows).astype(np.int64))
+            np.save(directory / "vectors.npy", np.concatenate(self.list_vectors).astype(np.float32))
+            with (directory / "ids.json").open("w", encoding="utf-8") as f:
+                json.dump(self.ids, f)
+            with (directory / "meta.json").open("w", encoding="utf-8") as f:
+                json.dump({"nlist": self.nlist, "nprobe": self.nprobe, "size": len(self), "recall": self.recall},
+                          f, indent=2)
+
+        return write_versioned(path, write)
+
+    @classmethod
+    def load(cls, path: Path = ANN_PATH, nprobe=None):
+        """
+        Loads an index written by `save`. The vectors are memory-mapped; a list is only
+        copied into memory if `add` or `remove` changes it.
+        """
+        path = version_path(path)
+        with (path / "meta.json").open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        with (path / "ids.json").open("r", encoding="utf-8") as f:
+            ids = json.load(f)
+        offsets = np.load(path / "offsets.npy")
+        rows = np.load(path / "rows.npy", mmap_mode="r")
+        vectors = np.load(path / "vectors.npy", mmap_mode="r")
+        spans = list(zip(offsets[:-1], offsets[1:]))
+        index = cls(ids, np.load(path / "centroids.npy"), [np.asarray(rows[start:end]) for start, end in spans],
+                    [vectors[start:end] for start, end in spans], nprobe or meta["nprobe"])
+        index.recall = meta.get("recall")
+        return index
+
+
+def measure_tradeoff(index, local_index, k=RECALL_K, sweep=NPROBE_SWEEP):
+    """
+    recall@k and mean query latency for each nprobe in `sweep`, against exact search.
+    Stores the result for the index's own nprobe on `index.recall`.
+    """
+    queries = recall_queries(local_index)
+    configured = index.nprobe
+    results = []
+    for nprobe in sorted({n for n in sweep if n <= index.nlist} | {configured}):
+        index.nprobe = nprobe
+        started = time.perf_counter()
+        for query in queries:
+            index.query(query, top_k=k)
+        latency_ms = (time.perf_counter() - started) / len(queries) * 1000
+        recall = measure_recall(index, local_index, queries, k)
+        results.append({"nprobe": nprobe, "recall": recall, "latency_ms": round(latency_ms, 4)})
+        print(f"nprobe={nprobe:<4} recall@{k}={recall:<7} {latency_ms:.3f} ms/query")
+    index.nprobe = configured
+    index.recall = {"k": k, "nprobe": configured,
+                    "recall": next(r["recall"] for r in results if r["nprobe"] == configured)}
+    return results
+
+
+def saved(path=ANN_PATH):
+    return (version_path(path) / "meta.json").exists()
+
+
+def load_or_build(path=ANN_PATH, nprobe=None, local_index=None):
+    """
+    Loads the ANN index, building it on first use from `local_index` (by default the
+    exact local index in JSONs/).
+    """
+    if saved(path):
+        return IVFIndex.load(path, nprobe)
+    local_index = local_index or LocalIndex.load()
+    index = IVFIndex.build(local_index, nprobe=nprobe or NPROBE)
+    measure_tradeoff(index, local_index)
+    index.save(path)
+    print(f"Built IVF index over {len(index)} vectors with {index.nlist} lists at {path}")
+    return IVFIndex.load(path, nprobe)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or evaluate the IVF index for the local backend.")
+    parser.add_argument("command", choices=["build", "recall"])
+    parser.add_argument("--nlist", type=int, default=0, help="Clusters (0 = 4 * sqrt(N)).")
+    parser.add_argument("--nprobe", type=int, default=NPROBE, help="Clusters searched per query.")
+    parser.add_argument("--path", type=Path, default=ANN_PATH)
+    args = parser.parse_args()
+
+    local_index = LocalIndex.load()
+    if args.command == "build":
+        index = IVFIndex.build(local_index, args.nlist, args.nprobe)
+    else:
+        index = IVFIndex.load(args.path, args.nprobe)
+    measure_tradeoff(index, local_index)
+    index.save(args.path)
+    print(f"Saved IVF index ({len(index)} vectors, nlist={index.nlist}, nprobe={index.nprobe}) to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,77 +1,414 @@
-import os
-import json
 import time
-from pathlib import Path
-from collections import OrderedDict
-from flask import Flask, request, jsonify
-from dotenv import load_dotenv
-from pinecone import Pinecone, ServerlessSpec
-from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
 
+IMPORT_STARTED = time.perf_counter()
 
-load_dotenv()
-GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
-PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+import os
+import json
+import signal
+import threading
+from functools import wraps
+from flask import Flask, request, jsonify, g
+import metrics
+from embedding_cache import normalize_query
+from filters import parse_filters, cache_key as filters_cache_key
+from response_cache import ResponseCache
+from engine import RecommendationEngine, MAX_RECOMMENDATIONS, OVERFETCH_TOP_K
+
+
+# Serialized /recommend responses, dropped whenever the served data is reloaded.
+# Hosted Pinecone has no cheap change signal, so bump INDEX_VERSION after re-ingesting.
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "300"))
+INDEX_VERSION = os.getenv("INDEX_VERSION", "")
+
+# Startup. Resources are initialised on a background thread so /health answers
+# immediately; /ready flips once they are loaded and warmed up. Requests that arrive
+# earlier wait up to READY_WAIT_SECONDS and then get a 503. A failed initialisation
+# is retried every INIT_RETRY_SECONDS. WARMUP_QUERY="" skips the warm-up embedding.
+READY_WAIT_SECONDS = float(os.getenv("READY_WAIT_SECONDS", "5"))
+INIT_RETRY_SECONDS = float(os.getenv("INIT_RETRY_SECONDS", "10"))
+WARMUP_QUERY = os.getenv("WARMUP_QUERY", "software engineer")
+
+# Set by gunicorn.conf.py: the catalog and local index are loaded in the master at
+# import time and each forked worker only opens its own connections (see post_fork).
+PREFORK = bool(os.getenv("API_PREFORK"))
+
+# API_AUTOSTART=0 leaves initialisation to the embedding program, which calls
+# start_background_init() itself (benchmarks/loadgen.py does, after installing fakes).
+AUTOSTART = os.getenv("API_AUTOSTART", "1") == "1"
+
+# Hot reload (see artifact.py and RecommendationEngine.reload): the catalog and local
+# index are swapped for the current versions on SIGHUP or POST /admin/reload, or when
+# a poll every ARTIFACT_WATCH_SECONDS (0 = off) finds a new artifact. Under gunicorn,
+# where each worker holds its own copy, signal the workers or use the poll. If
+# ADMIN_TOKEN is set, /admin/* requires "Authorization: Bearer <ADMIN_TOKEN>".
+ARTIFACT_WATCH_SECONDS = float(os.getenv("ARTIFACT_WATCH_SECONDS", "0"))
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+# /recommend/batch
+MAX_BATCH_QUERIES = 1000
+
+NO_MATCHES_ERROR = "No recommendations found above the similarity threshold."
+
+# Add a Server-Timing header with per-stage durations to every response. Clients can
+# also ask for it per request with ?timing=1.
+SERVER_TIMING = bool(os.getenv("SERVER_TIMING"))
 
 
-PRODUCTS_JSON_PATH = Path("JSONs/products.json")
+app = Flask(__name__)
 
-# Pinecone
-INDEX_NAME = "shl-product-index"
-DIMENSION = 768
-REGION = "us-east-1"
+app.config["JSON_SORT_KEYS"] = False
 
+engine = RecommendationEngine()
 
-SIMILARITY_THRESHOLD = 0.5
-MAX_RECOMMENDATIONS = 10
+ready = threading.Event()
+startup = {"status": "starting", "error": None, "timings": {}}
+_init_thread = None
+_init_lock = threading.Lock()
+reloads = {"count": 0, "failures": 0, "last_error": None, "last_seconds": None}
+_reload_lock = threading.Lock()
+_watch_thread = None
 
 
-app = Flask(__name__)
+def timed_stage(name, func):
+    """
+    Runs one startup stage and records how long it took.
+    """
+    started = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - started
+    startup["timings"][name] = round(elapsed, 4)
+    print(f"Startup: {name} took {elapsed:.3f}s")
+    return result
 
-app.config["JSON_SORT_KEYS"] = False
 
+def initialize():
+    """
+    Loads the catalog and the index, builds the embedder and warms up both remote
+    connections, then marks the service ready.
+    """
+    started = time.perf_counter()
+    if not engine.loaded:
+        timed_stage("local_data", engine.load_local)
+    timed_stage("connect", engine.connect)
+
+    if WARMUP_QUERY:
+        vector = timed_stage("warmup_embedding", lambda: engine.query_embeddings.embed_query(WARMUP_QUERY))
+        timed_stage("warmup_index", lambda: engine.index.query(vector=vector, top_k=1, include_metadata=False))
+
+    startup["timings"]["total"] = round(time.perf_counter() - started, 4)
+    startup["status"] = "ready"
+    startup["error"] = None
+    ready.set()
+
+
+def _initialize_until_ready():
+    while True:
+        try:
+            initialize()
+            start_artifact_watch()
+            return
+        except Exception as e:
+            startup["status"] = "error"
+            startup["error"] = str(e)
+            print(f"Startup failed: {e}. Retrying in {INIT_RETRY_SECONDS}s.")
+            time.sleep(INIT_RETRY_SECONDS)
+
+
+def start_background_init():
+    """
+    Starts initialisation on a daemon thread. Safe to call more than once.
+    """
+    global _init_thread
+    metrics.registry.start_flushing()
+    with _init_lock:
+        if _init_thread is None:
+            _init_thread = threading.Thread(target=_initialize_until_ready, name="api-init", daemon=True)
+            _init_thread.start()
+    return _init_thread
 
-def load_products(filepath: Path):
+
+def reload_data(force=False):
     """
-    Loads the product JSON data and returns a dictionary mapping product ID to product details.
+    Swaps in the current catalog and index (see RecommendationEngine.reload). One
+    reload runs at a time; requests keep being served from the previous data until
+    the swap. Returns (previous version, new version), or None if already current.
     """
-    with filepath.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    return {item["id"]: item for item in data}
+    with _reload_lock:
+        started = time.perf_counter()
+        try:
+            swapped = engine.reload(force)
+        except Exception as e:
+            reloads["failures"] += 1
+            reloads["last_error"] = str(e)
+            print(f"Reload failed, still serving version {engine.data.version}: {e}")
+            raise
+        if swapped is not None:
+            reloads["count"] += 1
+            reloads["last_error"] = None
+            reloads["last_seconds"] = round(time.perf_counter() - started, 4)
+            print(f"Reloaded data: {swapped[0]} -> {swapped[1]} in {reloads['last_seconds']}s")
+        return swapped
+
+
+def _reload_in_background():
+    try:
+        reload_data(force=True)
+    except Exception:
+        pass
 
 
-products_db = load_products(PRODUCTS_JSON_PATH)
+def install_reload_signal():
+    """
+    Makes SIGHUP reload the data on a background thread. Must run in the main thread;
+    gunicorn.conf.py calls it in each worker.
+    """
+    if hasattr(signal, "SIGHUP"):
+        signal.signal(signal.SIGHUP, lambda signum, frame: threading.Thread(
+            target=_reload_in_background, name="api-reload", daemon=True).start())
+
+
+def _watch_artifacts():
+    failed = None
+    while True:
+        time.sleep(ARTIFACT_WATCH_SECONDS)
+        version = None
+        try:
+            version = engine.current_version()
+            # A version that failed to load is not retried until CURRENT changes again.
+            if version not in (None, failed, engine.data.version):
+                reload_data()
+        except Exception:
+            failed = version
+
+
+def start_artifact_watch():
+    """
+    Starts polling for new artifacts if ARTIFACT_WATCH_SECONDS is set. Safe to call more than once.
+    """
+    global _watch_thread
+    with _init_lock:
+        if ARTIFACT_WATCH_SECONDS > 0 and _watch_thread is None:
+            _watch_thread = threading.Thread(target=_watch_artifacts, name="api-artifact-watch", daemon=True)
+            _watch_thread.start()
+
 
+def requires_ready(view):
+    """
+    Answers 503 instead of running `view` while resources are still initialising.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ready.wait(READY_WAIT_SECONDS):
+            return jsonify({"error": "Service is starting up, retry shortly."}), 503
+        return view(*args, **kwargs)
+    return wrapper
 
-pc = Pinecone(api_key=PINECONE_API_KEY)
-if INDEX_NAME not in pc.list_indexes().names():
-    print(f"Creating index '{INDEX_NAME}' ...")
-    pc.create_index(
-        name=INDEX_NAME,
-        dimension=DIMENSION,
-        metric="cosine",
-        spec=ServerlessSpec(cloud="aws", region=REGION)
-    )
 
-    while INDEX_NAME not in pc.list_indexes().names():
-        time.sleep(1)
-else:
-    print(f"Index '{INDEX_NAME}' already exists.")
+def data_version():
+    """
+    Token that changes whenever the engine swaps in newly loaded data (see
+    ServingData.generation), so cached responses always come from the data being
+    served. Files changed on disk do not count until they are reloaded. The cache
+    also keys in-flight computations by it and drops results finished after a swap.
+    """
+    return INDEX_VERSION, engine.data.generation
 
-index = pc.Index(INDEX_NAME)
 
-embedder = GoogleGenerativeAIEmbeddings(
-    model="models/embedding-001",
-    google_api_key=GOOGLE_API_KEY
+responses = ResponseCache(
+    max_size=RESPONSE_CACHE_SIZE,
+    ttl=RESPONSE_CACHE_TTL,
+    version=data_version
 )
 
 
+# Lookup totals last reported by each cache, per (cache, outcome).
+_cache_totals = {}
+
+
+def collect_cache_metrics():
+    caches = {"response": responses.stats()}
+    if engine.query_embeddings is not None:
+        caches["embedding"] = engine.query_embeddings.stats()
+    for name, cache_stats in caches.items():
+        metrics.cache_hit_ratio.set(name, value=cache_stats["hit_ratio"])
+        for outcome in ("hits", "disk_hits", "misses", "coalesced"):
+            if outcome in cache_stats:
+                # The caches keep totals; the counter is advanced by the increase. A
+                # total that went down belongs to a new cache and counts in full.
+                total = cache_stats[outcome]
+                previous = _cache_totals.get((name, outcome), 0)
+                metrics.cache_lookups.inc(name, outcome, amount=total - previous if total >= previous else total)
+                _cache_totals[(name, outcome)] = total
+
+
+metrics.registry.collectors.append(collect_cache_metrics)
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    metrics.in_flight.inc(g.endpoint)
+    metrics.begin_request()
+
+
+@app.after_request
+def record_request_metrics(response):
+    timings = metrics.end_request()
+    elapsed = time.perf_counter() - g.request_started
+    metrics.request_seconds.observe(elapsed, g.endpoint)
+    metrics.requests_total.inc(g.endpoint, str(response.status_code))
+    if timings and (SERVER_TIMING or request.args.get("timing")):
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings + [("total", elapsed)])
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    if "endpoint" in g:
+        metrics.in_flight.dec(g.endpoint)
+
+
+def record_error(error):
+    metrics.errors_total.inc(g.endpoint, type(error).__name__)
+    return jsonify({"error": f"An error occurred: {str(error)}"}), 500
+
+
 @app.route("/health", methods=["GET"])
 def health():
-    """Simple health check endpoint."""
+    """Liveness check: answers as soon as the process is up."""
     return jsonify({"status": "healthy"}), 200
 
+@app.route("/ready", methods=["GET"])
+def readiness():
+    """Readiness check: 200 once the catalog and index are loaded and connections are warm."""
+    body = {
+        "status": startup["status"],
+        "import_seconds": IMPORT_SECONDS,
+        "timings": startup["timings"]
+    }
+    if startup["error"]:
+        body["error"] = startup["error"]
+    return jsonify(body), 200 if ready.is_set() else 503
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    """Cache and index statistics."""
+    return jsonify({
+        "embedding_cache": engine.query_embeddings.stats() if engine.query_embeddings else None,
+        "response_cache": responses.stats(),
+        "index": engine.index_stats(),
+        "reloads": reloads
+    }), 200
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    """Request, stage-latency, error and cache metrics in the Prometheus text format."""
+    return app.response_class(response=metrics.registry.render(), status=200,
+                              mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/admin/reload", methods=["POST"])
+@requires_ready
+def admin_reload():
+    """
+    Swaps in the current artifact. Answers once the new data is being served (or the
+    load failed, in which case the previous data stays in place).
+    """
+    if ADMIN_TOKEN and request.headers.get("Authorization") != f"Bearer {ADMIN_TOKEN}":
+        return jsonify({"error": "Unauthorized."}), 401
+    try:
+        swapped = reload_data(force=request.args.get("force") == "1")
+    except Exception as e:
+        return record_error(e)
+    if swapped is None:
+        return jsonify({"status": "unchanged", "version": engine.data.version}), 200
+    return jsonify({"status": "reloaded", "previous": swapped[0], "version": swapped[1],
+                    "seconds": reloads["last_seconds"]}), 200
+
+
+def parse_search_options(data_in):
+    """
+    Reads the optional "top_k", "threshold" and "filters" request fields.
+    Returns (top_k, threshold, filters, error); threshold is None when the configured
+    mode applies, filters is None when none were given.
+    """
+    top_k = data_in.get("top_k", MAX_RECOMMENDATIONS)
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= OVERFETCH_TOP_K:
+        return None, None, None, f"'top_k' must be an integer between 1 and {OVERFETCH_TOP_K}."
+    threshold = data_in.get("threshold")
+    if threshold is not None and (not isinstance(threshold, (int, float)) or isinstance(threshold, bool)):
+        return None, None, None, "'threshold' must be a number."
+    filters, error = parse_filters(data_in.get("filters"))
+    if error:
+        return None, None, None, error
+    return top_k, threshold, filters, None
+
+
+def wants_compact(data_in):
+    """
+    Compact (non-indented) JSON output, requested with "compact": true or ?compact=1.
+    """
+    return data_in.get("compact") is True or request.args.get("compact") == "1"
+
+
+# Responses are assembled from the catalog's pre-serialized per-product fragments.
+# The indented layout is byte-for-byte what json.dumps(response, indent=2) produces.
+
+def render_object(items, compact=False, depth=0):
+    """
+    Serializes [(key, serialized value), ...] as a JSON object nested `depth` levels deep.
+    """
+    keys = [json.dumps(key).encode("utf-8") for key, _ in items]
+    if compact:
+        return b"{" + b",".join(key + b":" + value for key, (_, value) in zip(keys, items)) + b"}"
+    pad = b"\n" + b"  " * (depth + 1)
+    return (b"{" + pad + (b"," + pad).join(key + b": " + value for key, (_, value) in zip(keys, items))
+            + b"\n" + b"  " * depth + b"}")
+
+
+def render_array(values, compact=False, depth=0):
+    """
+    Serializes a list of already serialized values as a JSON array nested `depth` levels deep.
+    """
+    if compact:
+        return b"[" + b",".join(values) + b"]"
+    pad = b"\n" + b"  " * (depth + 1)
+    return b"[" + pad + (b"," + pad).join(values) + b"\n" + b"  " * depth + b"]"
+
+
+def render_assessments(fragments, compact=False, depth=1):
+    """
+    The "recommended_assessments" array for entries nested `depth` + 1 levels deep.
+    Stored indented fragments are laid out for depth 1 and are shifted for other depths.
+    """
+    if not compact and depth != 1:
+        shift = b"\n" + b"  " * (depth - 1)
+        fragments = [fragment.replace(b"\n", shift) for fragment in fragments]
+    return render_array(fragments, compact, depth)
+
+
+def render_string(value):
+    return json.dumps(value, ensure_ascii=False).encode("utf-8")
+
+
+def compute_recommendation(query, top_k, threshold, filters, compact=False):
+    """
+    Runs the full embed -> search -> hydrate -> serialize chain for one query and
+    returns (status, serialized JSON bytes).
+    """
+    fragments = engine.recommend_fragments(query, top_k, threshold, filters, compact)
+
+    if not fragments:
+        return 404, json.dumps({"error": NO_MATCHES_ERROR}).encode("utf-8")
+
+    with metrics.stage("serialize"):
+        return 200, render_object([("recommended_assessments", render_assessments(fragments, compact))], compact)
+
+
 @app.route("/recommend", methods=["POST"])
+@requires_ready
 def recommend():
 
     try:
@@ -79,48 +416,72 @@ def recommend():
         query = data_in.get("query", "").strip()
         if not query:
             return jsonify({"error": "Missing or empty 'query' field."}), 400
+        top_k, threshold, filters, error = parse_search_options(data_in)
+        if error:
+            return jsonify({"error": error}), 400
+
+        compact = wants_compact(data_in)
 
-        query_embedding = embedder.embed_query(query)
-
-        search_response = index.query(
-            vector=query_embedding,
-            top_k=MAX_RECOMMENDATIONS,
-            include_metadata=False
-        )
-
-        # Filter matches based on the similarity threshold.
-        filtered_matches = [
-            match for match in search_response.get("matches", [])
-            if match.get("score", 0) >= SIMILARITY_THRESHOLD
-        ]
-
-        recommended = []
-        for match in filtered_matches:
-            product_id = match["id"]
-            product = products_db.get(product_id)
-            if product:
-                rec = OrderedDict([
-                    ("url", product.get("url", "")),
-                    ("adaptive_support", product.get("adaptive_support", "")),
-                    ("description", product.get("description", "")),
-                    ("duration", int(product.get("duration", 0))),
-                    ("remote_support", product.get("remote_support", "")),
-                    ("test_type", product.get("test_type", []))
-                ])
-                recommended.append(rec)
-
-        if not recommended:
-            return jsonify({"error": "No recommendations found above the similarity threshold."}), 404
-
-        # json order
-        response_json = json.dumps({"recommended_assessments": recommended},
-                                   ensure_ascii=False,
-                                   indent=2,
-                                   sort_keys=False)
+        cache_key = (normalize_query(query), top_k, threshold, filters_cache_key(filters), compact)
+        with metrics.stage("response"):
+            status, response_json = responses.get_or_compute(
+                cache_key,
+                lambda: compute_recommendation(query, top_k, threshold, filters, compact),
+                cacheable=lambda result: result[0] in (200, 404)
+            )
+        return app.response_class(response=response_json, status=status, mimetype="application/json")
+
+    except Exception as e:
+        return record_error(e)
+
+
+@app.route("/recommend/batch", methods=["POST"])
+@requires_ready
+def recommend_batch():
+    """
+    Accepts {"queries": [...]} and returns one result per query, in order. Each result
+    carries the same fields as /recommend, or an "error" when nothing matched.
+    """
+    try:
+        data_in = request.get_json(force=True)
+        queries = data_in.get("queries")
+        if not isinstance(queries, list) or not queries:
+            return jsonify({"error": "Missing or empty 'queries' field."}), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch."}), 400
+        queries = [query.strip() if isinstance(query, str) else "" for query in queries]
+        if not all(queries):
+            return jsonify({"error": "Every query must be a non-empty string."}), 400
+        top_k, threshold, filters, error = parse_search_options(data_in)
+        if error:
+            return jsonify({"error": error}), 400
+
+        compact = wants_compact(data_in)
+
+        all_fragments = engine.recommend_many_fragments(queries, top_k, threshold, filters, compact)
+        with metrics.stage("serialize"):
+            results = []
+            for query, fragments in zip(queries, all_fragments):
+                if fragments:
+                    value = ("recommended_assessments", render_assessments(fragments, compact, depth=3))
+                else:
+                    value = ("error", render_string(NO_MATCHES_ERROR))
+                results.append(render_object([("query", render_string(query)), value], compact, depth=2))
+            response_json = render_object([("results", render_array(results, compact, depth=1))], compact)
         return app.response_class(response=response_json, status=200, mimetype="application/json")
 
     except Exception as e:
-        return jsonify({"error": f"An error occurred: {str(e)}"}), 500
+        return record_error(e)
+
+
+IMPORT_SECONDS = round(time.perf_counter() - IMPORT_STARTED, 4)
+print(f"Startup: importing api took {IMPORT_SECONDS:.3f}s")
+if PREFORK:
+    timed_stage("local_data", engine.load_local)
+elif AUTOSTART:
+    start_background_init()
+if not PREFORK and threading.current_thread() is threading.main_thread():
+    install_reload_signal()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,264 @@
+"""
+Versioned, self-contained index artifacts.
+
+ingest.py writes one per run into JSONs/artifacts/<version>/:
+
+    vectors.npy        the L2-normalised float32 embedding matrix
+    ids.json           the product id of each row
+    products.catalog   the catalog snapshot (see catalog.py)
+    manifest.json      version, embedding model, dimension, count and sha256 checksums
+
+A version is written under a temporary name and renamed into place, then the CURRENT
+file is replaced to name it, so a reader never sees a partial artifact. The API
+memory-maps the current version and swaps to a newer one without restarting (see
+RecommendationEngine.reload). The newest KEEP_VERSIONS versions are kept, so a bad
+one can be rolled back by pointing CURRENT at an older directory. The derived IVF and
+compressed indexes are written the same way (see `write_versioned`).
+
+    python artifact.py            # show the current version
+    python artifact.py verify     # re-check its checksums
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+from pathlib import Path
+from catalog import Catalog
+from local_index import LocalIndex
+
+
+ARTIFACTS_PATH = Path(os.getenv("ARTIFACTS_PATH", "JSONs/artifacts"))
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.json"
+CATALOG_FILE = "products.catalog"
+ARTIFACT_FILES = (VECTORS_FILE, IDS_FILE, CATALOG_FILE)
+# Indexes derived from a version's vectors, built into the version by ingest.py (see
+# `write_artifact`), so they always match its catalog and the API only loads them.
+ANN_DIR = "product_ann"
+QUANTIZED_DIR = "product_vectors_quantized"
+FORMAT_VERSION = 1
+
+KEEP_VERSIONS = int(os.getenv("ARTIFACT_KEEP_VERSIONS", "3"))
+# Re-hash the files before serving them. Costs one sequential read of the artifact.
+ARTIFACT_VERIFY = os.getenv("ARTIFACT_VERIFY", "1") == "1"
+
+CHECKSUM_CHUNK = 1 << 20
+
+
+def file_checksum(path):
+    digest = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(CHECKSUM_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def combined_checksum(files):
+    """
+    One checksum for the artifact, from the per-file checksums.
+    """
+    digest = hashlib.sha256()
+    for name in sorted(files):
+        digest.update(f"{name}:{files[name]}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+
+def content_checksum(files, model):
+    """
+    What the served data depends on: the id order, the catalog and the embedding model.
+    The vectors are left out. They are re-derived from the embedding cache and
+    re-normalised on every run, so their bytes can differ by rounding for the same
+    data, while a product's embedding only changes with its description (in the
+    catalog) or the model.
+    """
+    return combined_checksum({IDS_FILE: files[IDS_FILE], CATALOG_FILE: files[CATALOG_FILE], "model": model})
+
+
+def current_version(root=ARTIFACTS_PATH):
+    """
+    The version named by CURRENT, or None if no artifact has been written.
+    """
+    try:
+        version = (root / CURRENT_FILE).read_text(encoding="utf-8").strip()
+    except FileNotFoundError:
+        return None
+    return version or None
+
+
+def read_manifest(version, root=ARTIFACTS_PATH):
+    with (root / version / MANIFEST_FILE).open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def set_current(version, root=ARTIFACTS_PATH):
+    tmp_path = root / (CURRENT_FILE + ".tmp")
+    tmp_path.write_text(version + "\n", encoding="utf-8")
+    os.replace(tmp_path, root / CURRENT_FILE)
+
+
+def version_name(created, suffix):
+    """
+    Versions sort by creation time: UTC timestamp, then `suffix`.
+    """
+    return time.strftime("%Y%m%dT%H%M%S", time.gmtime(created)) + f".{int(created % 1 * 1e6):06d}Z-{suffix}"
+
+
+def version_path(root):
+    """
+    The directory to read a versioned directory (see `write_versioned`) from: the
+    version CURRENT names, or `root` itself if it was written before versioning.
+    """
+    version = current_version(root)
+    return root / version if version is not None else root
+
+
+def write_versioned(root, write, keep=2):
+    """
+    Replaces the contents of the directory `root` all at once. `write(path)` fills a
+    fresh temporary directory, which is renamed to a new version; CURRENT is then
+    pointed at it. No file is ever rewritten in place, so a process that memory-maps
+    the previous version keeps reading one consistent set of files. The newest `keep`
+    versions are kept. Returns the new version's path.
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    tmp_path = root / f".tmp-{os.getpid()}-{time.monotonic_ns()}"
+    tmp_path.mkdir()
+    try:
+        write(tmp_path)
+        version = version_name(time.time(), os.getpid())
+        os.rename(tmp_path, root / version)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    set_current(version, root)
+    prune(root, keep)
+    return root / version
+
+
+def write_artifact(local_index, catalog, model, root=ARTIFACTS_PATH, derived=None):
+    """
+    Writes `local_index` and `catalog` as a new version and makes it current.
+    If the current version holds the same data (see `content_checksum`) it is kept
+    and no new one is written. Returns the version.
+
+    `derived(path, previous)` adds the derived indexes to the version directory
+    `path` before the version is published; `previous` is the directory of the
+    version it replaces, to carry them forward from, or None. A kept version gets
+    any derived index it lacks, each written in one step (see `write_versioned`).
+    """
+    root.mkdir(parents=True, exist_ok=True)
+    tmp_path = root / f".tmp-{os.getpid()}-{time.monotonic_ns()}"
+    tmp_path.mkdir()
+    try:
+        local_index.save(tmp_path / VECTORS_FILE, tmp_path / IDS_FILE)
+        catalog.save(tmp_path / CATALOG_FILE)
+        files = {name: file_checksum(tmp_path / name) for name in ARTIFACT_FILES}
+        checksum = combined_checksum(files)
+        content = content_checksum(files, model)
+
+        current = current_version(root)
+        if current is not None:
+            try:
+                unchanged = read_manifest(current, root).get("content") == content
+            except (OSError, ValueError, KeyError):
+                unchanged = False
+            if unchanged:
+                shutil.rmtree(tmp_path)
+                print(f"Artifact unchanged; keeping version {current}.")
+                if derived is not None:
+                    derived(root / current, None)
+                return current
+
+        if derived is not None:
+            derived(tmp_path, root / current if current is not None else None)
+
+        created = time.time()
+        version = version_name(created, checksum[:12])
+        manifest = {
+            "format": FORMAT_VERSION,
+            "version": version,
+            "created": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(created)),
+            "model": model,
+            "dimension": int(local_index.dimension),
+            "count": len(local_index),
+            "files": files,
+            "checksum": checksum,
+            "content": content,
+        }
+        with (tmp_path / MANIFEST_FILE).open("w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.rename(tmp_path, root / version)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+
+    set_current(version, root)
+    prune(root)
+    print(f"Wrote index artifact {version} ({len(local_index)} vectors) to {root / version}")
+    return version
+
+
+def prune(root=ARTIFACTS_PATH, keep=KEEP_VERSIONS):
+    """
+    Deletes all but the newest `keep` versions, never the current one. Processes that
+    still map a deleted version keep reading it until they let go.
+    """
+    current = current_version(root)
+    versions = sorted(path.name for path in root.iterdir()
+                      if path.is_dir() and not path.name.startswith("."))
+    for version in versions[:-keep] if keep > 0 else versions:
+        if version != current:
+            shutil.rmtree(root / version, ignore_errors=True)
+
+
+def verify(version, root=ARTIFACTS_PATH):
+    """
+    Raises ValueError if any file of `version` does not match its manifest checksum.
+    Returns the manifest.
+    """
+    manifest = read_manifest(version, root)
+    if manifest.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Artifact {version} has unsupported format {manifest.get('format')}.")
+    for name in ARTIFACT_FILES:
+        if file_checksum(root / version / name) != manifest["files"][name]:
+            raise ValueError(f"Artifact {version}: checksum mismatch for {name}.")
+    if combined_checksum(manifest["files"]) != manifest["checksum"]:
+        raise ValueError(f"Artifact {version}: manifest checksum mismatch.")
+    return manifest
+
+
+def load_artifact(version=None, root=ARTIFACTS_PATH, check=ARTIFACT_VERIFY):
+    """
+    Opens an artifact (the current one by default). The matrix and the catalog are
+    memory-mapped. Returns (local index, catalog, manifest).
+    """
+    version = version or current_version(root)
+    if version is None:
+        raise FileNotFoundError(f"No index artifact in {root}.")
+    manifest = verify(version, root) if check else read_manifest(version, root)
+    path = root / version
+    local_index = LocalIndex.load(path / VECTORS_FILE, path / IDS_FILE)
+    if len(local_index) != manifest["count"]:
+        raise ValueError(f"Artifact {version} holds {len(local_index)} vectors, manifest says {manifest['count']}.")
+    catalog = Catalog.open_snapshot(path / CATALOG_FILE)[0]
+    return local_index, catalog, manifest
+
+
+def main():
+    command = sys.argv[1] if len(sys.argv) > 1 else "show"
+    version = current_version()
+    if version is None:
+        print(f"No index artifact in {ARTIFACTS_PATH}.")
+        return
+    manifest = verify(version) if command == "verify" else read_manifest(version)
+    print(json.dumps(manifest, indent=2))
+    if command == "verify":
+        print(f"Artifact {version} verified.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1 @@
+"""Reproducible offline benchmarks for the recommendation API (see loadgen.py)."""
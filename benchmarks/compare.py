@@ -0,0 +1,68 @@
+"""
+Compares two loadgen reports and flags performance regressions.
+
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+
+Exits with status 1 if throughput dropped, or any latency percentile grew, by more
+than --tolerance (a fraction, 0.10 by default).
+"""
+import sys
+import json
+import argparse
+from pathlib import Path
+
+
+LATENCY_KEYS = ("p50", "p95", "p99")
+
+
+def load_report(path: Path):
+    with path.open("r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline, candidate, tolerance):
+    """
+    Returns a list of (metric, baseline, candidate, change, regressed) rows.
+    """
+    rows = []
+
+    def add(metric, old, new, higher_is_better):
+        if old is None or new is None:
+            return
+        change = (new - old) / old if old else 0.0
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        rows.append((metric, old, new, change, regressed))
+
+    add("throughput_rps", baseline["throughput_rps"], candidate["throughput_rps"], True)
+    for key in LATENCY_KEYS:
+        add(f"latency_{key}_ms", (baseline["latency_ms"] or {}).get(key),
+            (candidate["latency_ms"] or {}).get(key), False)
+    for stage, stats in sorted((candidate.get("stages") or {}).items()):
+        old_stats = (baseline.get("stages") or {}).get(stage)
+        if old_stats:
+            add(f"stage_{stage}_p95_ms", old_stats["latency_ms"]["p95"], stats["latency_ms"]["p95"], False)
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare two benchmark reports.")
+    parser.add_argument("baseline", type=Path)
+    parser.add_argument("candidate", type=Path)
+    parser.add_argument("--tolerance", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    baseline = load_report(args.baseline)
+    candidate = load_report(args.candidate)
+    print(f"baseline {baseline['meta']['commit']}  ->  candidate {candidate['meta']['commit']}")
+
+    rows = compare(baseline, candidate, args.tolerance)
+    for metric, old, new, change, regressed in rows:
+        flag = "  REGRESSION" if regressed else ""
+        print(f"{metric:<32} {old:>12.3f} {new:>12.3f} {change:>+8.1%}{flag}")
+
+    if any(row[4] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
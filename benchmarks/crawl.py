@@ -0,0 +1,329 @@
+"""
+Crawl benchmark: the scrapers' detail-page crawl against a local fixture server.
+
+    python -m benchmarks.crawl --pages 650 --latency 0.2
+    python -m benchmarks.crawl --modes crawler --per-host 4 --min-interval 0.1
+
+The fixture server serves synthetic SHL-style product pages (and listing pages) on a
+local port, answering each request after --latency seconds, so the numbers reflect a
+remote site rather than localhost. Two modes crawl the same pages with the same parser
+(final.py's):
+
+  - "serial": what the scrapers did before crawler.py: one requests.get per page
+    (a new connection each time), then a fixed --serial-sleep pause
+  - "crawler": crawler.Crawler with a pooled session, --concurrency fetch threads and
+    its adaptive per-host throttle, capped by --per-host / --min-interval (the
+    crawler's defaults), parsing in --parse-workers processes
+  - "matched": the crawler held to the request rate "serial" actually achieved (one
+    request in flight, starts spaced by serial's mean time per page), so the two are
+    compared at the same load on the site. It needs "serial" to run first
+
+"recrawl" then crawls again, revalidating the pages "crawler" cached with conditional
+GETs (the server answers 304 for an unchanged ETag), and "offline" re-parses them from
+the cache without touching the server:
+
+    python -m benchmarks.crawl --modes crawler,recrawl,offline
+
+--server-capacity makes the server answer 429 with a Retry-After beyond that many
+concurrent requests, to watch the throttle back off and settle under the limit.
+
+The server measures what the site actually saw (connections opened, 429s sent, peak
+concurrent requests, mean request rate, most request starts in any second). "serial"
+never has more than one request in flight, so "crawler" only matches its politeness
+where those numbers match; "matched" is the like-for-like comparison.
+
+    python -m benchmarks.crawl --modes serial,crawler,matched
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import requests
+
+SCRAPERS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data_Collection_&_Processing")
+sys.path.insert(0, SCRAPERS_DIR)
+
+from crawler import Crawler, HEADERS, CRAWL_PER_HOST, CRAWL_MIN_INTERVAL, CRAWL_PARSE_WORKERS  # noqa: E402
+from http_cache import HTTPCache  # noqa: E402
+
+PAGE_FILLER_KB = 40
+MODES = ("serial", "crawler")
+ALL_MODES = ("serial", "crawler", "matched", "recrawl", "offline")
+LAST_MODIFIED = "Mon, 07 Apr 2025 09:00:00 GMT"
+
+TEST_TYPE_KEYS = "ABCDEKPS"
+LANGUAGES = ("English (USA)", "English International", "French", "German", "Spanish", "Latin American Spanish")
+
+
+def product_page(number, filler_kb=PAGE_FILLER_KB):
+    """
+    A product detail page laid out like the SHL catalogue's, padded with navigation
+    markup to about `filler_kb` KB so parsing costs what a real page does.
+    """
+    filler = "".join(
+        f'<li class="nav__item"><a class="nav__link" href="/solutions/{i}/">Solution area {i}</a></li>'
+        for i in range(filler_kb * 1024 // 90)
+    )
+    languages = ", ".join(LANGUAGES[:1 + number % len(LANGUAGES)]) + ","
+    rows = [
+        ("Description", f"Multi-choice test that measures the knowledge of topic {number} and how it is applied at work."),
+        ("Job levels", "Entry-Level, Graduate, Mid-Professional,"),
+        ("Languages", languages),
+        ("Assessment length", f"Approximate Completion Time in minutes = {5 + number % 50}"),
+    ]
+    details = "".join(
+        f'<div class="product-catalogue-training-calendar__row typ"><h4>{heading}</h4><p>{text}</p></div>'
+        for heading, text in rows
+    )
+    return (f'<!DOCTYPE html><html><head><title>Product {number} | SHL</title></head><body>'
+            f'<header><nav><ul class="nav">{filler}</ul></nav></header>'
+            f'<main><h1>Product {number}</h1><div class="product-catalogue module">{details}</div></main>'
+            f'<footer><ul>{filler[:len(filler) // 4]}</ul></footer></body></html>')
+
+
+def listing_page(start, solution_type=1, per_page=12, total=650, filler_kb=PAGE_FILLER_KB, base_url=""):
+    """
+    A catalogue listing page: a table of `per_page` products starting at `start`, with
+    the header scrapper2.py looks for ("Individual Test Solutions", type 1) or
+    "Pre-packaged Job Solutions" (type 2). Product links are relative to `base_url`.
+    """
+    header = "Individual Test Solutions" if solution_type == 1 else "Pre-packaged Job Solutions"
+    rows = []
+    for number in range(start, min(start + per_page, total)):
+        keys = "".join(f'<span class="product-catalogue__key">{TEST_TYPE_KEYS[(number + i) % 8]}</span>'
+                       for i in range(1 + number % 3))
+        remote = '<span class="catalogue__circle -yes"></span>' if number % 2 else ""
+        adaptive = '<span class="catalogue__circle -yes"></span>' if number % 5 == 0 else ""
+        rows.append(f'<tr data-entity-id="{number}"><td class="custom__table-heading__title">'
+                    f'<a href="{base_url}/solutions/products/product-catalog/view/product-{number}/">Product {number}</a></td>'
+                    f'<td class="custom__table-heading__general">{remote}</td>'
+                    f'<td class="custom__table-heading__general">{adaptive}</td>'
+                    f'<td class="custom__table-heading__general product-catalogue__keys">{keys}</td></tr>')
+    filler = "".join(f'<li class="nav__item"><a href="/solutions/{i}/">Solution area {i}</a></li>'
+                     for i in range(filler_kb * 1024 // 80))
+    table = (f'<div class="custom__table-wrapper"><table><tbody><tr><th class="custom__table-heading__title">{header}</th>'
+             f'<th>Remote Testing</th><th>Adaptive/IRT</th><th>Test Type</th></tr>{"".join(rows)}</tbody></table></div>')
+    return (f'<!DOCTYPE html><html><head><title>Product Catalog | SHL</title></head><body>'
+            f'<header><nav><ul>{filler}</ul></nav></header><main>{table}</main></body></html>')
+
+
+class FixtureServer:
+    """
+    Threaded HTTP/1.1 server for product and listing pages, with an artificial
+    per-request latency. Records connections, peak concurrency and request start times.
+    """
+
+    def __init__(self, latency=0.2, filler_kb=PAGE_FILLER_KB, capacity=0, retry_after=1, total=650):
+        self.latency = latency
+        self.filler_kb = filler_kb
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.total = total
+        self.connections = 0
+        self.requests = 0
+        self.throttled = 0
+        self.not_modified = 0
+        self.bytes_sent = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.starts = []
+        self._lock = threading.Lock()
+        self._pages = {}
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def do_GET(self):
+                with server._lock:
+                    server.requests += 1
+                    server.in_flight += 1
+                    server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+                    server.starts.append(time.monotonic())
+                    overloaded = 0 < server.capacity < server.in_flight
+                    if overloaded:
+                        server.throttled += 1
+                try:
+                    time.sleep(server.latency)
+                    if overloaded:
+                        self.send_response(429)
+                        self.send_header("Retry-After", str(server.retry_after))
+                        body = b"Too many requests"
+                        self.send_header("Content-Length", str(len(body)))
+                    else:
+                        body = server.page(self.path)
+                        etag = f'"{hashlib.sha1(body.encode("utf-8")).hexdigest()[:16]}"' if body else None
+                        if etag and self.headers.get("If-None-Match") == etag:
+                            self.send_response(304)
+                            body = b""
+                            with server._lock:
+                                server.not_modified += 1
+                        else:
+                            self.send_response(200 if body is not None else 404)
+                            body = (body or "Not found").encode("utf-8")
+                            self.send_header("Content-Length", str(len(body)))
+                        if etag:
+                            self.send_header("ETag", etag)
+                            self.send_header("Last-Modified", LAST_MODIFIED)
+                    self.send_header("Content-Type", "text/html; charset=utf-8")
+                    self.end_headers()
+                    self.wfile.write(body)
+                    with server._lock:
+                        server.bytes_sent += len(body)
+                finally:
+                    with server._lock:
+                        server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        self.base_url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        threading.Thread(target=self.httpd.serve_forever, name="fixture-server", daemon=True).start()
+
+    def page(self, path):
+        if path not in self._pages:
+            if "/view/product-" in path:
+                self._pages[path] = product_page(int(path.rstrip("/").rsplit("-", 1)[1]), self.filler_kb)
+            elif "start=" in path:
+                start = int(path.split("start=")[1].split("&")[0])
+                self._pages[path] = listing_page(start, 2 if "type=2" in path else 1, total=self.total,
+                                                 filler_kb=self.filler_kb, base_url=self.base_url)
+            else:
+                return None
+        return self._pages[path]
+
+    def listing_urls(self, solution_type=1):
+        """
+        The catalogue pages listing all `total` products, 12 to a page.
+        """
+        return [f"{self.base_url}/solutions/products/product-catalog/?start={start}&type={solution_type}"
+                for start in range(0, self.total, 12)]
+
+    def product_urls(self, count):
+        return [f"{self.base_url}/solutions/products/product-catalog/view/product-{number}/" for number in range(count)]
+
+    def reset(self):
+        with self._lock:
+            self.connections = self.requests = self.throttled = self.not_modified = self.peak_in_flight = 0
+            self.bytes_sent = 0
+            self.starts = []
+
+    def observed(self):
+        with self._lock:
+            starts = sorted(self.starts)
+            # Most request starts within any one-second window.
+            peak_per_second, first = 0, 0
+            for last, start in enumerate(starts):
+                while start - starts[first] >= 1.0:
+                    first += 1
+                peak_per_second = max(peak_per_second, last - first + 1)
+            return {
+                "requests": self.requests,
+                "throttled_429": self.throttled,
+                "not_modified_304": self.not_modified,
+                "body_bytes_sent": self.bytes_sent,
+                "connections": self.connections,
+                "peak_concurrent_requests": self.peak_in_flight,
+                "peak_requests_per_second": peak_per_second,
+            }
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+def crawl_serial(urls, parse, sleep):
+    """The scrapers' original loop: requests.get per page, then a fixed pause."""
+    results = []
+    for url in urls:
+        response = requests.get(url, headers=HEADERS, timeout=30)
+        response.raise_for_status()
+        results.append(parse(response.text, url))
+        time.sleep(sleep)
+    return results
+
+
+def crawl_concurrent(urls, parse, args, cache):
+    crawler = Crawler(concurrency=args.concurrency, per_host=args.per_host, min_interval=args.min_interval,
+                      cache=cache, parse_workers=args.parse_workers)
+    results = []
+    for url, result, error in crawler.crawl(urls, parse):
+        if error:
+            raise error
+        results.append(result)
+    crawler.close()
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers' crawl against a local fixture server.")
+    parser.add_argument("--pages", type=int, default=650, help="Detail pages to crawl.")
+    parser.add_argument("--latency", type=float, default=0.2, help="Server response time per request, in seconds.")
+    parser.add_argument("--page-kb", type=int, default=PAGE_FILLER_KB, help="Navigation filler per page, in KB.")
+    parser.add_argument("--server-capacity", type=int, default=0,
+                        help="Answer 429 (with Retry-After) beyond this many requests in flight; 0 for no limit.")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After of those 429s, in seconds.")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Comma-separated, from: {', '.join(ALL_MODES)}.")
+    parser.add_argument("--serial-sleep", type=float, default=0.2, help="Pause between pages in serial mode (final.py's).")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--per-host", type=int, default=CRAWL_PER_HOST)
+    parser.add_argument("--min-interval", type=float, default=CRAWL_MIN_INTERVAL)
+    parser.add_argument("--parse-workers", type=int, default=CRAWL_PARSE_WORKERS,
+                        help="Parser processes; 0 parses on the fetching threads.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    from final import parse_course_page
+
+    server = FixtureServer(args.latency, args.page_kb, args.server_capacity, args.retry_after)
+    urls = server.product_urls(args.pages)
+    report = {"pages": args.pages, "latency_s": args.latency, "parse_workers": args.parse_workers, "modes": {}}
+    outputs = {}
+    # "crawler" fills a scratch cache that "recrawl" revalidates and "offline" reads.
+    cache_path = tempfile.mkdtemp(prefix="crawl-cache-")
+    for mode in args.modes.split(","):
+        if mode not in ALL_MODES:
+            raise SystemExit(f"Unknown mode {mode!r}; choose from {', '.join(ALL_MODES)}.")
+        server.reset()
+        started = time.perf_counter()
+        if mode == "serial":
+            outputs[mode] = crawl_serial(urls, parse_course_page, args.serial_sleep)
+        elif mode == "matched":
+            if "serial" not in report["modes"]:
+                raise SystemExit('"matched" needs "serial" earlier in --modes.')
+            gap = report["modes"]["serial"]["elapsed_s"] / args.pages
+            matched = argparse.Namespace(**{**vars(args), "per_host": 1, "min_interval": gap})
+            outputs[mode] = crawl_concurrent(urls, parse_course_page, matched, False)
+        else:
+            cache = HTTPCache(cache_path, offline=mode == "offline")
+            outputs[mode] = crawl_concurrent(urls, parse_course_page, args, cache)
+        elapsed = time.perf_counter() - started
+        observed = server.observed()
+        report["modes"][mode] = dict(elapsed_s=round(elapsed, 3), pages_per_s=round(args.pages / elapsed, 2),
+                                     requests_per_s=round(observed["requests"] / elapsed, 2), **observed)
+        print(f"{mode}: {args.pages} pages in {elapsed:.2f}s ({args.pages / elapsed:.1f} pages/s)")
+    server.close()
+    shutil.rmtree(cache_path, ignore_errors=True)
+    if len(outputs) > 1:
+        first, *rest = outputs.values()
+        report["same_output"] = all(output == first for output in rest)
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Offline stand-ins for the Gemini embedding API and the Pinecone index.
+
+Both are deterministic and add a configurable latency per call, so the Flask app can
+be load-tested without network access or API quota and still behave like the real
+thing from the outside.
+"""
+import re
+import time
+import random
+import hashlib
+import numpy as np
+from embedding_cache import normalize_query
+
+
+DIMENSION = 768
+
+
+def _token_vector(token, dimension):
+    seed = int.from_bytes(hashlib.sha256(token.encode("utf-8")).digest()[:8], "little")
+    return np.random.default_rng(seed).standard_normal(dimension).astype(np.float32)
+
+
+class FakeEmbedder:
+    """
+    Hashed bag-of-words embeddings: every token maps to a fixed random vector and a
+    text embeds to the normalised sum of its tokens plus a shared component. Texts that
+    share words score higher, and all scores land in the range the real model produces,
+    so thresholds behave realistically.
+
+    `latency` seconds (plus up to `jitter`) are slept per API call. `embed_documents`
+    counts as one call per batch, like the real client.
+    """
+
+    def __init__(self, dimension=DIMENSION, latency=0.0, jitter=0.0, seed=0, shared_weight=1.2):
+        self.dimension = dimension
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._random = random.Random(seed)
+        self._shared = _token_vector(f"__shared__{seed}", dimension) * shared_weight
+
+    def _sleep(self):
+        self.calls += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def embed(self, text):
+        tokens = re.findall(r"\w+", normalize_query(text))
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for token in tokens:
+            vector += _token_vector(token, self.dimension)
+        if tokens:
+            vector /= np.linalg.norm(vector)
+        vector += self._shared / np.linalg.norm(self._shared)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def embed_query(self, text, **kwargs):
+        self._sleep()
+        return self.embed(text)
+
+    def embed_documents(self, texts, **kwargs):
+        self._sleep()
+        return [self.embed(text) for text in texts]
+
+
+def metadata_matches(metadata, condition):
+    """
+    Evaluates the subset of Pinecone's metadata filter language that filters.py emits.
+    """
+    for key, value in condition.items():
+        if key == "$and":
+            if not all(metadata_matches(metadata, clause) for clause in value):
+                return False
+            continue
+        field = metadata.get(key)
+        for op, operand in value.items():
+            values = field if isinstance(field, list) else [field]
+            if op == "$eq" and field != operand:
+                return False
+            if op == "$in" and not any(v in operand for v in values):
+                return False
+            if op == "$lte" and (field is None or field > operand):
+                return False
+            if op == "$gte" and (field is None or field < operand):
+                return False
+    return True
+
+
+class FakeIndex:
+    """
+    Pinecone-like index backed by an exact in-memory search. Each `query` sleeps
+    `latency` seconds first to stand in for the network round trip. It deliberately has
+    no `query_many`, so batch lookups take the same concurrent path as real Pinecone.
+    Metadata filters are applied against `metadata` ({id: pinecone_metadata(product)}).
+    """
+
+    def __init__(self, local_index, metadata=None, latency=0.0, jitter=0.0, seed=0):
+        self.local_index = local_index
+        self.metadata = metadata or {}
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = 0
+        self._random = random.Random(seed)
+
+    def query(self, vector, top_k=10, include_metadata=False, filter=None, **kwargs):
+        self.calls += 1
+        delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay)
+        mask = None
+        if filter:
+            mask = np.array([metadata_matches(self.metadata.get(product_id, {}), filter)
+                             for product_id in self.local_index.ids], dtype=bool)
+        return self.local_index.query(vector, top_k=top_k, mask=mask)
+
+
+def build_catalog_index(products, embedder):
+    """
+    Embeds every product description with `embedder` (without its latency) and returns
+    a LocalIndex over them.
+    """
+    from local_index import LocalIndex
+
+    ids = [product["id"] for product in products]
+    vectors = np.asarray([embedder.embed(product.get("description", "")) for product in products],
+                         dtype=np.float32)
+    return LocalIndex(ids, vectors)
@@ -0,0 +1,292 @@
+"""
+Load generator and benchmark for the recommendation API.
+
+    python -m benchmarks.loadgen --concurrency 16 --duration 30
+    python -m benchmarks.loadgen --rate 200 --duration 30 --embed-latency 0.08 --index-latency 0.03
+    python -m benchmarks.loadgen --url http://localhost:5000 --concurrency 32
+
+Without --url, api.py is served in-process on a local port with the fake embedder and
+index from benchmarks/fakes.py, so a run needs no network access and no API keys.
+Queries from --queries are replayed in order, either by a fixed number of concurrent
+clients (closed loop, --concurrency) or at a fixed arrival rate (open loop, --rate).
+In open-loop mode latency is measured from each request's scheduled start, so a
+backed-up server is not hidden by the generator slowing down.
+
+The report (throughput, latency percentiles, per-stage timings and allocations,
+upstream call counts) is printed and written as JSON to --output, by default
+benchmarks/results/<timestamp>-<commit>.json. Compare runs with benchmarks/compare.py.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import threading
+import subprocess
+from pathlib import Path
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import requests
+
+
+RESULTS_DIR = Path("benchmarks/results")
+QUERIES_PATH = Path("benchmarks/queries.txt")
+
+
+def percentile(sorted_values, pct):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def summarize_ms(seconds):
+    values = sorted(seconds)
+    if not values:
+        return None
+    return {
+        "mean": round(sum(values) / len(values) * 1000, 3),
+        "p50": round(percentile(values, 50) * 1000, 3),
+        "p95": round(percentile(values, 95) * 1000, 3),
+        "p99": round(percentile(values, 99) * 1000, 3),
+        "max": round(values[-1] * 1000, 3),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class StageRecorder:
+    """Collects the raw per-stage samples reported through metrics.observers."""
+
+    def __init__(self):
+        self.samples = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, stage, seconds, allocated_blocks):
+        with self._lock:
+            self.samples.setdefault(stage, []).append((seconds, allocated_blocks))
+
+    def clear(self):
+        with self._lock:
+            self.samples.clear()
+
+    def report(self):
+        with self._lock:
+            report = {}
+            for stage, samples in self.samples.items():
+                report[stage] = {
+                    "count": len(samples),
+                    "latency_ms": summarize_ms([seconds for seconds, _ in samples]),
+                    "mean_allocated_blocks": round(sum(blocks for _, blocks in samples) / len(samples), 1),
+                }
+            return report
+
+
+def start_local_server(args):
+    """
+    Serves api.py on a free local port with the fakes installed and returns
+    (base_url, fakes, stage_recorder).
+    """
+    os.environ["API_AUTOSTART"] = "0"
+    os.environ["WARMUP_QUERY"] = ""
+    from werkzeug.serving import make_server
+    import api
+    import metrics
+    from catalog import Catalog
+    from engine import load_products, PRODUCTS_JSON_PATH
+    from filters import pinecone_metadata
+    from benchmarks.fakes import FakeEmbedder, FakeIndex, build_catalog_index
+
+    embedder = FakeEmbedder(latency=args.embed_latency, jitter=args.jitter)
+    products = list(load_products(PRODUCTS_JSON_PATH).values())
+    catalog_index = build_catalog_index(products, embedder)
+
+    api.engine.catalog = Catalog.from_products(products)
+    api.engine.embedder = embedder
+    if args.backend == "local":
+        api.engine.backend = "local"
+        api.engine.index = catalog_index
+        index = None
+    else:
+        api.engine.backend = "pinecone"
+        metadata = {product["id"]: pinecone_metadata(product) for product in products}
+        index = api.engine.index = FakeIndex(catalog_index, metadata, latency=args.index_latency,
+                                             jitter=args.jitter)
+
+    api.start_background_init()
+    if not api.ready.wait(30):
+        raise RuntimeError(f"API did not become ready: {api.startup}")
+    if args.no_embedding_cache:
+        api.engine.query_embeddings.max_size = 0
+    if args.no_response_cache:
+        api.responses.max_size = 0
+
+    recorder = StageRecorder()
+    metrics.observers.append(recorder)
+
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    server = make_server("127.0.0.1", 0, api.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", {"embedder": embedder, "index": index}, recorder
+
+
+class LoadGenerator:
+    def __init__(self, base_url, queries, top_k=None):
+        self.url = base_url.rstrip("/") + "/recommend"
+        self.queries = queries
+        self.top_k = top_k
+        self.latencies = []
+        self.statuses = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def _next_query(self):
+        with self._lock:
+            query = self.queries[self._next % len(self.queries)]
+            self._next += 1
+            return query
+
+    def send(self, scheduled=None):
+        body = {"query": self._next_query()}
+        if self.top_k:
+            body["top_k"] = self.top_k
+        started = time.perf_counter() if scheduled is None else scheduled
+        try:
+            status = str(self._session().post(self.url, json=body, timeout=60).status_code)
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            if status in ("200", "404"):
+                self.latencies.append(elapsed)
+
+    def run_closed_loop(self, concurrency, duration, max_requests=None):
+        deadline = time.perf_counter() + duration
+
+        def client():
+            while time.perf_counter() < deadline:
+                if max_requests is not None:
+                    with self._lock:
+                        if self._next >= max_requests:
+                            return
+                self.send()
+
+        threads = [threading.Thread(target=client) for _ in range(concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def run_open_loop(self, rate, duration, max_in_flight):
+        started = time.perf_counter()
+        total = int(rate * duration)
+        with ThreadPoolExecutor(max_workers=max_in_flight) as pool:
+            for i in range(total):
+                scheduled = started + i / rate
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(self.send, scheduled)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the /recommend endpoint.")
+    parser.add_argument("--url", help="Benchmark a running server instead of an in-process one with fakes.")
+    parser.add_argument("--queries", type=Path, default=QUERIES_PATH, help="Query corpus, one per line.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Closed loop: concurrent clients.")
+    parser.add_argument("--rate", type=float, help="Open loop: requests per second (overrides --concurrency).")
+    parser.add_argument("--max-in-flight", type=int, default=256, help="Open loop: cap on outstanding requests.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to run.")
+    parser.add_argument("--requests", type=int, help="Closed loop: stop after this many requests.")
+    parser.add_argument("--warmup", type=float, default=1.0, help="Seconds of traffic excluded from the report.")
+    parser.add_argument("--top-k", type=int)
+    parser.add_argument("--backend", choices=["local", "pinecone"], default="local",
+                        help="In-process only: exact local index, or the fake remote index.")
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="Fake embedding API latency (s).")
+    parser.add_argument("--index-latency", type=float, default=0.0, help="Fake Pinecone latency (s).")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency per fake call (s).")
+    parser.add_argument("--no-embedding-cache", action="store_true")
+    parser.add_argument("--no-response-cache", action="store_true")
+    parser.add_argument("--output", type=Path, help="Where to write the JSON report.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    with args.queries.open("r", encoding="utf-8") as f:
+        queries = [line.strip() for line in f if line.strip()]
+
+    fakes, recorder = {}, None
+    base_url = args.url
+    if base_url is None:
+        base_url, fakes, recorder = start_local_server(args)
+
+    if args.warmup > 0:
+        LoadGenerator(base_url, queries, args.top_k).run_closed_loop(args.concurrency, args.warmup)
+    if recorder is not None:
+        recorder.clear()
+    calls_before = {name: fake.calls for name, fake in fakes.items() if fake is not None}
+
+    generator = LoadGenerator(base_url, queries, args.top_k)
+    started = time.perf_counter()
+    if args.rate:
+        generator.run_open_loop(args.rate, args.duration, args.max_in_flight)
+    else:
+        generator.run_closed_loop(args.concurrency, args.duration, args.requests)
+    elapsed = time.perf_counter() - started
+
+    completed = sum(generator.statuses.values())
+    commit = git_commit()
+    report = {
+        "meta": {
+            "commit": commit,
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "config": {key: str(value) if isinstance(value, Path) else value for key, value in vars(args).items()},
+        },
+        "mode": "open_loop" if args.rate else "closed_loop",
+        "requests": completed,
+        "statuses": generator.statuses,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(completed / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": summarize_ms(generator.latencies),
+        "stages": recorder.report() if recorder is not None else None,
+        "upstream_calls": {name: fake.calls - calls_before[name] for name, fake in fakes.items() if fake is not None},
+    }
+
+    output = args.output
+    if output is None:
+        stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        output = RESULTS_DIR / f"{stamp}-{commit}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with output.open("w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps({key: report[key] for key in ("requests", "statuses", "throughput_rps", "latency_ms")}, indent=2))
+    print(f"Report written to {output}")
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Parse benchmark: the scrapers' HTML extraction over saved pages, per parser backend,
+whole-page versus subtree-only (see Data_Collection_&_Processing/extract.py).
+
+    python -m benchmarks.parse                         # synthetic SHL-style pages
+    python -m benchmarks.parse --from-cache            # pages saved in the HTTP cache
+    python -m benchmarks.parse --fixtures saved_pages/ # a directory of .html files
+
+Each scraper's parse function runs over the listing or product pages in every
+configuration: "full" (the whole page) or "subtrees", with html.parser and, if it is
+installed, lxml. It reports the time per page and the speed-up over full html.parser
+parsing, which is what the scrapers did before. It also checks that every
+configuration extracts exactly what that baseline does.
+"""
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import importlib
+import contextlib
+from pathlib import Path
+
+SCRAPERS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Data_Collection_&_Processing")
+sys.path.insert(0, SCRAPERS_DIR)
+
+import extract  # noqa: E402
+from http_cache import HTTPCache  # noqa: E402
+from benchmarks.crawl import product_page, listing_page  # noqa: E402
+
+# (module, function, kind of page it parses)
+SCRAPER_PARSERS = (
+    ("scrapper1", "parse_table_data", "listing"),
+    ("scrapper2", "parse_individual_table_data", "listing"),
+    ("Scrapper_PrePackage_csv", "parse_product_page", "product"),
+    ("final", "parse_course_page", "product"),
+    ("products", "parse_course_details", "product"),
+)
+BASELINE = ("full", "html.parser")
+
+
+def page_kind(url, html):
+    if "/view/" in url:
+        return "product"
+    return "listing" if "custom__table" in html else "product"
+
+
+def synthetic_fixtures(count):
+    pages = [(f"product-{number}", product_page(number)) for number in range(count)]
+    pages += [(f"listing-{start}", listing_page(start)) for start in range(0, count * 12, 12)]
+    return pages
+
+
+def directory_fixtures(path):
+    return [(str(file), file.read_text(encoding="utf-8", errors="replace"))
+            for file in sorted(Path(path).glob("*.htm*"))]
+
+
+def cache_fixtures(cache, limit):
+    pages = []
+    for entry_path in sorted(cache.root.glob("entries/*/*.json"))[:limit]:
+        with entry_path.open("r", encoding="utf-8") as f:
+            entry = json.load(f)
+        try:
+            pages.append((entry["url"], cache.read(entry)))
+        except OSError:
+            continue
+    return pages
+
+
+def configurations():
+    parsers = ["html.parser"] + (["lxml"] if extract.LXML_AVAILABLE else [])
+    return [(mode, parser) for parser in parsers for mode in ("full", "subtrees")]
+
+
+def run(parse, pages, mode, parser, repeat):
+    extract.HTML_SUBTREES = mode == "subtrees"
+    extract.HTML_PARSER = parser
+    started = time.perf_counter()
+    # The scrapers print when a page lacks what they look for; keep that out of the report.
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeat):
+            outputs = [parse(html, url) for url, html in pages]
+    return (time.perf_counter() - started) / (repeat * len(pages)), outputs
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the scrapers' HTML extraction.")
+    parser.add_argument("--fixtures", help="Directory of saved .html pages.")
+    parser.add_argument("--from-cache", action="store_true", help="Use the pages in the scrapers' HTTP cache.")
+    parser.add_argument("--pages", type=int, default=40, help="Synthetic product pages (and as many listings).")
+    parser.add_argument("--limit", type=int, default=500, help="Most pages read from the HTTP cache.")
+    parser.add_argument("--repeat", type=int, default=3)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.fixtures:
+        pages = directory_fixtures(args.fixtures)
+    elif args.from_cache:
+        pages = cache_fixtures(HTTPCache(), args.limit)
+    else:
+        pages = synthetic_fixtures(args.pages)
+    by_kind = {"listing": [], "product": []}
+    for url, html in pages:
+        by_kind[page_kind(url, html)].append((url, html))
+    print(f"{len(by_kind['product'])} product pages, {len(by_kind['listing'])} listing pages")
+
+    report = {"pages": {kind: len(kind_pages) for kind, kind_pages in by_kind.items()},
+              "lxml_installed": extract.LXML_AVAILABLE, "parsers": {}}
+    for module_name, function_name, kind in SCRAPER_PARSERS:
+        kind_pages = by_kind[kind]
+        if not kind_pages:
+            continue
+        parse = getattr(importlib.import_module(module_name), function_name)
+        # One untimed pass warms up imports and caches, and gives the reference output.
+        baseline_outputs = run(parse, kind_pages, *BASELINE, 1)[1]
+        results = {}
+        for mode, parser in configurations():
+            seconds, outputs = run(parse, kind_pages, mode, parser, args.repeat)
+            if (mode, parser) == BASELINE:
+                baseline_seconds = seconds
+            results[f"{mode}/{parser}"] = {
+                "ms_per_page": round(seconds * 1000, 3),
+                "speedup": round(baseline_seconds / seconds, 2),
+                "same_output": outputs == baseline_outputs,
+            }
+        name = f"{module_name}.{function_name}"
+        report["parsers"][name] = results
+        print(name)
+        for config, result in results.items():
+            print(f"  {config:22} {result['ms_per_page']:8.2f} ms/page  x{result['speedup']:<5}"
+                  f" {'same output' if result['same_output'] else 'OUTPUT DIFFERS'}")
+    print(json.dumps(report, indent=2))
+    return report
+
+
+if __name__ == "__main__":
+    main()
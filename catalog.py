@@ -0,0 +1,330 @@
+"""
+Compact, array-backed product catalog.
+
+`products.json` stays the source of truth, but parsing it into a dict of dicts costs
+time and memory per process that grow with the catalog. `python catalog.py` (or the
+first `Catalog.load`) compiles it into a binary snapshot: every field is stored as a
+column (numpy arrays, with text in one UTF-8 blob plus offsets and enum-like fields
+such as "Yes"/"No" and test types as small integer codes into a vocabulary). Loading
+memory-maps the snapshot, so startup does no parsing and workers forked from the same
+master share the pages.
+
+The snapshot also holds each product's /recommend response entry pre-serialized,
+both indented and compact, so responses are assembled by joining stored bytes.
+
+Snapshot layout: MAGIC, an 8-byte little-endian header length, a JSON header (source
+file stamp, vocabularies, column layout), then the raw arrays, each 8-byte aligned.
+"""
+import os
+import sys
+import json
+import mmap
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+from json_stream import iter_items
+
+
+PRODUCTS_JSON_PATH = Path("JSONs/products.json")
+SNAPSHOT_PATH = Path("JSONs/products.catalog")
+
+MAGIC = b"SHLCAT02"
+ALIGNMENT = 8
+
+# Free-text fields, stored as a UTF-8 blob plus offsets.
+TEXT_FIELDS = ("id", "url", "description")
+# Fields with a small set of distinct values, stored as codes into a vocabulary.
+ENUM_FIELDS = ("adaptive_support", "remote_support", "language")
+# Fields holding a list of enum-like labels.
+ENUM_LIST_FIELDS = ("test_type",)
+
+# Pre-serialized response entries. The indented form is laid out for the depth at which
+# entries sit in a /recommend response, matching json.dumps(response, indent=2).
+FRAGMENT_FORMATS = ("pretty", "compact")
+FRAGMENT_INDENT = "    "
+
+
+def source_stamp(path):
+    stat = path.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _parse_duration(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
+def _text_column(values):
+    encoded = [value.encode("utf-8") for value in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(value) for value in encoded], out=offsets[1:])
+    return {"offsets": offsets, "data": np.frombuffer(b"".join(encoded), dtype=np.uint8)}
+
+
+def _codes(values, vocabulary, lookup):
+    codes = []
+    for value in values:
+        code = lookup.get(value)
+        if code is None:
+            code = lookup[value] = len(vocabulary)
+            vocabulary.append(value)
+        codes.append(code)
+    return codes
+
+
+def response_record(product):
+    """
+    The fields of a product returned by /recommend, in response order. Accepts a
+    product dict from products.json or a Product.
+    """
+    get = product.get if isinstance(product, dict) else lambda name, default: getattr(product, name)
+    return OrderedDict([
+        ("url", get("url", "")),
+        ("adaptive_support", get("adaptive_support", "")),
+        ("description", get("description", "")),
+        ("duration", int(get("duration", None) or 0)),
+        ("remote_support", get("remote_support", "")),
+        ("test_type", get("test_type", []))
+    ])
+
+
+def render_fragment(record, compact=False):
+    if compact:
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":"))
+    return json.dumps(record, ensure_ascii=False, indent=2).replace("\n", "\n" + FRAGMENT_INDENT)
+
+
+class Product:
+    """
+    One catalog entry. Enum-like fields are the catalog's interned vocabulary strings,
+    so equal values share a single object across all products.
+    """
+
+    __slots__ = ("id", "url", "description", "duration", "adaptive_support",
+                 "remote_support", "language", "test_type")
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields[name])
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+class Catalog:
+    """
+    Columnar product catalog. `duration` is a float32 array (NaN where the catalog
+    states none), enum fields are integer code arrays with a shared `vocabularies`
+    entry, text fields are decoded on access. Rows are addressed by position; `get`
+    and `rows` map product IDs to positions.
+    """
+
+    def __init__(self, columns, vocabularies, buffer=None):
+        self.columns = columns
+        self.vocabularies = vocabularies
+        self.duration = columns["duration"]
+        self._buffer = buffer
+        ids = self.text("id")
+        self._positions = {product_id: row for row, product_id in enumerate(ids)}
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.duration)
+
+    def __contains__(self, product_id):
+        return product_id in self._positions
+
+    @classmethod
+    def from_products(cls, products):
+        """
+        Builds a catalog from a list of product dicts as stored in products.json.
+        """
+        columns = {}
+        for field in TEXT_FIELDS:
+            column = _text_column([product.get(field, "") or "" for product in products])
+            columns[field + ".offsets"] = column["offsets"]
+            columns[field + ".data"] = column["data"]
+        for fragment_format in FRAGMENT_FORMATS:
+            column = _text_column([render_fragment(response_record(product), fragment_format == "compact")
+                                   for product in products])
+            columns["fragment." + fragment_format + ".offsets"] = column["offsets"]
+            columns["fragment." + fragment_format + ".data"] = column["data"]
+        columns["duration"] = np.array([_parse_duration(product.get("duration")) for product in products],
+                                       dtype=np.float32)
+
+        vocabularies = {}
+        for field in ENUM_FIELDS:
+            vocabulary, lookup = [], {}
+            columns[field] = np.array(_codes([product.get(field, "") or "" for product in products],
+                                             vocabulary, lookup), dtype=np.int32)
+            vocabularies[field] = vocabulary
+        for field in ENUM_LIST_FIELDS:
+            vocabulary, lookup = [], {}
+            lists = [product.get(field) or [] for product in products]
+            offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+            np.cumsum([len(values) for values in lists], out=offsets[1:])
+            codes = _codes([value for values in lists for value in values], vocabulary, lookup)
+            columns[field + ".offsets"] = offsets
+            columns[field + ".codes"] = np.array(codes, dtype=np.int32)
+            vocabularies[field] = vocabulary
+        return cls(columns, vocabularies)
+
+    @classmethod
+    def from_json(cls, path=PRODUCTS_JSON_PATH):
+        return cls.from_products(list(iter_items(path)))
+
+    def text(self, field, rows=None):
+        """
+        Decodes a text column, for all rows or for the given row positions.
+        """
+        offsets = self.columns[field + ".offsets"]
+        data = self.columns[field + ".data"]
+        rows = range(len(offsets) - 1) if rows is None else rows
+        return [bytes(data[offsets[row]:offsets[row + 1]]).decode("utf-8") for row in rows]
+
+    def fragments(self, product_ids, compact=False):
+        """
+        The pre-serialized response entries (UTF-8 bytes) of `product_ids`, in order,
+        skipping IDs not in the catalog.
+        """
+        name = "fragment." + ("compact" if compact else "pretty")
+        offsets = self.columns[name + ".offsets"]
+        data = self.columns[name + ".data"]
+        fragments = []
+        for product_id in product_ids:
+            row = self._positions.get(product_id)
+            if row is not None:
+                fragments.append(data[offsets[row]:offsets[row + 1]].tobytes())
+        return fragments
+
+    def enum(self, field, row):
+        return self.vocabularies[field][self.columns[field][row]]
+
+    def enum_list(self, field, row):
+        offsets = self.columns[field + ".offsets"]
+        vocabulary = self.vocabularies[field]
+        return [vocabulary[code] for code in self.columns[field + ".codes"][offsets[row]:offsets[row + 1]]]
+
+    def has_value(self, field, value):
+        """
+        Boolean array over all rows: whether an enum field is `value`, or for a list
+        field, whether the list contains it.
+        """
+        vocabulary = self.vocabularies[field]
+        if value not in vocabulary:
+            return np.zeros(len(self), dtype=bool)
+        code = vocabulary.index(value)
+        if field in ENUM_FIELDS:
+            return self.columns[field] == code
+        offsets = self.columns[field + ".offsets"]
+        owners = np.repeat(np.arange(len(self)), np.diff(offsets))
+        result = np.zeros(len(self), dtype=bool)
+        result[owners[self.columns[field + ".codes"] == code]] = True
+        return result
+
+    def rows(self, product_ids):
+        """
+        Row positions of `product_ids`, -1 for IDs not in the catalog.
+        """
+        return np.array([self._positions.get(product_id, -1) for product_id in product_ids], dtype=np.int64)
+
+    def product(self, row):
+        duration = self.duration[row]
+        return Product(
+            id=self.ids[row],
+            url=self.text("url", [row])[0],
+            description=self.text("description", [row])[0],
+            duration=None if np.isnan(duration) else int(duration),
+            adaptive_support=self.enum("adaptive_support", row),
+            remote_support=self.enum("remote_support", row),
+            language=self.enum("language", row),
+            test_type=self.enum_list("test_type", row),
+        )
+
+    def get(self, product_id, default=None):
+        row = self._positions.get(product_id)
+        return default if row is None else self.product(row)
+
+    def save(self, path=SNAPSHOT_PATH, source=None):
+        """
+        Writes the binary snapshot atomically. `source` is the stamp of the JSON file it
+        was compiled from, used by `load` to detect a stale snapshot.
+        """
+        layout, offset = {}, 0
+        for name, array in self.columns.items():
+            offset = -(-offset // ALIGNMENT) * ALIGNMENT
+            layout[name] = {"dtype": array.dtype.str, "length": len(array), "offset": offset}
+            offset += array.nbytes
+        header = json.dumps({"source": source, "vocabularies": self.vocabularies, "columns": layout},
+                            ensure_ascii=False).encode("utf-8")
+        data_start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        tmp_path = path.with_name(path.name + ".tmp")
+        with tmp_path.open("wb") as f:
+            f.write(MAGIC + len(header).to_bytes(8, "little") + header)
+            for name, array in self.columns.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(np.ascontiguousarray(array).tobytes())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def open_snapshot(cls, path=SNAPSHOT_PATH):
+        """
+        Memory-maps a snapshot. Returns (catalog, source stamp).
+        """
+        with path.open("rb") as f:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot.")
+        header_length = int.from_bytes(buffer[len(MAGIC):len(MAGIC) + 8], "little")
+        header_end = len(MAGIC) + 8 + header_length
+        header = json.loads(buffer[len(MAGIC) + 8:header_end].decode("utf-8"))
+        data_start = -(-header_end // ALIGNMENT) * ALIGNMENT
+
+        columns = {}
+        for name, spec in header["columns"].items():
+            if spec["length"] == 0:
+                columns[name] = np.empty(0, dtype=np.dtype(spec["dtype"]))
+                continue
+            columns[name] = np.frombuffer(buffer, dtype=np.dtype(spec["dtype"]), count=spec["length"],
+                                          offset=data_start + spec["offset"])
+        return cls(columns, header["vocabularies"], buffer), header["source"]
+
+    @classmethod
+    def load(cls, json_path=PRODUCTS_JSON_PATH, snapshot_path=SNAPSHOT_PATH):
+        """
+        Opens the snapshot if it was compiled from the current `json_path`; otherwise
+        compiles it first. Falls back to an in-memory catalog if the snapshot cannot
+        be written.
+        """
+        stamp = source_stamp(json_path)
+        if snapshot_path.exists():
+            try:
+                catalog, source = cls.open_snapshot(snapshot_path)
+                if source == stamp:
+                    return catalog
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Ignoring unreadable catalog snapshot {snapshot_path}: {e}")
+
+        catalog = cls.from_json(json_path)
+        try:
+            catalog.save(snapshot_path, source=stamp)
+        except OSError as e:
+            print(f"Could not write catalog snapshot {snapshot_path}: {e}")
+            return catalog
+        print(f"Compiled catalog snapshot {snapshot_path} ({len(catalog)} products).")
+        return cls.open_snapshot(snapshot_path)[0]
+
+
+def main():
+    json_path = Path(sys.argv[1]) if len(sys.argv) > 1 else PRODUCTS_JSON_PATH
+    snapshot_path = Path(sys.argv[2]) if len(sys.argv) > 2 else SNAPSHOT_PATH
+    catalog = Catalog.from_json(json_path)
+    catalog.save(snapshot_path, source=source_stamp(json_path))
+    print(f"Wrote {len(catalog)} products to {snapshot_path} ({snapshot_path.stat().st_size} bytes).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+from pathlib import Path
+from collections import OrderedDict
+
+
+def normalize_query(query: str):
+    """
+    Folds a query to the form used as its cache key: unicode NFKC-normalised,
+    case-folded and with runs of whitespace collapsed to a single space.
+    """
+    query = unicodedata.normalize("NFKC", query)
+    return " ".join(query.casefold().split())
+
+
+class EmbeddingCache:
+    """
+    Caches query embeddings in front of an embedder's `embed_query`.
+
+    The first tier is an in-memory LRU bounded by `max_size` entries, with entries
+    expiring `ttl` seconds after they were computed. If `path` is given, a SQLite
+    file acts as a second tier that survives restarts and is shared by every
+    process pointing at it. Queries are looked up by `normalize_query`, so
+    "Java developer" and "  java  Developer" share one embedding.
+    """
+
+    def __init__(self, embedder, model: str, max_size=10000, ttl=7 * 24 * 3600, path: Path = None):
+        self.embedder = embedder
+        self.model = model
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS query_embeddings ("
+                "model TEXT NOT NULL, query TEXT NOT NULL, vector BLOB NOT NULL, "
+                "created REAL NOT NULL, PRIMARY KEY (model, query))"
+            )
+            self._db.commit()
+
+    def embed_query(self, query: str):
+        """
+        Returns the embedding for `query`, calling the embedder only on a miss in both tiers.
+        """
+        key = normalize_query(query)
+        vector = self._get(key)
+        if vector is not None:
+            return vector
+
+        vector = self.embedder.embed_query(query)
+        with self._lock:
+            self.misses += 1
+        self._put(key, vector, time.time(), persist=True)
+        return vector
+
+    def embed_queries(self, queries, batch_size=100):
+        """
+        Returns embeddings for a list of queries, in order. Cache misses are de-duplicated
+        and sent to the embedder's batch `embed_documents` API, `batch_size` texts per call.
+        """
+        keys = [normalize_query(query) for query in queries]
+        found = {}
+        pending = OrderedDict()
+        for key, query in zip(keys, queries):
+            if key in found or key in pending:
+                continue
+            vector = self._get(key)
+            if vector is None:
+                pending[key] = query
+            else:
+                found[key] = vector
+
+        pending_keys = list(pending)
+        for i in range(0, len(pending_keys), batch_size):
+            batch = pending_keys[i:i+batch_size]
+            # Same task type embed_query uses, so batch and single lookups agree.
+            vectors = self.embedder.embed_documents(
+                [pending[key] for key in batch],
+                task_type="RETRIEVAL_QUERY"
+            )
+            now = time.time()
+            for key, vector in zip(batch, vectors):
+                found[key] = vector
+                self._put(key, vector, now, persist=True)
+            with self._lock:
+                self.misses += len(batch)
+
+        return [found[key] for key in keys]
+
+    def stats(self):
+        """
+        Returns the hit/miss counters and the current in-memory size.
+        """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    def _get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                vector, created = entry
+                if now - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self._entries[key]
+
+            if self._db is None:
+                return None
+            row = self._db.execute(
+                "SELECT vector, created FROM query_embeddings WHERE model = ? AND query = ?",
+                (self.model, key)
+            ).fetchone()
+
+        if row is None or now - row[1] >= self.ttl:
+            return None
+        vector = array("d")
+        vector.frombytes(row[0])
+        vector = vector.tolist()
+        self._put(key, vector, row[1], persist=False)
+        with self._lock:
+            self.disk_hits += 1
+        return vector
+
+    def _put(self, key, vector, created, persist):
+        with self._lock:
+            self._entries[key] = (vector, created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+            if persist and self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO query_embeddings (model, query, vector, created) VALUES (?, ?, ?, ?)",
+                    (self.model, key, array("d", vector).tobytes(), created)
+                )
+                self._db.commit()
+
+
+def content_key(model: str, text: str):
+    """
+    Cache key of a document embedding: a hash of the model name and the exact text.
+    """
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+class DocumentEmbeddingCache:
+    """
+    Persistent store of document embeddings keyed by `content_key`, used by ingest.py
+    so text that has been embedded once is never sent to the embedding API again,
+    whichever product it belongs to. Entries never expire: the key changes whenever
+    the model or the text does.
+    """
+
+    LOOKUP_CHUNK = 500
+
+    def __init__(self, path: Path):
+        self.path = path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(str(path), check_same_thread=False, timeout=30)
+        self._lock = threading.Lock()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS document_embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, created REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def get_many(self, keys):
+        """
+        Returns {key: vector} for the keys that are cached.
+        """
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), self.LOOKUP_CHUNK):
+                chunk = keys[i:i+self.LOOKUP_CHUNK]
+                rows = self._db.execute(
+                    f"SELECT key, vector FROM document_embeddings WHERE key IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("d")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+        return found
+
+    def put_many(self, items):
+        """
+        Stores (key, vector) pairs.
+        """
+        now = time.time()
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO document_embeddings (key, vector, created) VALUES (?, ?, ?)",
+                [(key, array("d", vector).tobytes(), now) for key, vector in items]
+            )
+            self._db.commit()
@@ -0,0 +1,446 @@
+import os
+import time
+import itertools
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import artifact
+from catalog import Catalog, SNAPSHOT_PATH, response_record
+from embedding_cache import EmbeddingCache
+from filters import CatalogFilters, pinecone_filter
+from json_stream import iter_items
+import metrics
+
+
+load_dotenv()
+GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+PINECONE_API_KEY = os.getenv("PINECONE_API_KEY")
+
+
+PRODUCTS_JSON_PATH = Path("JSONs/products.json")
+# Compiled from PRODUCTS_JSON_PATH on first load (see catalog.py).
+CATALOG_SNAPSHOT_PATH = Path(os.getenv("CATALOG_SNAPSHOT_PATH", str(SNAPSHOT_PATH)))
+
+# Pinecone
+INDEX_NAME = "shl-product-index"
+DIMENSION = 768
+REGION = "us-east-1"
+INDEX_CREATE_TIMEOUT = 300
+
+# "pinecone" queries the hosted index, "local" scores in-process against the
+# matrix written by local_index.py / ingest.py and never talks to Pinecone.
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "pinecone")
+
+# Local backend storage: "float32" scans the exact matrix; "float16" / "int8" scan a
+# compressed copy (optionally reduced to LOCAL_INDEX_DIMENSION dimensions by "pca" or
+# "truncate") and re-score the best candidates exactly. See quantized_index.py.
+LOCAL_INDEX_STORAGE = os.getenv("LOCAL_INDEX_STORAGE", "float32")
+LOCAL_INDEX_DIMENSION = int(os.getenv("LOCAL_INDEX_DIMENSION", "0"))
+LOCAL_INDEX_REDUCTION = os.getenv("LOCAL_INDEX_REDUCTION", "pca")
+
+# LOCAL_INDEX_TYPE=ivf searches an approximate inverted-file index instead (see
+# ann_index.py); ANN_NPROBE overrides the number of clusters it searches per query.
+LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "exact")
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "0"))
+
+# Serve the catalog and the local index from the current artifact written by
+# ingest.py (see artifact.py) when there is one.
+USE_ARTIFACT = os.getenv("USE_ARTIFACT", "1") == "1"
+
+EMBEDDING_MODEL = "models/embedding-001"
+
+# Query embedding cache. Set EMBEDDING_CACHE_PATH to keep embeddings across restarts.
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH")
+
+SIMILARITY_THRESHOLD = 0.5
+MAX_RECOMMENDATIONS = 10
+
+# "fixed" (the default) keeps SIMILARITY_THRESHOLD. "dynamic" starts at THRESHOLD_START
+# and lowers the threshold by THRESHOLD_STEP until MIN_RESULTS matches pass or
+# THRESHOLD_FLOOR is reached. Every step is applied to the scores of a single query
+# over-fetched to OVERFETCH_TOP_K, so it costs one round trip.
+THRESHOLD_MODE = os.getenv("THRESHOLD_MODE", "fixed")
+THRESHOLD_START = float(os.getenv("THRESHOLD_START", "0.7"))
+THRESHOLD_STEP = float(os.getenv("THRESHOLD_STEP", "0.05"))
+THRESHOLD_FLOOR = float(os.getenv("THRESHOLD_FLOOR", str(SIMILARITY_THRESHOLD)))
+MIN_RESULTS = int(os.getenv("MIN_RESULTS", "3"))
+OVERFETCH_TOP_K = 50
+
+EMBED_BATCH_SIZE = 100
+QUERY_CONCURRENCY = 16
+
+
+def load_products(filepath: Path):
+    """
+    Loads the product JSON data and returns a dictionary mapping product ID to product details.
+    The file is parsed one product at a time.
+    """
+    return {item["id"]: item for item in iter_items(filepath)}
+
+
+def initialize_pinecone():
+    """
+    Connects to the Pinecone index, creating it first if it does not exist.
+    """
+    from pinecone import Pinecone, ServerlessSpec
+
+    pc = Pinecone(api_key=PINECONE_API_KEY)
+    if INDEX_NAME not in pc.list_indexes().names():
+        print(f"Creating index '{INDEX_NAME}' ...")
+        pc.create_index(
+            name=INDEX_NAME,
+            dimension=DIMENSION,
+            metric="cosine",
+            spec=ServerlessSpec(cloud="aws", region=REGION)
+        )
+
+        deadline = time.monotonic() + INDEX_CREATE_TIMEOUT
+        while INDEX_NAME not in pc.list_indexes().names():
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Index '{INDEX_NAME}' was not created within {INDEX_CREATE_TIMEOUT}s.")
+            time.sleep(1)
+    else:
+        print(f"Index '{INDEX_NAME}' already exists.")
+
+    return pc.Index(INDEX_NAME)
+
+
+def create_embedder():
+    from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
+
+    return GoogleGenerativeAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        google_api_key=GOOGLE_API_KEY
+    )
+
+
+def select_threshold(scores, start=THRESHOLD_START, step=THRESHOLD_STEP,
+                     floor=THRESHOLD_FLOOR, min_results=MIN_RESULTS):
+    """
+    Returns the highest threshold in start, start - step, ... floor that at least
+    `min_results` of `scores` reach, or `floor` if none does.
+    """
+    threshold = start
+    while threshold > floor and sum(score >= threshold for score in scores) < min_results:
+        threshold = max(round(threshold - step, 6), floor)
+    return threshold
+
+
+def search_top_k(top_k, threshold=None):
+    """
+    Number of matches to ask the index for: dynamic thresholding over-fetches so that
+    lowering the threshold never needs a second query.
+    """
+    if threshold is None and THRESHOLD_MODE == "dynamic":
+        return max(OVERFETCH_TOP_K, top_k)
+    return top_k
+
+
+def select_matches(search_response, top_k, threshold=None):
+    """
+    Keeps the best `top_k` matches that pass the similarity threshold. An explicit
+    `threshold` is applied as-is; otherwise THRESHOLD_MODE decides.
+    """
+    matches = search_response.get("matches", [])
+    if threshold is None:
+        if THRESHOLD_MODE == "dynamic":
+            threshold = select_threshold([match.get("score", 0) for match in matches])
+        else:
+            threshold = SIMILARITY_THRESHOLD
+
+    # Filter matches based on the similarity threshold.
+    filtered_matches = [
+        match for match in matches
+        if match.get("score", 0) >= threshold
+    ]
+    return filtered_matches[:top_k]
+
+
+class ServingData:
+    """
+    One consistent version of what requests read: the catalog, the index and the
+    filter bitmaps over both. It is not changed after construction; a reload builds a
+    new one and replaces `RecommendationEngine.data` in a single assignment, so a
+    request that took a reference when it started finishes on that version.
+    """
+
+    __slots__ = ("catalog", "index", "filters", "version", "generation")
+
+    # Numbers every ServingData built in this process: a new one per load or reload,
+    # whether or not it comes from an artifact.
+    _generations = itertools.count(1)
+
+    def __init__(self, catalog=None, index=None, version=None):
+        self.catalog = catalog
+        self.index = index
+        self.version = version
+        self.generation = next(self._generations)
+        self.filters = CatalogFilters(catalog, index.ids) if catalog is not None and hasattr(index, "ids") else None
+
+
+class RecommendationEngine:
+    """
+    Retrieval shared by the Flask API and the Streamlit app: embed the query, search
+    the vector index, apply the similarity threshold and hydrate the matches from the
+    product catalog.
+
+    Loading happens in two steps so a pre-fork server can share read-only data:
+    `load_local` reads the catalog (and the local index, if that backend is selected)
+    from disk and is safe to run before forking; `connect` creates the network
+    clients and must run in the process that will use them. `reload` swaps in newer
+    local data while requests are being served.
+    """
+
+    def __init__(self, max_recommendations=MAX_RECOMMENDATIONS, backend=VECTOR_BACKEND):
+        self.max_recommendations = max_recommendations
+        self.backend = backend
+        self.data = ServingData()
+        self.embedder = None
+        self.query_embeddings = None
+
+    @property
+    def catalog(self):
+        return self.data.catalog
+
+    @catalog.setter
+    def catalog(self, catalog):
+        self.data = ServingData(catalog, self.data.index, self.data.version)
+
+    @property
+    def index(self):
+        return self.data.index
+
+    @index.setter
+    def index(self, index):
+        self.data = ServingData(self.data.catalog, index, self.data.version)
+
+    @property
+    def filters(self):
+        return self.data.filters
+
+    @property
+    def loaded(self):
+        return self.catalog is not None and (self.backend != "local" or self.index is not None)
+
+    @property
+    def connected(self):
+        return self.query_embeddings is not None and self.index is not None
+
+    def load_local(self):
+        """
+        Loads everything that comes from local files. The catalog (and the exact local
+        index) are memory-mapped, so forked workers share them.
+        """
+        self.data = self.load_data()
+
+    def load_data(self, index=None):
+        """
+        Reads the catalog and, for the local backend, the index into a new ServingData
+        without touching the one being served. With an artifact (see artifact.py) the
+        catalog and every kind of local index come from that one version. Its IVF or
+        compressed index is built by ingest.py; a version without the configured one
+        is refused rather than trained here. Otherwise everything is read from JSONs/.
+        `index` (e.g. the Pinecone connection) is used as-is instead of loading one.
+        """
+        version = artifact.current_version() if USE_ARTIFACT else None
+        if version is not None:
+            artifact_index, catalog, manifest = artifact.load_artifact(version)
+            if manifest["model"] != EMBEDDING_MODEL:
+                raise ValueError(f"Artifact {version} was embedded with {manifest['model']}, "
+                                 f"queries use {EMBEDDING_MODEL}.")
+            print(f"Loaded index artifact {version}.")
+        else:
+            artifact_index = None
+            catalog = Catalog.load(PRODUCTS_JSON_PATH, CATALOG_SNAPSHOT_PATH)
+
+        if index is None and self.backend == "local":
+            if LOCAL_INDEX_TYPE == "ivf":
+                from ann_index import IVFIndex, load_or_build as load_ann_index, saved
+                if version is None:
+                    index = load_ann_index(nprobe=ANN_NPROBE or None)
+                elif saved(artifact.ARTIFACTS_PATH / version / artifact.ANN_DIR):
+                    index = IVFIndex.load(artifact.ARTIFACTS_PATH / version / artifact.ANN_DIR, ANN_NPROBE or None)
+                else:
+                    raise ValueError(f"Artifact {version} has no IVF index; run ingest.py with "
+                                     f"LOCAL_INDEX_TYPE=ivf to add one.")
+            elif LOCAL_INDEX_STORAGE == "float32" and not LOCAL_INDEX_DIMENSION:
+                from local_index import LocalIndex
+                index = artifact_index or LocalIndex.load()
+            else:
+                from quantized_index import load_or_build, load_matching
+                if version is None:
+                    index = load_or_build(LOCAL_INDEX_STORAGE, LOCAL_INDEX_DIMENSION, LOCAL_INDEX_REDUCTION)
+                else:
+                    path = artifact.ARTIFACTS_PATH / version
+                    index = load_matching(LOCAL_INDEX_STORAGE, LOCAL_INDEX_DIMENSION, LOCAL_INDEX_REDUCTION,
+                                          path / artifact.QUANTIZED_DIR, path / artifact.VECTORS_FILE,
+                                          path / artifact.IDS_FILE)
+                    if index is None:
+                        raise ValueError(f"Artifact {version} has no {LOCAL_INDEX_STORAGE} index with these "
+                                         f"settings; run ingest.py with the same LOCAL_INDEX_* settings to add one.")
+            print(f"Loaded local index with {len(index)} vectors.")
+        return ServingData(catalog, index, version)
+
+    def reload(self, force=False):
+        """
+        Loads the current data and swaps it in with one assignment. Requests already
+        running finish on the data they started with; later ones see only the new
+        data. Does nothing if the current artifact is the one being served, unless
+        `force`. Returns (previous version, new version), or None if nothing changed.
+        """
+        previous = self.data
+        if not force and previous.version is not None and self.current_version() == previous.version:
+            return None
+        # Network indexes are not local data: keep the connection.
+        keep_index = previous.index if self.backend != "local" else None
+        self.data = self.load_data(keep_index)
+        return previous.version, self.data.version
+
+    def current_version(self):
+        """
+        The artifact version that `reload` would load, or None.
+        """
+        return artifact.current_version() if USE_ARTIFACT else None
+
+    def connect(self):
+        """
+        Creates the embedding client (with its cache) and, for the Pinecone backend,
+        the index connection. Components already set, e.g. test doubles, are kept.
+        """
+        if self.index is None:
+            self.index = initialize_pinecone()
+        if self.embedder is None:
+            self.embedder = create_embedder()
+        self.query_embeddings = EmbeddingCache(
+            self.embedder,
+            model=EMBEDDING_MODEL,
+            max_size=EMBEDDING_CACHE_SIZE,
+            ttl=EMBEDDING_CACHE_TTL,
+            path=Path(EMBEDDING_CACHE_PATH) if EMBEDDING_CACHE_PATH else None
+        )
+
+    def search(self, query, top_k=None, threshold=None, filters=None, data=None):
+        """
+        Returns the selected matches for one query. `filters` (see filters.parse_filters)
+        restricts the search to eligible products before the top-k is taken. `data` is
+        the ServingData to search, by default the current one.
+        """
+        data = data or self.data
+        top_k = top_k or self.max_recommendations
+        with metrics.stage("embed"):
+            query_embedding = self.query_embeddings.embed_query(query)
+        with metrics.stage("index_query"):
+            search_response = data.index.query(
+                vector=query_embedding,
+                top_k=search_top_k(top_k, threshold),
+                include_metadata=False,
+                **self.filter_arguments(filters, data)
+            )
+        with metrics.stage("threshold"):
+            return select_matches(search_response, top_k, threshold)
+
+    def search_many(self, queries, top_k=None, threshold=None, filters=None, data=None):
+        """
+        Returns the selected matches for each query, in order. Queries are embedded in
+        batches and searched together (see `query_index`).
+        """
+        top_k = top_k or self.max_recommendations
+        with metrics.stage("embed"):
+            query_vectors = self.query_embeddings.embed_queries(queries, batch_size=EMBED_BATCH_SIZE)
+        with metrics.stage("index_query"):
+            search_responses = self.query_index(query_vectors, search_top_k(top_k, threshold), filters, data)
+        with metrics.stage("threshold"):
+            return [select_matches(response, top_k, threshold) for response in search_responses]
+
+    # The recommend* methods take one ServingData reference up front and use it for
+    # both the search and the hydration, so a concurrent reload cannot mix versions.
+
+    def recommend(self, query, top_k=None, threshold=None, filters=None):
+        data = self.data
+        matches = self.search(query, top_k, threshold, filters, data)
+        with metrics.stage("hydrate"):
+            return self.build_recommendations(matches, data)
+
+    def recommend_many(self, queries, top_k=None, threshold=None, filters=None):
+        data = self.data
+        all_matches = self.search_many(queries, top_k, threshold, filters, data)
+        with metrics.stage("hydrate"):
+            return [self.build_recommendations(matches, data) for matches in all_matches]
+
+    def recommend_fragments(self, query, top_k=None, threshold=None, filters=None, compact=False):
+        """
+        Like `recommend`, but returns each recommendation as its pre-serialized JSON
+        fragment from the catalog (see catalog.py) instead of a dict.
+        """
+        data = self.data
+        matches = self.search(query, top_k, threshold, filters, data)
+        with metrics.stage("hydrate"):
+            return data.catalog.fragments([match["id"] for match in matches], compact)
+
+    def recommend_many_fragments(self, queries, top_k=None, threshold=None, filters=None, compact=False):
+        data = self.data
+        all_matches = self.search_many(queries, top_k, threshold, filters, data)
+        with metrics.stage("hydrate"):
+            return [data.catalog.fragments([match["id"] for match in matches], compact)
+                    for matches in all_matches]
+
+    def filter_arguments(self, filters, data=None):
+        """
+        Index query arguments that apply `filters`: a row mask from the bitmap indexes
+        for the local index, a metadata filter for Pinecone.
+        """
+        if not filters:
+            return {}
+        data = data or self.data
+        if data.filters is not None:
+            return {"mask": data.filters.mask(filters)}
+        return {"filter": pinecone_filter(filters)}
+
+    def query_index(self, vectors, top_k, filters=None, data=None):
+        """
+        Runs one similarity search per vector and returns the responses in order.
+        The local index scores the whole batch in a single matrix product; Pinecone has
+        no batch query, so its searches are issued concurrently instead.
+        """
+        data = data or self.data
+        index = data.index
+        arguments = self.filter_arguments(filters, data)
+        if hasattr(index, "query_many"):
+            return index.query_many(vectors, top_k=top_k, **arguments)
+        with ThreadPoolExecutor(max_workers=QUERY_CONCURRENCY) as pool:
+            return list(pool.map(
+                lambda vector: index.query(vector=vector, top_k=top_k, include_metadata=False, **arguments),
+                vectors
+            ))
+
+    def build_recommendations(self, matches, data=None):
+        """
+        Hydrates the selected matches from the catalog, keeping the response field order.
+        """
+        catalog = (data or self.data).catalog
+        recommended = []
+        for match in matches:
+            product_id = match["id"]
+            product = catalog.get(product_id)
+            if product:
+                recommended.append(response_record(product))
+        return recommended
+
+    def index_stats(self):
+        """
+        Size of the index and, for approximate local indexes, their measured recall.
+        """
+        data = self.data
+        if data.index is None:
+            return None
+        stats = {"type": type(data.index).__name__}
+        if data.version is not None:
+            stats["version"] = data.version
+        if hasattr(data.index, "ids"):
+            stats["size"] = len(data.index)
+        for name in ("recall", "nprobe", "nlist", "storage"):
+            if getattr(data.index, name, None) is not None:
+                stats[name] = getattr(data.index, name)
+        return stats
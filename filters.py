@@ -0,0 +1,196 @@
+import numpy as np
+
+
+FILTER_FIELDS = ("max_duration", "min_duration", "remote_support", "adaptive_support", "test_type", "language")
+
+
+def split_labels(value):
+    """
+    Turns a catalog field holding comma-joined labels (or a list of such strings, as
+    `test_type` is stored) into a list of individual labels.
+    """
+    if isinstance(value, str):
+        value = [value]
+    labels = []
+    for item in value or []:
+        labels.extend(label.strip() for label in item.split(",") if label.strip())
+    return labels
+
+
+def parse_duration(value):
+    """
+    Returns the duration in minutes, or None when the catalog does not state one.
+    """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _as_yes_no(value):
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    if isinstance(value, str) and value.strip().lower() in ("yes", "no"):
+        return value.strip().capitalize()
+    return None
+
+
+def _as_label_list(value):
+    if isinstance(value, str):
+        value = [value]
+    if not isinstance(value, list) or not value or not all(isinstance(item, str) and item.strip() for item in value):
+        return None
+    return sorted({item.strip() for item in value})
+
+
+def parse_filters(raw):
+    """
+    Validates the "filters" request field. Returns (filters, error) where filters is a
+    canonical dict (None if no filter was given):
+      - max_duration / min_duration: minutes; items without a stated duration never match
+      - remote_support / adaptive_support: true/false or "Yes"/"No"
+      - test_type / language: a label or list of labels; an item matches if it has any of them
+    """
+    if raw is None:
+        return None, None
+    if not isinstance(raw, dict):
+        return None, "'filters' must be an object."
+    unknown = set(raw) - set(FILTER_FIELDS)
+    if unknown:
+        return None, f"Unknown filter(s): {', '.join(sorted(unknown))}. Supported: {', '.join(FILTER_FIELDS)}."
+
+    filters = {}
+    for field in ("max_duration", "min_duration"):
+        if field in raw:
+            value = raw[field]
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                return None, f"'{field}' must be a number of minutes."
+            filters[field] = float(value)
+    for field in ("remote_support", "adaptive_support"):
+        if field in raw:
+            value = _as_yes_no(raw[field])
+            if value is None:
+                return None, f"'{field}' must be true/false or \"Yes\"/\"No\"."
+            filters[field] = value
+    for field in ("test_type", "language"):
+        if field in raw:
+            value = _as_label_list(raw[field])
+            if value is None:
+                return None, f"'{field}' must be a non-empty string or list of strings."
+            filters[field] = value
+    return filters or None, None
+
+
+def cache_key(filters):
+    """
+    Hashable form of a parsed filter dict, for use in cache keys.
+    """
+    if not filters:
+        return None
+    return tuple(sorted((field, tuple(value) if isinstance(value, list) else value)
+                        for field, value in filters.items()))
+
+
+class CatalogFilters:
+    """
+    Precomputed boolean-array (bitmap) indexes over the catalog fields, aligned with the
+    row order of a vector index. `mask(filters)` combines them into the set of eligible
+    rows with a few vectorised ANDs/ORs, so the index can score only eligible items and
+    a filtered top-k is as cheap as an unfiltered one.
+    """
+
+    def __init__(self, catalog, ids):
+        rows = catalog.rows(ids)
+        known = rows >= 0
+        rows = np.where(known, rows, 0)
+        self.size = len(rows)
+        self.duration = np.where(known, catalog.duration[rows], np.nan).astype(np.float32)
+        self.yes_no = {
+            field: known & catalog.has_value(field, "Yes")[rows]
+            for field in ("remote_support", "adaptive_support")
+        }
+        self.labels = {
+            field: self._label_bitmaps(catalog, field, rows, known)
+            for field in ("test_type", "language")
+        }
+
+    def _label_bitmaps(self, catalog, field, rows, known):
+        # One pass per distinct stored value (e.g. "English (USA), Spanish"), not per row.
+        bitmaps = {}
+        for value in catalog.vocabularies[field]:
+            present = known & catalog.has_value(field, value)[rows]
+            for label in split_labels(value):
+                bitmap = bitmaps.get(label)
+                if bitmap is None:
+                    bitmap = bitmaps[label] = np.zeros(self.size, dtype=bool)
+                bitmap |= present
+        return bitmaps
+
+    def mask(self, filters):
+        """
+        Returns a boolean array of the rows matching every filter, or None for no filters.
+        """
+        if not filters:
+            return None
+        mask = np.ones(self.size, dtype=bool)
+        with np.errstate(invalid="ignore"):
+            if "max_duration" in filters:
+                mask &= self.duration <= filters["max_duration"]
+            if "min_duration" in filters:
+                mask &= self.duration >= filters["min_duration"]
+        for field in ("remote_support", "adaptive_support"):
+            if field in filters:
+                bitmap = self.yes_no[field]
+                mask &= bitmap if filters[field] == "Yes" else ~bitmap
+        for field in ("test_type", "language"):
+            if field in filters:
+                any_of = np.zeros(self.size, dtype=bool)
+                for label in filters[field]:
+                    bitmap = self.labels[field].get(label)
+                    if bitmap is not None:
+                        any_of |= bitmap
+                mask &= any_of
+        return mask
+
+
+def pinecone_filter(filters):
+    """
+    Translates parsed filters into a Pinecone metadata filter over the fields that
+    ingest.py stores with each vector.
+    """
+    if not filters:
+        return None
+    clauses = []
+    duration = {}
+    if "max_duration" in filters:
+        duration["$lte"] = filters["max_duration"]
+    if "min_duration" in filters:
+        duration["$gte"] = filters["min_duration"]
+    if duration:
+        clauses.append({"duration": duration})
+    for field in ("remote_support", "adaptive_support"):
+        if field in filters:
+            clauses.append({field: {"$eq": filters[field]}})
+    for field in ("test_type", "language"):
+        if field in filters:
+            clauses.append({field: {"$in": filters[field]}})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+def pinecone_metadata(product):
+    """
+    Metadata stored with each vector so Pinecone can apply the same filters.
+    Products without a stated duration get no duration field and never match a
+    duration filter, as with the local index.
+    """
+    metadata = {
+        "description": product.get("description", ""),
+        "remote_support": product.get("remote_support", ""),
+        "adaptive_support": product.get("adaptive_support", ""),
+        "test_type": split_labels(product.get("test_type")),
+        "language": split_labels(product.get("language")),
+    }
+    duration = parse_duration(product.get("duration"))
+    if duration is not None:
+        metadata["duration"] = duration
+    return metadata
@@ -0,0 +1,74 @@
+"""
+Production server for api.py:
+
+    gunicorn -c gunicorn.conf.py api:app
+
+The app is imported once in the master (preload_app), which loads the product catalog
+and, with VECTOR_BACKEND=local, memory-maps the embedding matrix. Workers are forked
+from it and share those pages copy-on-write instead of each loading their own copy.
+Network clients (Pinecone, the embedding API, the SQLite embedding cache) are not
+fork-safe, so every worker opens its own in post_fork.
+
+Each worker reloads the data on its own SIGHUP (`pkill -HUP -P <master pid>`) and polls
+for a new index artifact every ARTIFACT_WATCH_SECONDS, so a catalog refresh written by
+ingest.py is picked up without restarting workers. SIGHUP to the master still restarts
+the workers, which are forked with the data the master loaded at startup and then
+swap to the current artifact on their first poll.
+
+Metrics are aggregated across workers (see metrics.py): each worker writes its
+samples to METRICS_DIR and /metrics answers with the totals for the whole server
+whichever worker serves the scrape. Unless METRICS_DIR is set, it is a fresh
+directory per server run, removed on exit. A directory set by the operator is left
+alone; empty it between runs, or the counters carry over.
+"""
+import gc
+import os
+import shutil
+import tempfile
+import multiprocessing
+
+os.environ.setdefault("API_PREFORK", "1")
+os.environ.setdefault("ARTIFACT_WATCH_SECONDS", "5")
+# Only a directory created here is removed on shutdown; one the operator set is kept.
+OWN_METRICS_DIR = "METRICS_DIR" not in os.environ
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), f"recommend-metrics-{os.getpid()}"))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+workers = int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "4"))
+preload_app = True
+timeout = 60
+
+
+def pre_fork(server, worker):
+    # Move everything allocated so far out of the collector's reach, so GC passes in the
+    # workers do not write to (and so un-share) the pages holding the catalog.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import api
+    api.start_background_init()
+
+
+def post_worker_init(worker):
+    # Runs after gunicorn has reset the worker's signal handlers.
+    import api
+    api.install_reload_signal()
+
+
+def worker_exit(server, worker):
+    # Write the last samples, so the worker's final requests still count.
+    import metrics
+    metrics.registry.flush()
+
+
+def child_exit(server, worker):
+    import metrics
+    metrics.mark_process_dead(worker.pid)
+
+
+def on_exit(server):
+    if OWN_METRICS_DIR:
+        shutil.rmtree(os.environ["METRICS_DIR"], ignore_errors=True)
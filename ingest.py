@@ -2,30 +2,76 @@ import os
 import json
 import uuid
 import time
+import hashlib
+import argparse
+import functools
+import threading
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from dotenv import load_dotenv
-from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
+import artifact
+from catalog import Catalog
+from local_index import LocalIndex, VECTORS_PATH, IDS_PATH
+from ann_index import IVFIndex, ANN_PATH, saved as ann_saved, load_or_build as load_ann_index
+from quantized_index import load_or_build as load_quantized_index
+from filters import pinecone_metadata
+from embedding_cache import DocumentEmbeddingCache, content_key
+from rate_limit import RateLimiter
+from json_stream import iter_items, write_items
 
 
 load_dotenv()
 JSON_PATH = Path("JSONs/products.json")
 INDEX_NAME = "shl-product-index"
 BATCH_SIZE = 32
+EMBEDDING_MODEL = "models/embedding-001"
+
+# What the Pinecone index holds, as {id: hash of the embedded text and metadata}.
+# Each run only upserts products whose hash changed and deletes ids no longer in the JSON.
+MANIFEST_PATH = Path("JSONs/index_manifest.json")
+# Document embeddings keyed by (model, text) hash, so unchanged text is never re-embedded.
+EMBEDDING_CACHE_PATH = Path(os.getenv("INGEST_EMBEDDING_CACHE", ".cache/document_embeddings.sqlite3"))
+DELETE_BATCH_SIZE = 1000
+
+# Upserts run on their own pool while the next window of batches is embedded. At most
+# UPSERT_IN_FLIGHT batches wait for the index, so a slow index throttles embedding.
+UPSERT_CONCURRENCY = int(os.getenv("UPSERT_CONCURRENCY", "4"))
+UPSERT_IN_FLIGHT = int(os.getenv("UPSERT_IN_FLIGHT", "8"))
+# The local index the API serves (engine.py reads the same settings). An IVF or
+# compressed index is built into every artifact here, so the API never trains one.
+LOCAL_INDEX_TYPE = os.getenv("LOCAL_INDEX_TYPE", "exact")
+LOCAL_INDEX_STORAGE = os.getenv("LOCAL_INDEX_STORAGE", "float32")
+LOCAL_INDEX_DIMENSION = int(os.getenv("LOCAL_INDEX_DIMENSION", "0"))
+LOCAL_INDEX_REDUCTION = os.getenv("LOCAL_INDEX_REDUCTION", "pca")
+# Finished upsert batches of the current sync, for --resume after a crash.
+CHECKPOINT_PATH = Path("JSONs/ingest_checkpoint.json")
+
+# Embedding: texts per embed_documents call (the API accepts up to 100), calls in
+# flight at once, and the quota to stay within. Tokens are estimated from text length.
+# A 429 halves the rate and backs off; successes win it back gradually.
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_RPM = int(os.getenv("EMBED_RPM", "1500"))
+EMBED_TPM = int(os.getenv("EMBED_TPM", "1000000"))
+CHARS_PER_TOKEN = 4
 
 def load_json(filepath: Path):
     with filepath.open("r", encoding="utf-8") as f:
         return json.load(f)
 
 def save_json(filepath: Path, data):
-    with filepath.open("w", encoding="utf-8") as f:
+    tmp_path = filepath.with_name(filepath.name + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as f:
         json.dump(data, f, indent=2)
+    os.replace(tmp_path, filepath)
 
 def initialize_pinecone():
 
     from pinecone import Pinecone, ServerlessSpec
 
     pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
-    
+
     if INDEX_NAME not in pc.list_indexes().names():
         print(f"Creating index '{INDEX_NAME}' ...")
         pc.create_index(
@@ -42,44 +88,377 @@ def initialize_pinecone():
 
     return pc.Index(INDEX_NAME)
 
-def ensure_ids(data):
+def create_embedder():
+    from langchain_google_genai.embeddings import GoogleGenerativeAIEmbeddings
+
+    return GoogleGenerativeAIEmbeddings(
+        model=EMBEDDING_MODEL,
+        google_api_key=os.environ.get("GOOGLE_API_KEY")
+    )
+
+def product_id(item):
+    """
+    Deterministic id: a UUIDv5 of the product URL, so rebuilding products.json from a
+    fresh scrape yields the same ids.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, item.get("url") or item.get("description", "")))
 
+def ensure_ids(data):
+    """
+    Gives every item its deterministic id and drops repeated products (the scrape
+    lists some assessments more than once). `data` can be any iterable, e.g. items
+    streamed from the file. Returns (data, whether anything changed).
+    """
+    changed = False
+    unique = {}
+    total = 0
     for item in data:
-        if "id" not in item or not item["id"]:
-            new_id = str(uuid.uuid4())
-            print(f"Assigning new id {new_id} to item with description: {item.get('description','')}")
+        total += 1
+        new_id = product_id(item)
+        if item.get("id") != new_id:
             item["id"] = new_id
-    return data
+            changed = True
+        if new_id in unique:
+            changed = True
+            continue
+        unique[new_id] = item
+    dropped = total - len(unique)
+    if dropped:
+        print(f"Dropped {dropped} repeated products.")
+    return list(unique.values()), changed
+
+def record_hash(item):
+    """
+    Hash of everything stored for a product in the index: its embedded text and metadata.
+    """
+    record = {"content": content_key(EMBEDDING_MODEL, item["description"]), "metadata": pinecone_metadata(item)}
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode("utf-8")).hexdigest()
+
+def load_manifest(index):
+    """
+    Returns {id: record hash} for what the index holds. Without a manifest (first run,
+    or one written elsewhere) the ids are listed from the index with unknown hashes,
+    so every product is re-upserted once and stale ids are still deleted.
+    """
+    if MANIFEST_PATH.exists():
+        return load_json(MANIFEST_PATH)
+    manifest = {}
+    try:
+        for ids in index.list():
+            manifest.update((product_id, None) for product_id in ids)
+    except Exception as e:
+        print(f"Could not list the ids in the index ({e}); removed products will not be deleted this run.")
+    print(f"No manifest found; the index holds {len(manifest)} ids.")
+    return manifest
+
+def plan_sync(data, manifest):
+    """
+    Returns (products to upsert, ids to delete, {id: record hash}).
+    """
+    hashes = {item["id"]: record_hash(item) for item in data}
+    changed = [item for item in data if manifest.get(item["id"]) != hashes[item["id"]]]
+    removed = [product_id for product_id in manifest if product_id not in hashes]
+    return changed, removed, hashes
+
+def load_local_vectors():
+    """
+    Returns {id: vector} from the saved local index, or {} if there is none.
+    """
+    if not (VECTORS_PATH.exists() and IDS_PATH.exists()):
+        return {}
+    local_index = LocalIndex.load()
+    return dict(zip(local_index.ids, local_index.vectors))
+
+def estimate_tokens(texts):
+    return sum(len(text) // CHARS_PER_TOKEN + 1 for text in texts)
+
+def embed_descriptions(items, cache, embedder_factory, limiter=None):
+    """
+    Returns {content key: vector} for the descriptions of `items`. Only texts missing
+    from the cache are sent to the embedding API (created on first need), in batches of
+    EMBED_BATCH_SIZE, EMBED_CONCURRENCY at a time, within the EMBED_RPM / EMBED_TPM budget
+    (or `limiter`'s, when one is shared across calls).
+    """
+    texts = {content_key(EMBEDDING_MODEL, item["description"]): item["description"] for item in items}
+    vectors = cache.get_many(texts)
+    missing = [key for key in texts if key not in vectors]
+    print(f"{len(texts) - len(missing)} embeddings cached, {len(missing)} to compute.")
+    if not missing:
+        return vectors
+
+    embed = embedder_factory()
+    limiter = limiter or RateLimiter(EMBED_RPM, EMBED_TPM)
+    lock = threading.Lock()
+    progress = {"done": 0}
+    started = time.perf_counter()
+
+    def embed_batch(batch):
+        batch_texts = [texts[key] for key in batch]
+        # Same task type as the embed_query calls the index was originally built with.
+        embedded = limiter.call(lambda: embed.embed_documents(batch_texts, task_type="RETRIEVAL_QUERY"),
+                                tokens=estimate_tokens(batch_texts))
+        pairs = list(zip(batch, embedded))
+        cache.put_many(pairs)
+        with lock:
+            vectors.update(pairs)
+            progress["done"] += len(pairs)
+            done = progress["done"]
+        print(f"Embedded {done}/{len(missing)} descriptions.")
+
+    batches = [missing[i:i+EMBED_BATCH_SIZE] for i in range(0, len(missing), EMBED_BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY) as pool:
+        list(pool.map(embed_batch, batches))
+    elapsed = time.perf_counter() - started
+    print(f"Embedded {len(missing)} descriptions in {elapsed:.1f}s ({len(missing) / elapsed:.1f}/s, "
+          f"{limiter.throttles} rate-limit backoffs).")
+    return vectors
+
+def save_manifest(manifest):
+    save_json(MANIFEST_PATH, manifest)
+
+def plan_id(changed, removed, hashes):
+    """
+    Identifies a sync plan, so a checkpoint is only resumed against the same work.
+    """
+    digest = hashlib.sha256()
+    for item in changed:
+        digest.update(f"+{item['id']}:{hashes[item['id']]}\n".encode("utf-8"))
+    for product_id in removed:
+        digest.update(f"-{product_id}\n".encode("utf-8"))
+    return digest.hexdigest()
+
+class Checkpoint:
+    """
+    Durable record of the upsert batches finished for one sync plan, as merged
+    [start, end) ranges over the list of changed products. It is rewritten atomically
+    after every batch, so `--resume` skips them after a crash.
+    """
+
+    def __init__(self, path: Path, plan, completed=()):
+        self.path = path
+        self.plan = plan
+        self.completed = [list(span) for span in completed]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def open(cls, path: Path, plan, resume):
+        if resume and path.exists():
+            saved = load_json(path)
+            if saved.get("plan") == plan:
+                checkpoint = cls(path, plan, saved.get("completed", []))
+                print(f"Resuming: {checkpoint.count()} changed products already upserted.")
+                return checkpoint
+            print("The checkpoint is for a different catalog state; starting over.")
+        return cls(path, plan)
 
-def main():
+    def count(self):
+        with self._lock:
+            return sum(end - start for start, end in self.completed)
+
+    def done(self, start):
+        with self._lock:
+            return any(low <= start < high for low, high in self.completed)
+
+    def complete(self, start, end):
+        with self._lock:
+            spans = sorted(self.completed + [[start, end]])
+            merged = [spans[0]]
+            for low, high in spans[1:]:
+                if low <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], high)
+                else:
+                    merged.append([low, high])
+            self.completed = merged
+            save_json(self.path, {"plan": self.plan, "completed": merged})
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+def upsert_pipeline(index, changed, hashes, manifest, checkpoint, embed_items, vector_for):
+    """
+    Embeds and upserts `changed` in BATCH_SIZE batches. `embed_items` embeds one window
+    of batches while the upserts of the previous window are still running; at most
+    UPSERT_IN_FLIGHT batches are queued for the index. Every finished batch goes into
+    the manifest and the checkpoint. Returns the number of vectors upserted.
+    """
+    window = BATCH_SIZE * max(1, -(-EMBED_BATCH_SIZE * EMBED_CONCURRENCY // BATCH_SIZE))
+    slots = threading.BoundedSemaphore(UPSERT_IN_FLIGHT)
+    lock = threading.Lock()
+    failures = []
+    upserted = {"count": 0}
+
+    def upsert(start, batch, vectors):
+        try:
+            index.upsert(vectors)
+            with lock:
+                manifest.update((item["id"], hashes[item["id"]]) for item in batch)
+                upserted["count"] += len(batch)
+            checkpoint.complete(start, start + len(batch))
+            print(f"Upserted batch {(start // BATCH_SIZE) + 1} (items {start} to {start + len(batch) - 1}).")
+        except Exception as e:
+            failures.append(e)
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=UPSERT_CONCURRENCY) as pool:
+        for window_start in range(0, len(changed), window):
+            starts = []
+            for start in range(window_start, min(window_start + window, len(changed)), BATCH_SIZE):
+                if checkpoint.done(start):
+                    manifest.update((item["id"], hashes[item["id"]]) for item in changed[start:start+BATCH_SIZE])
+                else:
+                    starts.append(start)
+            if not starts:
+                continue
+            embed_items([item for start in starts for item in changed[start:start+BATCH_SIZE]])
+            for start in starts:
+                slots.acquire()
+                if failures:
+                    slots.release()
+                    break
+                batch = changed[start:start+BATCH_SIZE]
+                pool.submit(upsert, start, batch,
+                            [(item["id"], vector_for(item), pinecone_metadata(item)) for item in batch])
+            if failures:
+                break
+
+    if failures:
+        raise failures[0]
+    return upserted["count"]
+
+def delete_removed(index, removed, manifest):
+    for i in range(0, len(removed), DELETE_BATCH_SIZE):
+        batch = removed[i:i+DELETE_BATCH_SIZE]
+        index.delete(ids=batch)
+        for product_id in batch:
+            manifest.pop(product_id, None)
+        print(f"Deleted {len(batch)} removed products.")
+
+def carry_ann_index(path, previous, local_index):
+    """
+    The IVF index of the `previous` artifact version brought up to date with
+    `local_index` without retraining: products that are gone are removed, and new
+    ones and those whose vector changed are added. Returns None if there is none.
+    """
+    if previous is None or not ann_saved(previous / artifact.ANN_DIR):
+        return None
+    ann_index = IVFIndex.load(previous / artifact.ANN_DIR)
+    previous_index = LocalIndex.load(previous / artifact.VECTORS_FILE, previous / artifact.IDS_FILE)
+    previous_rows = {product_id: row for row, product_id in enumerate(previous_index.ids)}
+    ann_index.remove(set(ann_index.ids) - set(local_index.ids))
+    kept = [row for row, product_id in enumerate(local_index.ids) if product_id in previous_rows]
+    old_rows = [previous_rows[local_index.ids[row]] for row in kept]
+    # Vectors re-normalised from the same embedding differ only by rounding.
+    moved = np.abs(local_index.vectors[kept] - previous_index.vectors[old_rows]).max(axis=1, initial=0) > 1e-6
+    added = sorted((set(range(len(local_index))) - set(kept)) | {row for row, changed in zip(kept, moved) if changed})
+    ann_index.add([local_index.ids[row] for row in added], np.asarray(local_index.vectors[added]))
+    return ann_index
+
+def build_derived_indexes(path, previous):
+    """
+    Adds the IVF or compressed index the API is configured to serve to the artifact
+    version directory `path`, built from that version's vectors. An IVF index is
+    carried forward from the `previous` version with add/remove, as JSONs/product_ann
+    is, and only trained when there is none to start from.
+    """
+    if LOCAL_INDEX_TYPE == "ivf":
+        local_index = LocalIndex.load(path / artifact.VECTORS_FILE, path / artifact.IDS_FILE)
+        ann_index = None if ann_saved(path / artifact.ANN_DIR) else carry_ann_index(path, previous, local_index)
+        if ann_index is not None:
+            ann_index.save(path / artifact.ANN_DIR)
+            print(f"Carried the IVF index forward ({len(ann_index)} vectors).")
+        else:
+            load_ann_index(path / artifact.ANN_DIR, local_index=local_index)
+    elif LOCAL_INDEX_STORAGE != "float32" or LOCAL_INDEX_DIMENSION:
+        load_quantized_index(LOCAL_INDEX_STORAGE, LOCAL_INDEX_DIMENSION, LOCAL_INDEX_REDUCTION,
+                             path / artifact.QUANTIZED_DIR, path / artifact.VECTORS_FILE, path / artifact.IDS_FILE)
+
+def update_local_indexes(data, changed_ids, removed, local_vectors, vectors_by_key, embed_items, vector_for):
+    """
+    Brings the local index, the IVF index (if built) and the served artifact up to
+    date with `data` once the Pinecone sync is done.
+    """
+    # Keep a copy for the in-process backend (VECTOR_BACKEND=local in api.py).
+    # Products skipped on resume, or missing locally, come from the embedding cache.
+    needed = [item for item in data if item["id"] in changed_ids or item["id"] not in local_vectors]
+    embed_items([item for item in needed if content_key(EMBEDDING_MODEL, item["description"]) not in vectors_by_key])
+    all_ids = [item["id"] for item in data]
+    if needed or removed or list(local_vectors) != all_ids:
+        all_vectors = np.asarray([vector_for(item) for item in data], dtype=np.float32)
+        local_index = LocalIndex(all_ids, all_vectors)
+        local_index.save()
+        print(f"Saved {len(all_ids)} vectors for the local index.")
+
+        # Update the approximate index in place, if one has been built.
+        if ann_saved(ANN_PATH):
+            ann_index = IVFIndex.load(ANN_PATH)
+            stale = set(ann_index.ids) - set(all_ids)
+            ann_index.remove(stale)
+            added = [row for row, item in enumerate(data) if item["id"] in changed_ids or item["id"] not in ann_index]
+            ann_index.add([all_ids[row] for row in added], all_vectors[added])
+            ann_index.save(ANN_PATH)
+            print(f"Updated the IVF index ({len(ann_index)} vectors).")
+    else:
+        local_index = LocalIndex.load()
+
+    # The versioned, self-contained copy the API serves and hot-swaps to (see artifact.py).
+    # Unchanged contents keep the current version.
+    artifact.write_artifact(local_index, Catalog.from_products(data), EMBEDDING_MODEL,
+                            derived=build_derived_indexes)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sync products.json into the vector indexes.")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the manifest and re-upsert every product (embeddings still come from the cache).")
+    parser.add_argument("--resume", action="store_true",
+                        help="Skip the upsert batches an interrupted run already finished.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
 
     print("Loading JSON data...")
-    data = load_json(JSON_PATH)
-    data = ensure_ids(data)
-    
-    save_json(JSON_PATH, data)
-    print(f"Updated JSON saved to {JSON_PATH}")
-
-    embed = GoogleGenerativeAIEmbeddings(
-        model="models/embedding-001",
-        google_api_key=os.environ.get("GOOGLE_API_KEY")
-    )
-    
+    data, ids_changed = ensure_ids(iter_items(JSON_PATH))
+    if ids_changed:
+        write_items(JSON_PATH, data)
+        print(f"Updated JSON saved to {JSON_PATH}")
+
     index = initialize_pinecone()
+    manifest = {} if args.full else load_manifest(index)
+    changed, removed, hashes = plan_sync(data, manifest)
+    print(f"{len(data)} products: {len(changed)} new or changed, {len(removed)} removed, "
+          f"{len(data) - len(changed)} unchanged.")
+
+    local_vectors = load_local_vectors()
+    changed_ids = {item["id"] for item in changed}
+    cache = DocumentEmbeddingCache(EMBEDDING_CACHE_PATH)
+    limiter = RateLimiter(EMBED_RPM, EMBED_TPM)
+    embedder_factory = functools.lru_cache(maxsize=1)(create_embedder)
+    vectors_by_key = {}
+
+    def embed_items(items):
+        vectors_by_key.update(embed_descriptions(items, cache, embedder_factory, limiter))
+
+    def vector_for(item):
+        key = content_key(EMBEDDING_MODEL, item["description"])
+        if key in vectors_by_key:
+            return vectors_by_key[key]
+        return local_vectors[item["id"]]
+
+    checkpoint = Checkpoint.open(CHECKPOINT_PATH, plan_id(changed, removed, hashes), args.resume)
+    print("Embedding and upserting changed vectors into Pinecone in batches...")
+    started = time.perf_counter()
+    upserted = upsert_pipeline(index, changed, hashes, manifest, checkpoint, embed_items, vector_for)
+    elapsed = time.perf_counter() - started
+    if upserted:
+        print(f"Upserted {upserted} vectors in {elapsed:.1f}s ({upserted / elapsed:.1f} vectors/s end to end).")
+
+    delete_removed(index, removed, manifest)
+    save_manifest(manifest)
+    checkpoint.clear()
+    print("Index in sync with products.json.")
 
-    print("Creating embeddings and upserting into Pinecone in batches...")
-    for i in range(0, len(data), BATCH_SIZE):
-        batch = data[i:i+BATCH_SIZE]
-        vectors = []
-        for item in batch:
-            description = item["description"]
-            vector = embed.embed_query(description)
-            vectors.append((item["id"], vector, {"description": description}))
-        
-        index.upsert(vectors)
-        print(f"Upserted batch {(i // BATCH_SIZE) + 1} (items {i} to {i + len(batch) - 1}).")
-    
-    print("All vectors upserted successfully.")
+    update_local_indexes(data, changed_ids, removed, local_vectors, vectors_by_key, embed_items, vector_for)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,153 @@
+"""
+Item-at-a-time reading and writing of JSON arrays, for catalog files that should not
+be loaded whole.
+
+`iter_items` parses one element at a time out of a bounded read buffer, so memory stays
+at about one item plus READ_SIZE however large the file is. `write_items` writes any
+iterable as an array without building it in memory, through a temporary file that
+replaces the target when complete. `append_items` adds elements to an existing array in
+place: only the closing bracket is rewritten, so an append costs O(new records), not
+O(file size). The layout is the same as json.dump(items, f, indent=indent).
+"""
+import os
+import json
+import itertools
+from pathlib import Path
+
+
+READ_SIZE = 1 << 16
+# Bytes read from the end of a file to find its closing bracket.
+TAIL_SIZE = 4096
+# What the scrapers have always written.
+DEFAULT_INDENT = 4
+
+WHITESPACE = " \t\r\n"
+DELIMITERS = WHITESPACE + ",]"
+_END = object()
+
+
+def iter_items(path, read_size=READ_SIZE):
+    """
+    Yields the elements of the JSON array in `path`, in order. Raises ValueError if the
+    file is not a well-formed array.
+    """
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, position = "", 0
+        state = "start"  # then "first" (after "["), "value" (after ",") or "after" (after an element)
+        while True:
+            while position < len(buffer) and buffer[position] in WHITESPACE:
+                position += 1
+            if position == len(buffer):
+                buffer, position = f.read(read_size), 0
+                if not buffer:
+                    raise ValueError(f"{path}: unexpected end of file in JSON array.")
+                continue
+
+            char = buffer[position]
+            if state == "start":
+                if char != "[":
+                    raise ValueError(f"{path}: expected a JSON array.")
+                position += 1
+                state = "first"
+                continue
+            if state == "after" or (state == "first" and char == "]"):
+                if char == "]":
+                    return
+                if char != ",":
+                    raise ValueError(f"{path}: expected ',' or ']', found {char!r}.")
+                position += 1
+                state = "value"
+                continue
+
+            # Decode one element, reading further while it may be incomplete. The read
+            # size doubles each time, so a very large element still costs linear time.
+            size = read_size
+            while True:
+                error = None
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                    # A number cut off by the buffer end (e.g. "2" of "2.5") also decodes;
+                    # only trust a value that is followed by a delimiter.
+                    if end < len(buffer) and buffer[end] in DELIMITERS:
+                        break
+                except json.JSONDecodeError as e:
+                    error = e
+                chunk = f.read(size)
+                if not chunk:
+                    if error is not None:
+                        raise ValueError(f"{path}: {error}")
+                    break
+                buffer, position = buffer[position:] + chunk, 0
+                size *= 2
+            yield item
+            position = end
+            state = "after"
+
+
+def dump_item(item, indent=DEFAULT_INDENT, newline="\n"):
+    """
+    One array element as json.dump(..., indent=indent) lays it out inside the array.
+    """
+    if indent is None:
+        return json.dumps(item)
+    pad = " " * indent
+    return pad + json.dumps(item, indent=indent).replace("\n", newline + pad)
+
+
+def write_items(path, items, indent=DEFAULT_INDENT):
+    """
+    Writes `items` (any iterable, e.g. a generator) as a JSON array, one element at a
+    time. The file is replaced only once it is complete. Returns the number written.
+    """
+    path = Path(path)
+    tmp_path = path.with_name(path.name + ".tmp")
+    newline = "" if indent is None else "\n"
+    separator = ", " if indent is None else ","
+    count = 0
+    with tmp_path.open("w", encoding="utf-8") as f:
+        f.write("[")
+        for item in items:
+            f.write((separator if count else "") + newline + dump_item(item, indent))
+            count += 1
+        f.write((newline if count else "") + "]")
+    os.replace(tmp_path, path)
+    return count
+
+
+def append_items(path, items, indent=DEFAULT_INDENT):
+    """
+    Appends `items` to the JSON array in `path` without reading or rewriting what is
+    already there, creating the file if it does not exist. New elements use the line
+    ending the file already uses. Returns the number appended.
+    """
+    path = Path(path)
+    items = iter(items)
+    if not path.exists() or path.stat().st_size == 0:
+        return write_items(path, items, indent)
+    first = next(items, _END)
+    if first is _END:
+        return 0
+
+    with path.open("r+b") as f:
+        size = f.seek(0, os.SEEK_END)
+        tail_start = max(0, size - TAIL_SIZE)
+        f.seek(tail_start)
+        tail = f.read()
+        closed = tail.rstrip(WHITESPACE.encode())
+        head = closed[:-1].rstrip(WHITESPACE.encode())
+        if not closed.endswith(b"]") or not head:
+            raise ValueError(f"{path} does not end with a JSON array.")
+        newline = "\r\n" if b"\r" in tail[len(head):] else "\n"
+        # An empty array ends "[]"; a non-empty one ends with its last element.
+        separator = "" if head.endswith(b"[") else ","
+
+        f.seek(tail_start + len(head))
+        f.truncate()
+        count = 0
+        for item in itertools.chain([first], items):
+            f.write((separator + newline + dump_item(item, indent, newline)).encode("utf-8"))
+            separator = ","
+            count += 1
+        f.write((newline + "]").encode("utf-8"))
+    return count
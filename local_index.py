@@ -0,0 +1,187 @@
+import os
+import json
+from pathlib import Path
+import numpy as np
+from dotenv import load_dotenv
+from json_stream import iter_items
+
+
+load_dotenv()
+PRODUCTS_JSON_PATH = Path("JSONs/products.json")
+VECTORS_PATH = Path("JSONs/product_vectors.npy")
+IDS_PATH = Path("JSONs/product_vector_ids.json")
+INDEX_NAME = "shl-product-index"
+FETCH_BATCH_SIZE = 100
+
+# Recall of approximate indexes (quantized_index.py, ann_index.py) against exact search.
+RECALL_K = 10
+RECALL_SAMPLE = 200
+# Norm of the noise added to catalog vectors to make evaluation queries.
+QUERY_NOISE = 0.3
+
+
+def normalize_rows(matrix):
+    """
+    Returns a contiguous float32 copy of the matrix with every row scaled to unit L2 norm.
+    Zero rows are left as zeros.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+def top_rows(scores, top_k, mask=None):
+    """
+    Positions of the `top_k` highest scores, best first. If `mask` is given, only
+    positions where it is true are eligible.
+    """
+    if mask is not None:
+        scores = np.where(mask, scores, -np.inf)
+        top_k = min(top_k, int(np.count_nonzero(mask)))
+    top_k = min(top_k, len(scores))
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if top_k < len(scores):
+        top = np.argpartition(-scores, top_k - 1)[:top_k]
+    else:
+        top = np.arange(len(scores))
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+class LocalIndex:
+    """
+    In-process replacement for the Pinecone index.
+
+    Holds the product embeddings as one contiguous, L2-normalised float32 matrix so a
+    cosine-similarity search is a single matrix-vector product followed by an
+    argpartition top-k. `query` returns the same shape of response as Pinecone's
+    `Index.query`, so callers do not need to know which backend they are talking to.
+    """
+
+    def __init__(self, ids, vectors, normalized=False):
+        if len(ids) != len(vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(vectors)} vectors.")
+        self.ids = list(ids)
+        self.vectors = vectors if normalized else normalize_rows(vectors)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dimension(self):
+        return self.vectors.shape[1]
+
+    def query(self, vector, top_k=10, include_metadata=False, mask=None, **kwargs):
+        """
+        Returns the `top_k` most similar products to `vector` as
+        {"matches": [{"id": ..., "score": ...}, ...]}, best match first.
+        If `mask` is given, only rows where it is true are eligible.
+        """
+        query = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        scores = self.vectors @ query
+        return {"matches": self._top_matches(scores, top_k, mask)}
+
+    def query_many(self, vectors, top_k=10, mask=None):
+        """
+        Scores a batch of query vectors with one matrix-matrix product and returns one
+        `query`-style response per row of `vectors`.
+        """
+        queries = normalize_rows(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        scores = queries @ self.vectors.T
+        return [{"matches": self._top_matches(row, top_k, mask)} for row in scores]
+
+    def _top_matches(self, scores, top_k, mask=None):
+        top = top_rows(scores, top_k, mask)
+        return [{"id": self.ids[i], "score": float(scores[i])} for i in top]
+
+    def save(self, vectors_path: Path = VECTORS_PATH, ids_path: Path = IDS_PATH):
+        """
+        Writes the matrix as a .npy file and the id order as a JSON list. Each file is
+        written beside its target and renamed over it, so processes that memory-mapped
+        the previous matrix keep a valid copy.
+        """
+        tmp_vectors = vectors_path.with_name(vectors_path.stem + ".tmp.npy")
+        np.save(tmp_vectors, self.vectors)
+        tmp_ids = ids_path.with_name(ids_path.name + ".tmp")
+        with tmp_ids.open("w", encoding="utf-8") as f:
+            json.dump(self.ids, f)
+        os.replace(tmp_vectors, vectors_path)
+        os.replace(tmp_ids, ids_path)
+
+    @classmethod
+    def load(cls, vectors_path: Path = VECTORS_PATH, ids_path: Path = IDS_PATH):
+        """
+        Loads an index previously written by `save`. The matrix is memory-mapped read-only,
+        so every process that loads the same file shares one copy in the page cache.
+        """
+        with ids_path.open("r", encoding="utf-8") as f:
+            ids = json.load(f)
+        return cls(ids, np.load(vectors_path, mmap_mode="r"), normalized=True)
+
+
+def measure_recall(index, reference, queries, k=RECALL_K):
+    """
+    Mean fraction of `reference`'s top-k ids that `index` also returns for `queries`.
+    """
+    found = index.query_many(queries, top_k=k)
+    expected = reference.query_many(queries, top_k=k)
+    overlaps = [
+        len({m["id"] for m in got["matches"]} & {m["id"] for m in want["matches"]}) / max(len(want["matches"]), 1)
+        for got, want in zip(found, expected)
+    ]
+    return round(float(np.mean(overlaps)), 4) if overlaps else None
+
+
+def recall_queries(local_index, sample=RECALL_SAMPLE, seed=0):
+    """
+    Evaluation queries: catalog vectors with noise added, so each query's nearest
+    neighbour is not trivially itself.
+    """
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(local_index), size=min(sample, len(local_index)), replace=False)
+    vectors = np.asarray(local_index.vectors[np.sort(rows)], dtype=np.float32)
+    noise = rng.standard_normal(vectors.shape).astype(np.float32) * (QUERY_NOISE / np.sqrt(vectors.shape[1]))
+    return normalize_rows(vectors + noise)
+
+
+def export_from_pinecone(index, ids):
+    """
+    Fetches the stored vectors for `ids` from a Pinecone index and returns a LocalIndex.
+    Ids that are missing from Pinecone are skipped.
+    """
+    found_ids = []
+    vectors = []
+    for i in range(0, len(ids), FETCH_BATCH_SIZE):
+        batch = ids[i:i+FETCH_BATCH_SIZE]
+        response = index.fetch(ids=batch)
+        fetched = response.vectors
+        for product_id in batch:
+            if product_id in fetched:
+                found_ids.append(product_id)
+                vectors.append(fetched[product_id].values)
+        print(f"Fetched {len(found_ids)}/{len(ids)} vectors.")
+    return LocalIndex(found_ids, np.asarray(vectors, dtype=np.float32))
+
+
+def main():
+    """
+    Builds the local index from the vectors already stored in Pinecone, so switching
+    backends does not cost any embedding calls.
+    """
+    from pinecone import Pinecone
+
+    ids = [item["id"] for item in iter_items(PRODUCTS_JSON_PATH)]
+
+    pc = Pinecone(api_key=os.environ.get("PINECONE_API_KEY"))
+    local_index = export_from_pinecone(pc.Index(INDEX_NAME), ids)
+    local_index.save()
+    print(f"Saved {len(local_index)} vectors to {VECTORS_PATH} and {IDS_PATH}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import time
+import bisect
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+
+
+# Multiprocess mode, set by gunicorn.conf.py: every process writes a snapshot of its
+# metrics to METRICS_DIR every METRICS_FLUSH_SECONDS, and /metrics in any worker
+# renders the aggregate over all of them instead of its own process only.
+METRICS_DIR = os.getenv("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "1"))
+
+# Latency buckets in seconds, from in-process index lookups up to slow remote calls.
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonically increasing count, one series per label combination."""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, labels, (), value) for labels, value in self._values.items()]
+
+
+class Gauge(Counter):
+    """
+    Value that can go up and down, e.g. requests in flight. Across processes, "sum"
+    adds up the live processes' values and "all" keeps one series per process, with
+    a pid label.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), multiprocess_mode="sum"):
+        super().__init__(name, help_text, labelnames)
+        self.multiprocess_mode = multiprocess_mode
+
+    def dec(self, *labelvalues, amount=1):
+        self.inc(*labelvalues, amount=-amount)
+
+    def set(self, *labelvalues, value):
+        with self._lock:
+            self._values[labelvalues] = value
+
+
+class Histogram:
+    """Cumulative-bucket histogram of observed values, one series per label combination."""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * len(self.buckets), 0.0, 0]
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for labels, (counts, total, count) in self._series.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((self.name + "_bucket", labels, (("le", _format_value(float(bound))),), cumulative))
+                samples.append((self.name + "_bucket", labels, (("le", "+Inf"),), count))
+                samples.append((self.name + "_sum", labels, (), total))
+                samples.append((self.name + "_count", labels, (), count))
+        return samples
+
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class Registry:
+    """
+    Holds the metrics of one process and renders them in the Prometheus text format.
+    Collectors are callables run before rendering (and before every snapshot) to
+    refresh metrics derived from other components, such as cache hit ratios.
+
+    With a `directory`, `flush` writes this process's samples to <directory>/<pid>.json
+    and `render` aggregates every process's file: counters and histograms are summed
+    (including processes that have exited, so totals never go backwards) and gauges
+    follow their multiprocess_mode over the processes still running.
+    """
+
+    def __init__(self, directory=None):
+        self.metrics = []
+        self.collectors = []
+        self.directory = Path(directory) if directory else None
+        self._collect_lock = threading.Lock()
+        self._flush_pid = None
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def collect(self):
+        with self._collect_lock:
+            for collector in self.collectors:
+                collector()
+
+    def flush(self):
+        """
+        Writes this process's current samples to its file in the metrics directory.
+        """
+        self.collect()
+        snapshot = {"pid": os.getpid(), "metrics": {metric.name: metric.samples() for metric in self.metrics}}
+        path = self.directory / f"{os.getpid()}.json"
+        tmp_path = path.with_name(f"{path.name}.{threading.get_ident()}.tmp")
+        tmp_path.write_text(json.dumps(snapshot), encoding="utf-8")
+        os.replace(tmp_path, path)
+
+    def _flush_periodically(self):
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"Could not write metrics to {self.directory}: {e}")
+
+    def start_flushing(self):
+        """
+        Starts this process's snapshot thread, if there is a metrics directory. Safe to
+        call more than once, and again after a fork.
+        """
+        if self.directory is None or self._flush_pid == os.getpid():
+            return
+        self._flush_pid = os.getpid()
+        threading.Thread(target=self._flush_periodically, name="metrics-flush", daemon=True).start()
+
+    def _aggregate(self):
+        kinds = {metric.name: metric for metric in self.metrics}
+        totals = {metric.name: {} for metric in self.metrics}
+        for path in sorted(self.directory.glob("*.json")):
+            try:
+                snapshot = json.loads(path.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                continue
+            alive = not snapshot.get("dead") and _process_alive(snapshot["pid"])
+            for metric_name, samples in snapshot["metrics"].items():
+                metric = kinds.get(metric_name)
+                if metric is None or (metric.kind == "gauge" and not alive):
+                    continue
+                series = totals[metric_name]
+                for name, labels, extra, value in samples:
+                    extra = tuple(tuple(pair) for pair in extra)
+                    if metric.kind == "gauge" and metric.multiprocess_mode == "all":
+                        extra += (("pid", str(snapshot["pid"])),)
+                    key = (name, tuple(labels), extra)
+                    series[key] = series.get(key, 0) + value
+        return {name: [(*key, value) for key, value in series.items()] for name, series in totals.items()}
+
+    def render(self):
+        if self.directory is not None:
+            self.flush()
+            samples = self._aggregate()
+        else:
+            self.collect()
+            samples = {metric.name: metric.samples() for metric in self.metrics}
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, extra, value in samples[metric.name]:
+                lines.append(f"{name}{_format_labels(metric.labelnames, labels, extra)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def mark_process_dead(pid, directory=METRICS_DIR):
+    """
+    Drops the gauges of an exited process from the aggregate; its counters and
+    histograms still count. gunicorn.conf.py calls it when a worker exits.
+    """
+    if not directory:
+        return
+    path = Path(directory) / f"{pid}.json"
+    try:
+        snapshot = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return
+    snapshot["dead"] = True
+    tmp_path = path.with_name(path.name + ".tmp")
+    tmp_path.write_text(json.dumps(snapshot), encoding="utf-8")
+    os.replace(tmp_path, path)
+
+
+registry = Registry(METRICS_DIR)
+
+stage_seconds = registry.register(Histogram(
+    "recommend_stage_seconds", "Time spent in each stage of serving a recommendation.", ["stage"]
+))
+request_seconds = registry.register(Histogram(
+    "http_request_seconds", "End-to-end request latency.", ["endpoint"]
+))
+requests_total = registry.register(Counter(
+    "http_requests_total", "Requests served, by endpoint and status code.", ["endpoint", "status"]
+))
+errors_total = registry.register(Counter(
+    "recommend_errors_total", "Exceptions raised while serving requests, by type.", ["endpoint", "type"]
+))
+in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "Requests currently being served.", ["endpoint"]
+))
+# Each worker has its own caches, so their hit ratios are reported per process.
+cache_hit_ratio = registry.register(Gauge(
+    "cache_hit_ratio", "Fraction of lookups answered by the cache.", ["cache"], multiprocess_mode="all"
+))
+cache_lookups = registry.register(Counter(
+    "cache_lookups_total", "Cache lookups, by outcome.", ["cache", "outcome"]
+))
+
+# Callables invoked as observer(stage, seconds, allocated_blocks) after every stage,
+# e.g. by the benchmark to keep raw samples. allocated_blocks is the net change in
+# live interpreter memory blocks across the stage.
+observers = []
+
+_local = threading.local()
+
+
+def begin_request():
+    """
+    Starts collecting stage timings for the current request (thread).
+    """
+    _local.timings = []
+
+
+def end_request():
+    """
+    Stops collecting and returns the [(stage, seconds), ...] recorded for this request.
+    """
+    timings = getattr(_local, "timings", None) or []
+    _local.timings = None
+    return timings
+
+
+@contextmanager
+def stage(name):
+    """
+    Times the enclosed block into the stage histogram and, inside a request, into the
+    timings reported by the Server-Timing header.
+    """
+    blocks = sys.getallocatedblocks() if observers else 0
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        stage_seconds.observe(elapsed, name)
+        timings = getattr(_local, "timings", None)
+        if timings is not None:
+            timings.append((name, elapsed))
+        if observers:
+            allocated = sys.getallocatedblocks() - blocks
+            for observer in observers:
+                observer(name, elapsed, allocated)
+
+
+def server_timing_header(timings):
+    """
+    Formats [(stage, seconds), ...] as a Server-Timing header value (durations in ms).
+    """
+    return ", ".join(f"{name};dur={seconds * 1000:.3f}" for name, seconds in timings)
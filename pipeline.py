@@ -0,0 +1,332 @@
+"""
+One streaming catalogue refresh: listing -> detail -> normalise -> embed -> upsert.
+
+    python pipeline.py            # full refresh
+    python pipeline.py --resume   # continue an interrupted refresh
+
+This replaces running the file-hop chain by hand: scrapper1.py / scrapper2.py, then
+Final_json.py, final.py (or products.py) and finally ingest.py. Each of those writes a
+whole JSON file before the next one starts. Here the stages are connected by
+generators and bounded pools, so every product moves on as soon as it is ready:
+
+  - listing: the catalogue pages in TXTs/*.txt are crawled (see crawler.py) and their
+    table rows parsed as they arrive
+  - detail: each new product URL from those rows goes straight to the detail crawl
+  - normalise: rows and details become products.json records with stable ids
+  - embed / upsert: records are grouped into batches of ingest.BATCH_SIZE. Changed ones
+    are embedded (through the embedding cache) and upserted while the crawl goes on.
+    Unchanged ones, according to the index manifest, are skipped
+
+The first products are searchable seconds after the start, not after the last page.
+Every finished batch is appended to a checkpoint, and --resume skips the detail pages
+of the products it holds. At the end products.json, the manifest, the local indexes
+and the served artifact are written once, as ingest.py does. If any page failed, the
+previous records of products that were not scraped are kept rather than deleted.
+Counts and rates per stage are printed every PIPELINE_STATUS_SECONDS.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import functools
+import threading
+from pathlib import Path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import ingest
+from embedding_cache import DocumentEmbeddingCache, content_key
+from rate_limit import RateLimiter
+from json_stream import iter_items, write_items
+
+# The scrapers live in Data_Collection_&_Processing.
+SCRAPERS_DIR = Path(__file__).resolve().parent / "Data_Collection_&_Processing"
+sys.path.insert(0, str(SCRAPERS_DIR))
+from crawler import Crawler  # noqa: E402
+from scrapper1 import parse_table_data  # noqa: E402
+from scrapper2 import parse_individual_table_data  # noqa: E402
+from final import parse_course_page  # noqa: E402
+
+
+load_dotenv()
+# Listing pages and the parser for their table, in the order Final_json.py merged them.
+LISTINGS = (
+    (SCRAPERS_DIR / "TXTs" / "individual_assessment.txt", parse_individual_table_data),
+    (SCRAPERS_DIR / "TXTs" / "pre-package.txt", parse_table_data),
+)
+FAILED_PATH = Path("JSONs/failed.json")
+# Records of the batches finished by the current refresh, for --resume, one JSON
+# object per line.
+CHECKPOINT_PATH = Path("JSONs/pipeline_checkpoint.jsonl")
+PIPELINE_STATUS_SECONDS = float(os.getenv("PIPELINE_STATUS_SECONDS", "5"))
+STAGES = ("listing", "detail", "normalise", "embed", "upsert")
+
+
+class StageCounters:
+    """
+    Items through each stage, with their rate since the run started.
+    """
+
+    def __init__(self, stages=STAGES):
+        self.started = time.perf_counter()
+        self.counts = dict.fromkeys(stages, 0)
+        self.first_upsert = None
+        self._lock = threading.Lock()
+
+    def add(self, stage, amount=1):
+        with self._lock:
+            self.counts[stage] += amount
+            if stage == "upsert" and self.first_upsert is None:
+                self.first_upsert = time.perf_counter() - self.started
+
+    def summary(self):
+        with self._lock:
+            elapsed = max(time.perf_counter() - self.started, 1e-9)
+            line = " | ".join(f"{stage} {count} ({count / elapsed:.1f}/s)" for stage, count in self.counts.items())
+            if self.first_upsert is not None:
+                line += f" | first upsert after {self.first_upsert:.1f}s"
+            return f"→ {line}"
+
+
+def read_pages(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def listing_rows(crawler, counters, failures, listings=LISTINGS):
+    """
+    Yields the table rows of every listing page, as each page is parsed.
+    """
+    for path, parse in listings:
+        for page, rows, error in crawler.crawl(read_pages(path), parse):
+            counters.add("listing")
+            if error:
+                print(f"ERROR on listing {page}: {error}")
+                failures.append(page)
+                continue
+            yield from rows
+
+
+def normalise(row, details):
+    """
+    A products.json record from a listing row and its detail page, as final.py builds it.
+    """
+    item = {
+        "url": row["url"],
+        "adaptive_support": row.get("adaptive_support", ""),
+        "description": details.get("description", ""),
+        "language": details.get("language", ""),
+        "duration": details.get("duration", ""),
+        "remote_support": row.get("remote_support", ""),
+        "test_type": [row.get("test_type", "")],
+    }
+    return {"id": ingest.product_id(item), **item}
+
+
+def product_records(crawler, counters, failures, failed_rows, skip_urls, listings=LISTINGS):
+    """
+    Yields a normalised record per product, crawling each detail page as soon as its
+    listing row is parsed. Products in `skip_urls` and repeated rows are skipped.
+    """
+    rows = deque()
+    seen = set(skip_urls)
+
+    def detail_urls():
+        for row in listing_rows(crawler, counters, failures, listings):
+            url = row.get("url")
+            if not url or url in seen:
+                continue
+            seen.add(url)
+            rows.append(row)
+            yield url
+
+    # In-order results pair up with the rows queued by detail_urls.
+    results = crawler.crawl(detail_urls(), parse_course_page)
+    try:
+        for url, details, error in results:
+            row = rows.popleft()
+            counters.add("detail")
+            if error:
+                print(f"ERROR on {url}: {error}")
+                failures.append(url)
+                failed_rows.append(row)
+                continue
+            counters.add("normalise")
+            yield normalise(row, details)
+    finally:
+        results.close()
+
+
+def append_checkpoint(path, items):
+    """
+    Appends `items` to the checkpoint, one JSON object per line, and syncs it to disk.
+    Nothing already written is rewritten, so a crash can at worst leave a partial
+    last line.
+    """
+    with path.open("a", encoding="utf-8") as f:
+        f.write("".join(json.dumps(item, ensure_ascii=False) + "\n" for item in items))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def read_checkpoint(path):
+    """
+    The records in the checkpoint, without a partial last line left by a crash.
+    """
+    items = []
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                break
+            items.append(json.loads(line))
+    return items
+
+
+def batched(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Scrape, embed and index the catalogue in one streaming pass.")
+    parser.add_argument("--resume", action="store_true",
+                        help="Reuse the products an interrupted refresh already finished.")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the manifest and re-upsert every product (embeddings still come from the cache).")
+    return parser.parse_args(argv)
+
+
+def main(argv=None, listings=LISTINGS):
+    args = parse_args(argv)
+    counters = StageCounters()
+    failures = []
+    failed_rows = []
+
+    index = ingest.initialize_pinecone()
+    manifest = {} if args.full else ingest.load_manifest(index)
+    local_vectors = ingest.load_local_vectors()
+    cache = DocumentEmbeddingCache(ingest.EMBEDDING_CACHE_PATH)
+    limiter = RateLimiter(ingest.EMBED_RPM, ingest.EMBED_TPM)
+    embedder_factory = functools.lru_cache(maxsize=1)(ingest.create_embedder)
+    vectors_by_key = {}
+
+    def embed_items(items):
+        vectors_by_key.update(ingest.embed_descriptions(items, cache, embedder_factory, limiter))
+
+    def vector_for(item):
+        key = content_key(ingest.EMBEDDING_MODEL, item["description"])
+        if key in vectors_by_key:
+            return vectors_by_key[key]
+        return local_vectors[item["id"]]
+
+    data = []
+    hashes = {}
+    changed_ids = set()
+    if args.resume and CHECKPOINT_PATH.exists():
+        # These were upserted by the interrupted run.
+        data = read_checkpoint(CHECKPOINT_PATH)
+        for item in data:
+            hashes[item["id"]] = ingest.record_hash(item)
+            manifest[item["id"]] = hashes[item["id"]]
+            changed_ids.add(item["id"])
+        print(f"Resuming: {len(data)} products already done.")
+    else:
+        CHECKPOINT_PATH.unlink(missing_ok=True)
+
+    lock = threading.Lock()
+    slots = threading.BoundedSemaphore(ingest.UPSERT_IN_FLIGHT)
+    upsert_failures = []
+
+    def embed_and_upsert(batch):
+        """
+        Embeds and upserts the records of `batch` whose hash the manifest does not
+        have, then checkpoints the whole batch.
+        """
+        changed = [item for item in batch if manifest.get(item["id"]) != hashes[item["id"]]]
+        if changed:
+            embed_items(changed)
+            counters.add("embed", len(changed))
+            index.upsert([(item["id"], vector_for(item), ingest.pinecone_metadata(item)) for item in changed])
+            counters.add("upsert", len(changed))
+        with lock:
+            manifest.update((item["id"], hashes[item["id"]]) for item in changed)
+            changed_ids.update(item["id"] for item in changed)
+            append_checkpoint(CHECKPOINT_PATH, batch)
+
+    def embed_and_upsert_async(batch):
+        try:
+            embed_and_upsert(batch)
+        except Exception as e:
+            upsert_failures.append(e)
+        finally:
+            slots.release()
+
+    stop = threading.Event()
+
+    def report_status():
+        while not stop.wait(PIPELINE_STATUS_SECONDS):
+            print(counters.summary(), flush=True)
+
+    if PIPELINE_STATUS_SECONDS > 0:
+        threading.Thread(target=report_status, daemon=True).start()
+    crawler = Crawler(status_seconds=0)
+    records = product_records(crawler, counters, failures, failed_rows, {item["url"] for item in data}, listings)
+    try:
+        with ThreadPoolExecutor(max_workers=ingest.UPSERT_CONCURRENCY) as pool:
+            for batch in batched(records, ingest.BATCH_SIZE):
+                for item in batch:
+                    hashes[item["id"]] = ingest.record_hash(item)
+                data.extend(batch)
+                # At most UPSERT_IN_FLIGHT batches wait for the index; then the crawl waits too.
+                slots.acquire()
+                if upsert_failures:
+                    slots.release()
+                    break
+                pool.submit(embed_and_upsert_async, batch)
+    finally:
+        records.close()
+        stop.set()
+    if upsert_failures:
+        raise upsert_failures[0]
+    print(counters.summary())
+
+    if failures:
+        # A partial crawl must not drop products: keep the previous record of any
+        # product this run did not scrape.
+        previous = []
+        if ingest.JSON_PATH.exists():
+            previous, _ = ingest.ensure_ids(iter_items(ingest.JSON_PATH))
+            previous = [item for item in previous if item["id"] not in hashes]
+        data.extend(previous)
+        print(f"{len(failures)} pages failed; kept {len(previous)} products from the previous catalogue.")
+        if failed_rows:
+            write_items(FAILED_PATH, failed_rows)
+            print(f"Wrote {len(failed_rows)} failed products to {FAILED_PATH}")
+    # Carried-over products are synced like any other: re-upserted only if the index lacks them.
+    carried = [item for item in data if item["id"] not in hashes]
+    for item in carried:
+        hashes[item["id"]] = ingest.record_hash(item)
+    for batch in batched(carried, ingest.BATCH_SIZE):
+        embed_and_upsert(batch)
+
+    write_items(ingest.JSON_PATH, data)
+    print(f"Wrote {len(data)} products to {ingest.JSON_PATH}")
+    removed = [product_id for product_id in manifest if product_id not in hashes]
+    ingest.delete_removed(index, removed, manifest)
+    ingest.save_manifest(manifest)
+    CHECKPOINT_PATH.unlink(missing_ok=True)
+    print("Index in sync with the scraped catalogue.")
+
+    ingest.update_local_indexes(data, changed_ids, removed, local_vectors, vectors_by_key, embed_items, vector_for)
+    print(counters.summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""
+Compressed storage for the local index.
+
+The float32 matrix written by local_index.py / ingest.py costs 3 KB per product at 768
+dimensions. This module builds a compressed copy that is scanned instead:
+
+  - storage "float16": half precision, 2 bytes per dimension
+  - storage "int8": one signed byte per dimension plus one float32 scale per vector
+  - reduction "pca" / "truncate" to `dimension` (0 keeps every dimension) before
+    quantizing: an uncentred PCA projection that keeps dot products, or the leading
+    dimensions as they are
+
+The compressed scan only chooses `rescore` x top_k candidates. They are re-scored
+exactly against the float32 matrix, which stays memory-mapped on disk; only the
+candidate rows are ever paged in. Build it with
+
+    python quantized_index.py --storage int8 --dimension 256 --reduction pca
+
+which also reports recall@k against exact search.
+"""
+import json
+import argparse
+from pathlib import Path
+import numpy as np
+from catalog import source_stamp
+from artifact import version_path, write_versioned
+from local_index import (LocalIndex, normalize_rows, top_rows, measure_recall, recall_queries,
+                         VECTORS_PATH, IDS_PATH, RECALL_K)
+
+
+QUANTIZED_PATH = Path("JSONs/product_vectors_quantized")
+STORAGE_MODES = ("float32", "float16", "int8")
+REDUCTIONS = ("pca", "truncate")
+
+# Candidates re-scored in float32, as a multiple of the requested top_k.
+RESCORE_FACTOR = 4
+# Bytes of float32 rows decompressed at a time during a scan, so a block stays in the
+# L2 cache; the rows per block follow from the dimension (see `scan_block_rows`).
+SCAN_BLOCK_BYTES = 1 << 20
+
+# Rows the PCA projection is fitted on; more adds build time, not accuracy.
+PCA_SAMPLE_ROWS = 100000
+
+def scan_block_rows(dimension, block_bytes=SCAN_BLOCK_BYTES):
+    return max(1, block_bytes // (4 * dimension))
+
+
+def fit_projection(vectors, dimension, reduction):
+    """
+    Returns the (dimension x original dimension) projection matrix for `reduction`.
+    """
+    if reduction == "truncate":
+        return np.eye(dimension, vectors.shape[1], dtype=np.float32)
+    # Uncentred PCA: the top right singular vectors preserve dot products best.
+    if len(vectors) > PCA_SAMPLE_ROWS:
+        rows = np.random.default_rng(0).choice(len(vectors), size=PCA_SAMPLE_ROWS, replace=False)
+        vectors = vectors[np.sort(rows)]
+    _, _, components = np.linalg.svd(np.asarray(vectors, dtype=np.float32), full_matrices=False)
+    return np.ascontiguousarray(components[:dimension], dtype=np.float32)
+
+
+def quantize(vectors, storage):
+    """
+    Returns (codes, scales) for `vectors`; scales is None unless storage is "int8".
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if storage == "int8":
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    return vectors.astype(np.float16 if storage == "float16" else np.float32), None
+
+
+class QuantizedIndex:
+    """
+    Drop-in for LocalIndex (same `query` / `query_many` / `ids` interface) that scans
+    compressed vectors and re-scores the best candidates against `full_vectors`.
+    """
+
+    def __init__(self, ids, codes, full_vectors, scales=None, projection=None, storage="float16",
+                 reduction=None, rescore=RESCORE_FACTOR):
+        if len(ids) != len(codes) or len(ids) != len(full_vectors):
+            raise ValueError(f"Got {len(ids)} ids for {len(codes)} codes and {len(full_vectors)} vectors.")
+        self.ids = list(ids)
+        self.codes = codes
+        self.scales = scales
+        self.projection = projection
+        self.full_vectors = full_vectors
+        self.storage = storage
+        self.reduction = reduction
+        self.rescore = rescore
+        self.recall = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def dimension(self):
+        return self.full_vectors.shape[1]
+
+    @property
+    def nbytes(self):
+        """Bytes scanned per query."""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    @classmethod
+    def build(cls, local_index, storage="int8", dimension=0, reduction="pca", rescore=RESCORE_FACTOR):
+        """
+        Compresses a LocalIndex. `dimension` 0 (or >= the original) skips reduction.
+        """
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"Unknown storage mode '{storage}'. Supported: {', '.join(STORAGE_MODES)}.")
+        vectors = local_index.vectors
+        projection = None
+        if dimension and dimension < vectors.shape[1]:
+            if reduction not in REDUCTIONS:
+                raise ValueError(f"Unknown reduction '{reduction}'. Supported: {', '.join(REDUCTIONS)}.")
+            projection = fit_projection(vectors, dimension, reduction)
+            vectors = np.asarray(vectors, dtype=np.float32) @ projection.T
+        else:
+            reduction = None
+        codes, scales = quantize(vectors, storage)
+        return cls(local_index.ids, codes, local_index.vectors, scales, projection, storage, reduction, rescore)
+
+    def approximate_scores(self, queries):
+        """
+        Scores normalised queries (rows) against the compressed vectors, one block of
+        rows at a time.
+        """
+        if self.projection is not None:
+            queries = queries @ self.projection.T
+        scores = np.empty((len(queries), len(self.codes)), dtype=np.float32)
+        block_rows = scan_block_rows(self.codes.shape[1])
+        for start in range(0, len(self.codes), block_rows):
+            block = self.codes[start:start + block_rows].astype(np.float32)
+            scores[:, start:start + len(block)] = queries @ block.T
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def _rescored_matches(self, query, approximate, top_k, mask=None):
+        candidates = top_rows(approximate, max(top_k * self.rescore, top_k), mask)
+        candidates.sort()  # sequential reads from the memory-mapped matrix
+        exact = np.asarray(self.full_vectors[candidates], dtype=np.float32) @ query
+        best = top_rows(exact, top_k)
+        return [{"id": self.ids[candidates[i]], "score": float(exact[i])} for i in best]
+
+    def query(self, vector, top_k=10, include_metadata=False, mask=None, **kwargs):
+        return self.query_many([vector], top_k, mask)[0]
+
+    def query_many(self, vectors, top_k=10, mask=None):
+        queries = normalize_rows(np.atleast_2d(np.asarray(vectors, dtype=np.float32)))
+        approximate = self.approximate_scores(queries)
+        return [{"matches": self._rescored_matches(query, row, top_k, mask)}
+                for query, row in zip(queries, approximate)]
+
+    def save(self, path: Path = QUANTIZED_PATH, source=None):
+        """
+        Writes the compressed arrays and a meta.json as a new version of the `path`
+        directory (see artifact.write_versioned), so workers that memory-map the
+        previous version are never handed a half-written one. `source` identifies the
+        float32 files it was built from.
+        """
+        meta = {
+            "storage": self.storage,
+            "reduction": self.reduction,
+            "dimension": int(self.codes.shape[1]),
+            "rescore": self.rescore,
+            "recall": self.recall,
+            "source": source,
+        }
+
+        def write(directory):
+            np.save(directory / "codes.npy", self.codes)
+            if self.scales is not None:
+                np.save(directory / "scales.npy", self.scales)
+            if self.projection is not None:
+                np.save(directory / "projection.npy", self.projection)
+            with (directory / "meta.json").open("w", encoding="utf-8") as f:
+                json.dump(meta, f, indent=2)
+
+        return write_versioned(path, write)
+
+    @classmethod
+    def load(cls, path: Path = QUANTIZED_PATH, vectors_path: Path = VECTORS_PATH, ids_path: Path = IDS_PATH):
+        """
+        Loads an index written by `save`. Everything is memory-mapped read-only.
+        Returns (index, meta).
+        """
+        path = version_path(path)
+        with (path / "meta.json").open("r", encoding="utf-8") as f:
+            meta = json.load(f)
+        local_index = LocalIndex.load(vectors_path, ids_path)
+        scales = np.load(path / "scales.npy", mmap_mode="r") if meta["storage"] == "int8" else None
+        projection = np.load(path / "projection.npy") if meta["reduction"] else None
+        index = cls(local_index.ids, np.load(path / "codes.npy", mmap_mode="r"), local_index.vectors,
+                    scales, projection, meta["storage"], meta["reduction"], meta["rescore"])
+        index.recall = meta["recall"]
+        return index, meta
+
+
+def source_stamps(vectors_path=VECTORS_PATH, ids_path=IDS_PATH):
+    return {"vectors": source_stamp(vectors_path), "ids": source_stamp(ids_path)}
+
+
+def report_recall(index, local_index, k=RECALL_K):
+    """
+    Measures recall@k of `index` against exact search, with and without re-scoring,
+    stores it on the index and prints it.
+    """
+    queries = recall_queries(local_index)
+    rescore = index.rescore
+    index.rescore = 1
+    without_rescore = measure_recall(index, local_index, queries, k)
+    index.rescore = rescore
+    index.recall = {"k": k, "rescored": measure_recall(index, local_index, queries, k),
+                    "compressed_only": without_rescore}
+    print(f"recall@{k}: {index.recall['rescored']} with float32 re-scoring of {rescore}x candidates, "
+          f"{without_rescore} from the compressed scan alone.")
+    return index.recall
+
+
+def load_matching(storage, dimension=0, reduction="pca", path=QUANTIZED_PATH,
+                  vectors_path=VECTORS_PATH, ids_path=IDS_PATH):
+    """
+    Loads the compressed index if one was built with the requested settings from the
+    current float32 files, else returns None.
+    """
+    if not (version_path(path) / "meta.json").exists():
+        return None
+    index, meta = QuantizedIndex.load(path, vectors_path, ids_path)
+    requested_dimension = dimension or None
+    built_dimension = meta["dimension"] if meta["reduction"] else None
+    if (meta["source"] == source_stamps(vectors_path, ids_path) and meta["storage"] == storage
+            and built_dimension == requested_dimension
+            and (not requested_dimension or meta["reduction"] == reduction)):
+        return index
+    return None
+
+
+def load_or_build(storage, dimension=0, reduction="pca", path=QUANTIZED_PATH,
+                  vectors_path=VECTORS_PATH, ids_path=IDS_PATH):
+    """
+    Loads the compressed index if it matches the requested settings and the current
+    float32 files; otherwise builds (reporting recall) and saves it.
+    """
+    index = load_matching(storage, dimension, reduction, path, vectors_path, ids_path)
+    if index is not None:
+        return index
+
+    stamps = source_stamps(vectors_path, ids_path)
+    local_index = LocalIndex.load(vectors_path, ids_path)
+    index = QuantizedIndex.build(local_index, storage, dimension, reduction)
+    report_recall(index, local_index)
+    index.save(path, source=stamps)
+    print(f"Saved {storage} index ({index.nbytes} bytes scanned per query, "
+          f"{local_index.vectors.nbytes} at float32) to {path}")
+    return QuantizedIndex.load(path, vectors_path, ids_path)[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a compressed copy of the local index.")
+    parser.add_argument("--storage", choices=STORAGE_MODES, default="int8")
+    parser.add_argument("--dimension", type=int, default=0, help="Reduce to this many dimensions (0 keeps all).")
+    parser.add_argument("--reduction", choices=REDUCTIONS, default="pca")
+    parser.add_argument("--rescore", type=int, default=RESCORE_FACTOR,
+                        help="Candidates re-scored in float32, as a multiple of top_k.")
+    parser.add_argument("--output", type=Path, default=QUANTIZED_PATH)
+    args = parser.parse_args()
+
+    local_index = LocalIndex.load()
+    index = QuantizedIndex.build(local_index, args.storage, args.dimension, args.reduction, args.rescore)
+    report_recall(index, local_index)
+    index.save(args.output, source=source_stamps())
+    print(f"Saved {len(index)} vectors to {args.output}: {index.nbytes} bytes scanned per query "
+          f"({local_index.vectors.nbytes} at float32).")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+import time
+import random
+import threading
+
+
+def is_rate_limited(error):
+    """
+    Whether an exception from an API client means "429 / quota exhausted". Clients wrap
+    these differently, so the status code, the exception type and the message are checked.
+    """
+    for attribute in ("code", "status_code", "status"):
+        value = getattr(error, attribute, None)
+        if value == 429:
+            return True
+    response = getattr(error, "response", None)
+    if getattr(response, "status_code", None) == 429:
+        return True
+    text = f"{type(error).__name__} {error}".lower()
+    return any(marker in text for marker in ("429", "resourceexhausted", "resource_exhausted", "rate limit", "quota"))
+
+
+class RateLimiter:
+    """
+    Client-side requests-per-minute and tokens-per-minute budget shared by threads.
+
+    Both budgets are token buckets that refill continuously and hold at most one
+    minute's worth. `acquire(tokens)` blocks until a call of that size fits. After a
+    429, `throttled()` halves the rate (down to `min_fraction` of the budget) and
+    pauses every caller for an exponential, jittered backoff; each success afterwards
+    (`succeeded()`) wins back `recovery` of the budget, so the limiter settles just
+    below whatever rate the server actually allows.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute=None, min_fraction=0.05, recovery=0.05,
+                 base_backoff=1.0, max_backoff=60.0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_fraction = min_fraction
+        self.recovery = recovery
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.fraction = 1.0
+        self.throttles = 0
+        self._consecutive_throttles = 0
+        self._paused_until = 0.0
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute * self.fraction,
+                             self._requests + elapsed * self.requests_per_minute * self.fraction / 60)
+        if self.tokens_per_minute:
+            self._tokens = min(self.tokens_per_minute * self.fraction,
+                               self._tokens + elapsed * self.tokens_per_minute * self.fraction / 60)
+
+    def acquire(self, tokens=0):
+        """
+        Blocks until one request of `tokens` tokens fits in both budgets, then spends it.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = self._paused_until - now
+                if wait <= 0:
+                    request_capacity = self.requests_per_minute * self.fraction
+                    wait = (1 - self._requests) * 60 / request_capacity if self._requests < 1 else 0.0
+                    if self.tokens_per_minute:
+                        token_capacity = self.tokens_per_minute * self.fraction
+                        # A call larger than the whole bucket goes through once it is full.
+                        needed = min(tokens, token_capacity)
+                        if self._tokens < needed:
+                            wait = max(wait, (needed - self._tokens) * 60 / token_capacity)
+                    if wait <= 0:
+                        self._requests -= 1
+                        self._tokens -= tokens
+                        return
+            time.sleep(wait)
+
+    def throttled(self, retry_after=None):
+        """
+        Records a 429: lowers the rate and pauses all callers. Returns the pause in seconds.
+        """
+        with self._lock:
+            self.throttles += 1
+            self._consecutive_throttles += 1
+            self.fraction = max(self.min_fraction, self.fraction / 2)
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (self._consecutive_throttles - 1))
+            backoff = retry_after if retry_after is not None else backoff * random.uniform(0.5, 1.0)
+            self._paused_until = max(self._paused_until, time.monotonic() + backoff)
+            return backoff
+
+    def succeeded(self):
+        with self._lock:
+            self._consecutive_throttles = 0
+            self.fraction = min(1.0, self.fraction + self.recovery)
+
+    def call(self, func, tokens=0, max_retries=8):
+        """
+        Runs `func()` within the budget, retrying on rate-limit errors.
+        """
+        for attempt in range(max_retries + 1):
+            self.acquire(tokens)
+            try:
+                result = func()
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == max_retries:
+                    raise
+                pause = self.throttled()
+                print(f"Rate limited ({type(e).__name__}); backing off {pause:.1f}s at "
+                      f"{self.fraction:.0%} of the configured rate.")
+                continue
+            self.succeeded()
+            return result
@@ -0,0 +1,123 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class _Flight:
+    """A computation in progress that other callers with the same key can wait on."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ResponseCache:
+    """
+    Caches serialized responses by key, with LRU eviction past `max_size` entries and
+    expiry `ttl` seconds after an entry was stored.
+
+    `version` is a callable returning a token for the data the responses were built
+    from (catalog file, index version, ...). Whenever the token changes, every entry
+    is dropped. Concurrent `get_or_compute` calls for a key that is not cached are
+    coalesced: one caller computes, the others wait for its result. Only callers that
+    saw the same version share a computation, and its result is stored only if the
+    version has not changed meanwhile, so a result built from replaced data is never
+    served to later callers.
+    """
+
+    def __init__(self, max_size=1000, ttl=300, version=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = version
+        self._entries = OrderedDict()
+        self._flights = {}
+        self._lock = threading.Lock()
+        self._current_version = version() if version else None
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get_or_compute(self, key, compute, cacheable=lambda result: True):
+        """
+        Returns the cached value for `key`, or the result of `compute()`. The result is
+        stored only if `cacheable(result)` is true; exceptions are never cached but are
+        raised in every caller that was waiting on the same computation.
+        """
+        with self._lock:
+            version = self._check_version()
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, created = entry
+                if time.monotonic() - created < self.ttl:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+            flight_key = (version, key)
+            flight = self._flights.get(flight_key)
+            if flight is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                flight = self._flights[flight_key] = _Flight()
+                self.misses += 1
+                leader = True
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = compute()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[flight_key]
+                # A reload during compute() may have replaced the data it read.
+                if flight.error is None and self._check_version() == version and cacheable(flight.result):
+                    self._entries[key] = (flight.result, time.monotonic())
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.max_size:
+                        self._entries.popitem(last=False)
+                        self.evictions += 1
+            flight.done.set()
+        return flight.result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_ratio": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            }
+
+    def _check_version(self):
+        """
+        Drops every entry if the data version changed. Returns the current version.
+        """
+        if self.version is None:
+            return None
+        version = self.version()
+        if version != self._current_version:
+            self._current_version = version
+            self._entries.clear()
+            self.invalidations += 1
+        return version